@@ -13,4 +13,5 @@
 #cmakedefine HAS_GET_TIME
 #cmakedefine HAS_PUT_TIME
 #cmakedefine DEBUG_SQL_QUERIES
+#cmakedefine MIN_LOG_LEVEL ${MIN_LOG_LEVEL}
 
@@ -5,6 +5,7 @@
 #include <utils/empty_if_fixed_server.hpp>
 #include <utils/encoding.hpp>
 #include <utils/tolower.hpp>
+#include <utils/timed_events.hpp>
 #include <utils/uuid.hpp>
 #include <logger/logger.hpp>
 #include <utils/revstr.hpp>
@@ -42,6 +43,13 @@ Bridge::Bridge(std::string user_jid, BiboumiComponent& xmpp, std::shared_ptr<Pol
 #endif
 }
 
+Bridge::~Bridge()
+{
+  this->xmpp.get_channel_list_cache().abort_fetches(this);
+  for (const auto& pair: this->waiting_irc)
+    TimedEventsManager::instance().cancel(this->waiting_irc_event_name(pair.first));
+}
+
 /**
  * Return the role and affiliation, corresponding to the given irc mode
  */
@@ -71,29 +79,57 @@ void Bridge::shutdown(const std::string& exit_message)
 void Bridge::remove_resource(const std::string& resource,
                              const std::string& part_message)
 {
-  const auto resources_in_chan_copy = this->resources_in_chan;
-  for (const auto& chan_pair: resources_in_chan_copy)
-  {
-    const ChannelKey& channel_key = chan_pair.first;
-    const std::set<Resource>& resources = chan_pair.second;
-    if (resources.count(resource))
-      this->leave_irc_channel({std::get<0>(channel_key), std::get<1>(channel_key), {}},
-                              part_message, resource);
-  }
+  const auto it = this->channels_of_resource.find(resource);
+  if (it == this->channels_of_resource.end())
+    return;
+  // leave_irc_channel() removes the channels from that set
+  const auto channels = it->second;
+  for (const ChannelKey& channel_key: channels)
+    this->leave_irc_channel({std::get<0>(channel_key), std::get<1>(channel_key), {}},
+                            part_message, resource);
 }
 
-void Bridge::clean()
+static bool is_inactive(const IrcClient& client)
 {
-  auto it = this->irc_clients.begin();
-  while (it != this->irc_clients.end())
-  {
-    IrcClient* client = it->second.get();
-    if (!client->is_connected() && !client->is_connecting() &&
-        !client->get_resolver().is_resolving())
-      it = this->irc_clients.erase(it);
-    else
-      ++it;
-  }
+  return !client.is_connected() && !client.is_connecting() &&
+      !client.get_resolver().is_resolving();
+}
+
+void Bridge::clean(const bool all)
+{
+  if (all)
+    {
+      auto it = this->irc_clients.begin();
+      while (it != this->irc_clients.end())
+      {
+        if (is_inactive(*it->second))
+          {
+            this->cancel_waiting_irc(it->first);
+            it = this->irc_clients.erase(it);
+          }
+        else
+          ++it;
+      }
+      this->dirty_irc_clients.clear();
+      return;
+    }
+  const auto dirty = std::move(this->dirty_irc_clients);
+  this->dirty_irc_clients.clear();
+  for (const std::string& hostname: dirty)
+    {
+      const auto it = this->irc_clients.find(hostname);
+      if (it != this->irc_clients.end() && is_inactive(*it->second))
+        {
+          this->cancel_waiting_irc(hostname);
+          this->irc_clients.erase(it);
+        }
+    }
+}
+
+void Bridge::mark_irc_client_dirty(const std::string& hostname)
+{
+  this->dirty_irc_clients.insert(hostname);
+  this->xmpp.mark_bridge_dirty(this->user_jid);
 }
 
 const std::string& Bridge::get_jid() const
@@ -119,11 +155,10 @@ Xmpp::body Bridge::make_xmpp_body(const std::string& str, const std::string& enc
 
 IrcClient* Bridge::make_irc_client(const std::string& hostname, const std::string& nickname)
 {
-  try
-    {
-      return this->irc_clients.at(hostname).get();
-    }
-  catch (const std::out_of_range& exception)
+  const auto it = this->irc_clients.find(hostname);
+  if (it != this->irc_clients.end())
+    return it->second.get();
+  else
     {
       auto username = nickname;
       auto realname = nickname;
@@ -133,38 +168,32 @@ IrcClient* Bridge::make_irc_client(const std::string& hostname, const std::strin
           username = jid.local;
           realname = this->get_bare_jid();
         }
-      this->irc_clients.emplace(hostname,
-                                std::make_shared<IrcClient>(this->poller, hostname,
-                                                            nickname, username,
-                                                            realname, jid.domain,
-                                                            *this));
-      std::shared_ptr<IrcClient> irc = this->irc_clients.at(hostname);
-      return irc.get();
+      const auto inserted = this->irc_clients.emplace(hostname,
+                                                      std::make_shared<IrcClient>(this->poller, hostname,
+                                                                                  nickname, username,
+                                                                                  realname, jid.domain,
+                                                                                  *this));
+      // If it never manages to connect, nothing else will tell us to
+      // remove it
+      this->mark_irc_client_dirty(hostname);
+      return inserted.first->second.get();
     }
 }
 
 IrcClient* Bridge::get_irc_client(const std::string& hostname)
 {
-  try
-    {
-      return this->irc_clients.at(hostname).get();
-    }
-  catch (const std::out_of_range& exception)
-    {
-      throw IRCNotConnected(hostname);
-    }
+  const auto it = this->irc_clients.find(hostname);
+  if (it == this->irc_clients.end())
+    throw IRCNotConnected(hostname);
+  return it->second.get();
 }
 
 IrcClient* Bridge::find_irc_client(const std::string& hostname) const
 {
-  try
-    {
-      return this->irc_clients.at(hostname).get();
-    }
-  catch (const std::out_of_range& exception)
-    {
-      return nullptr;
-    }
+  const auto it = this->irc_clients.find(hostname);
+  if (it == this->irc_clients.end())
+    return nullptr;
+  return it->second.get();
 }
 
 bool Bridge::join_irc_channel(const Iid& iid, std::string nickname,
@@ -221,6 +250,37 @@ void Bridge::send_channel_message(const Iid& iid, const std::string& body, std::
   std::vector<std::string> lines = utils::split(body, '\n', true);
   if (lines.empty())
     return ;
+
+  // If the server supports it, the lines are instead sent together, as one
+  // multiline message, unless some of them are commands
+  lines.erase(std::remove(lines.begin(), lines.end(), std::string{}), lines.end());
+  if (lines.size() > 1 &&
+      std::none_of(lines.begin(), lines.end(), [](const std::string& line) {
+        return line.substr(0, 5) == "/mode" || line.substr(0, 4) == "/me ";
+      }) &&
+      irc->can_send_multiline_message(iid.get_local(), lines))
+    {
+      std::string text;
+      for (const std::string& line: lines)
+        text += (text.empty() ? "" : "\n") + line;
+      std::string uuid;
+#ifdef USE_DATABASE
+      const auto xmpp_body = this->make_xmpp_body(text);
+      if (this->record_history)
+        uuid = Database::store_muc_message(this->get_bare_jid(), iid.get_local(), iid.get_server(), std::chrono::system_clock::now(),
+                                    std::get<0>(xmpp_body), irc->get_own_nick());
+#endif
+      if (id.empty())
+        id = utils::gen_uuid();
+      MessageCallback mirror_to_all_resources = [this, iid, uuid, id, text](const IrcClient* irc, const IrcMessage&) {
+        for (const auto& resource: this->resources_in_chan[iid.to_tuple()])
+          this->xmpp.send_muc_message(std::to_string(iid), irc->get_own_nick(), this->make_xmpp_body(text),
+                                      this->user_jid + "/" + resource, uuid, id);
+      };
+      irc->send_channel_multiline_message(iid.get_local(), lines, std::move(mirror_to_all_resources));
+      return;
+    }
+
   bool first = true;
   for (const std::string& line: lines)
     {
@@ -268,7 +328,7 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
   IrcChannel* chan = irc->get_channel(iid.get_local());
   if (!chan || !chan->joined)
     return;
-  IrcUser* user = chan->find_user(nick);
+  const IrcChannelUser* user = chan->find_user(nick);
   if (!user)
     {
       this->xmpp.send_stanza_error("iq", from, std::to_string(iid), id, "cancel",
@@ -316,7 +376,7 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
   else
     return;
   for (const char mode: modes_to_remove)
-    if (user->modes.find(mode) != user->modes.end())
+    if (user->modes.has(mode, irc->get_user_mode_ranks()))
       {
         modes += "-"s + mode;
         nb++;
@@ -327,19 +387,19 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
   args.insert(args.begin(), modes);
   irc->send_mode_command(iid.get_local(), args);
 
-  irc_responder_callback_t cb = [this, iid, irc, id, from, nick](const std::string& irc_hostname, const IrcMessage& message) -> bool
+  irc_responder_callback_t cb = [this, iid, irc, id, from, nick](const std::string& irc_hostname, const IrcMessage& message) -> IrcResponse
   {
     if (irc_hostname != iid.get_server())
-      return false;
+      return IrcResponse::ignored;
 
     if (message.command == "MODE" && message.arguments.size() >= 2)
       {
         const std::string& chan_name = message.arguments[0];
         if (chan_name != iid.get_local())
-          return false;
+          return IrcResponse::ignored;
         const std::string actor_nick = IrcUser{message.prefix}.nick;
         if (!irc || irc->get_own_nick() != actor_nick)
-          return false;
+          return IrcResponse::ignored;
 
         this->xmpp.send_iq_result(id, from, std::to_string(iid));
       }
@@ -347,7 +407,7 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
         {
           const std::string target_later = message.arguments[1];
           if (target_later != nick)
-            return false;
+            return IrcResponse::ignored;
           std::string error_message = "No such nick";
           if (message.arguments.size() >= 3)
             error_message = message.arguments[2];
@@ -358,7 +418,7 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
       {
         const std::string chan_name_later = utils::tolower(message.arguments[1]);
         if (chan_name_later != iid.get_local())
-          return false;
+          return IrcResponse::ignored;
         std::string error_message = "You're not channel operator";
         if (message.arguments.size() >= 3)
           error_message = message.arguments[2];
@@ -373,9 +433,14 @@ void Bridge::forward_affiliation_role_change(const Iid& iid, const std::string&
           this->xmpp.send_stanza_error("iq", from, std::to_string(iid), id, "cancel", "not-allowed",
                                         error_message, false);
       }
-    return true;
+    return IrcResponse::done;
   };
-  this->add_waiting_irc(std::move(cb));
+  this->add_waiting_irc(iid.get_server(), {"MODE", "401", "482", "472"}, std::move(cb),
+                        [this, iid, id, from]()
+                        {
+                          this->xmpp.send_stanza_error("iq", from, std::to_string(iid), id, "wait",
+                                                       "remote-server-timeout", "", false);
+                        });
 }
 
 void Bridge::send_private_message(const Iid& iid, const std::string& body, const std::string& type)
@@ -470,163 +535,111 @@ void Bridge::send_irc_nick_change(const Iid& iid, const std::string& new_nick, c
   irc->send_nick_command(new_nick);
 }
 
-void Bridge::send_irc_channel_list_request(const Iid& iid, const std::string& iq_id, const std::string& to_jid,
-                                           ResultSetInfo rs_info)
+void Bridge::request_channel_list(const Iid& iid, const bool first_page)
 {
-  auto& list = this->channel_list_cache[iid.get_server()];
+  auto& cache = this->xmpp.get_channel_list_cache();
+  const std::string& irc_hostname = iid.get_server();
+  static const std::vector<std::string> list_commands{"263", "RPL_TRYAGAIN", "ERR_TOOMANYMATCHES",
+                                                      "ERR_NOSUCHSERVER", "322", "RPL_LIST",
+                                                      "323", "RPL_LISTEND"};
 
-  // We fetch the list from the IRC server only if we have a complete
-  // cached list that needs to be invalidated (that is, when the request
-  // doesn’t have a after or before, or when the list is empty).
-  // If the list is not complete, this means that a request is already
-  // ongoing, so we just need to add the callback.
-  // By default the list is complete and empty.
-  if (list.complete &&
-      (list.channels.empty() || (rs_info.after.empty() && rs_info.before.empty())))
+  // The list is shared by all the users.  We fetch it from the IRC server
+  // only if no request is already ongoing for that server, and if the
+  // cached list has never been fetched, or is expired and the request
+  // doesn’t have a after or before.
+  if (!cache.needs_fetch(irc_hostname, first_page))
+    return;
+  // Throws if we are not connected to that server: the list must not be
+  // marked as being fetched by us in that case, the other users would wait
+  // for it forever
+  IrcClient* irc = this->get_irc_client(irc_hostname);
+  if (cache.start_fetch(irc_hostname, this, first_page))
     {
-      IrcClient* irc = this->get_irc_client(iid.get_server());
       irc->send_list_command();
 
-      // Add a callback that will populate our list
-      list.channels.clear();
-      list.complete = false;
+      // Add a callback that will populate the list
       irc_responder_callback_t cb = [this, iid](const std::string& irc_hostname,
-                                                const IrcMessage& message) -> bool
+                                                const IrcMessage& message) -> IrcResponse
       {
-        if (irc_hostname != iid.get_server())
-          return false;
-
-        auto& list = this->channel_list_cache[iid.get_server()];
+        auto& cache = this->xmpp.get_channel_list_cache();
 
         if (message.command == "263" || message.command == "RPL_TRYAGAIN" || message.command == "ERR_TOOMANYMATCHES"
             || message.command == "ERR_NOSUCHSERVER")
           {
-            list.complete = true;
-            return true;
+            std::string text;
+            if (message.arguments.size() >= 2)
+              text = message.arguments[1];
+            cache.fail(irc_hostname, text);
+            return IrcResponse::done;
           }
         else if (message.command == "322" || message.command == "RPL_LIST")
           { // Add element to list
             if (message.arguments.size() == 4)
               {
-                list.channels.emplace_back(message.arguments[1] + utils::empty_if_fixed_server("%" + iid.get_server()),
-                                           message.arguments[2], message.arguments[3]);
+                cache.add(irc_hostname, {message.arguments[1] + utils::empty_if_fixed_server("%" + iid.get_server()),
+                                         message.arguments[2], message.arguments[3]});
               }
-            return false;
+            return IrcResponse::partial;
           }
         else if (message.command == "323" || message.command == "RPL_LISTEND")
-          { // Send the iq response with the content of the list
-            list.complete = true;
-            return true;
-          }
-        return false;
-      };
-
-      this->add_waiting_irc(std::move(cb));
-    }
-
-  // If the list is complete, we immediately send the answer.
-  // Otherwise, we install a callback, that will populate our list and send
-  // the answer when we can.
-  if (list.complete)
-    {
-      this->send_matching_channel_list(list, rs_info, iq_id, to_jid, std::to_string(iid));
-    }
-  else
-    {
-      // Add a callback to answer the request as soon as we can
-      irc_responder_callback_t cb = [this, iid, iq_id, to_jid,
-                                     rs_info=std::move(rs_info)](const std::string& irc_hostname,
-                                                                 const IrcMessage& message) -> bool
-      {
-        if (irc_hostname != iid.get_server())
-          return false;
-
-        if (message.command == "263" || message.command == "RPL_TRYAGAIN" || message.command == "ERR_TOOMANYMATCHES"
-            || message.command == "ERR_NOSUCHSERVER")
           {
-            std::string text;
-            if (message.arguments.size() >= 2)
-              text = message.arguments[1];
-            this->xmpp.send_stanza_error("iq", to_jid, std::to_string(iid), iq_id, "wait", "service-unavailable", text, false);
-            return true;
+            cache.complete(irc_hostname);
+            return IrcResponse::done;
           }
-        else if (message.command == "322" || message.command == "RPL_LIST")
-          {
-            auto& list = channel_list_cache[iid.get_server()];
-            const auto res = this->send_matching_channel_list(list, rs_info, iq_id, to_jid, std::to_string(iid));
-            return res;
-          }
-        else if (message.command == "323" || message.command == "RPL_LISTEND")
-          { // Send the iq response with the content of the list
-            auto& list = channel_list_cache[iid.get_server()];
-            this->send_matching_channel_list(list, rs_info, iq_id, to_jid, std::to_string(iid));
-            return true;
-          }
-        return false;
+        return IrcResponse::ignored;
       };
 
-      this->add_waiting_irc(std::move(cb));
+      this->add_waiting_irc(irc_hostname, list_commands, std::move(cb),
+                            [this, irc_hostname]()
+                            {
+                              this->xmpp.get_channel_list_cache().fail(irc_hostname, "");
+                            });
     }
 }
 
-bool Bridge::send_matching_channel_list(const ChannelList& channel_list, const ResultSetInfo& rs_info,
-                                        const std::string& id, const std::string& to_jid, const std::string& from)
+void Bridge::send_irc_channel_list_request(const Iid& iid, const std::string& iq_id, const std::string& to_jid,
+                                           ResultSetInfo rs_info)
 {
-  auto begin = channel_list.channels.begin();
-  auto end = channel_list.channels.end();
-  if (channel_list.complete)
-    {
-      begin = std::find_if(channel_list.channels.begin(), channel_list.channels.end(), [this, &rs_info](const ListElement& element)
+  this->request_channel_list(iid, rs_info.after.empty() && rs_info.before.empty());
+
+  // Answer as soon as the list contains what is needed, or is complete.
+  // The waiter may outlive this bridge, so it only uses the component.
+  BiboumiComponent& xmpp = this->xmpp;
+  xmpp.get_channel_list_cache().add_waiter(iid.get_server(), [&xmpp, from=std::to_string(iid), iq_id, to_jid,
+                                                              rs_info=std::move(rs_info)](const ChannelList& list) -> bool
+  {
+    if (list.failed)
       {
-        return rs_info.after == element.channel + "@" + this->xmpp.get_served_hostname();
-      });
-      if (begin == channel_list.channels.end())
-        begin = channel_list.channels.begin();
-      else
-        begin = std::next(begin);
-      end = std::find_if(channel_list.channels.begin(), channel_list.channels.end(), [this, &rs_info](const ListElement& element)
+        xmpp.send_stanza_error("iq", to_jid, from, iq_id, "wait", "service-unavailable", list.error, false);
+        return true;
+      }
+    return xmpp.send_matching_channel_list(list, rs_info, iq_id, to_jid, from);
+  });
+}
+
+void Bridge::send_irc_channel_search(const Iid& iid, const std::string& iq_id, const std::string& to_jid,
+                                     const std::string& text, const ChannelDirectory::Order order,
+                                     const std::size_t max)
+{
+  this->request_channel_list(iid, true);
+
+  // The search needs the whole list
+  BiboumiComponent& xmpp = this->xmpp;
+  const std::string irc_hostname = iid.get_server();
+  xmpp.get_channel_list_cache().add_waiter(irc_hostname, [&xmpp, irc_hostname, from=std::to_string(iid), iq_id,
+                                                          to_jid, text, order, max](const ChannelList& list) -> bool
+  {
+    if (!list.complete)
+      return false;
+    if (list.failed)
       {
-        return rs_info.before == element.channel + "@" + this->xmpp.get_served_hostname();
-      });
-      if (rs_info.max >= 0)
-        {
-          if (std::distance(begin, end) >= rs_info.max)
-            end = begin + rs_info.max;
-        }
-    }
-  else
-    {
-      if (rs_info.after.empty() && rs_info.before.empty() && rs_info.max < 0)
-        return false;
-      if (!rs_info.after.empty())
-        {
-          begin = std::find_if(channel_list.channels.begin(), channel_list.channels.end(), [this, &rs_info](const ListElement& element)
-          {
-            return rs_info.after == element.channel + "@" + this->xmpp.get_served_hostname();
-          });
-          if (begin == channel_list.channels.end())
-            return false;
-          begin = std::next(begin);
-        }
-        if (!rs_info.before.empty())
-        {
-          end = std::find_if(channel_list.channels.begin(), channel_list.channels.end(), [this, &rs_info](const ListElement& element)
-          {
-            return rs_info.before == element.channel + "@" + this->xmpp.get_served_hostname();
-          });
-          if (end == channel_list.channels.end())
-            return false;
-        }
-      if (rs_info.max >= 0)
-        {
-          if (std::distance(begin, end) < rs_info.max)
-            return false;
-          else
-            end = begin + rs_info.max;
-        }
-    }
-  this->xmpp.send_iq_room_list_result(id, to_jid, from, channel_list, begin, end, rs_info);
-  return true;
+        xmpp.send_stanza_error("iq", to_jid, from, iq_id, "wait", "service-unavailable", list.error, false);
+        return true;
+      }
+    const auto& directory = xmpp.get_channel_list_cache().get_directory(irc_hostname);
+    xmpp.send_channel_search_result(iq_id, to_jid, from, list, directory.search(text, order), max);
+    return true;
+  });
 }
 
 void Bridge::send_irc_kick(const Iid& iid, const std::string& target, const std::string& reason,
@@ -636,23 +649,23 @@ void Bridge::send_irc_kick(const Iid& iid, const std::string& target, const std:
 
   irc->send_kick_command(iid.get_local(), target, reason);
   irc_responder_callback_t cb = [this, target, iq_id, to_jid, iid](const std::string& irc_hostname,
-                                                                   const IrcMessage& message) -> bool
+                                                                   const IrcMessage& message) -> IrcResponse
     {
       if (irc_hostname != iid.get_server())
-        return false;
+        return IrcResponse::ignored;
       if (message.command == "KICK" && message.arguments.size() >= 2)
         {
           const std::string target_later = message.arguments[1];
           const std::string chan_name_later = utils::tolower(message.arguments[0]);
           if (target_later != target || chan_name_later != iid.get_local())
-            return false;
+            return IrcResponse::ignored;
           this->xmpp.send_iq_result(iq_id, to_jid, std::to_string(iid));
         }
       else if (message.command == "401" && message.arguments.size() >= 2)
         {
           const std::string target_later = message.arguments[1];
           if (target_later != target)
-            return false;
+            return IrcResponse::ignored;
           std::string error_message = "No such nick";
           if (message.arguments.size() >= 3)
             error_message = message.arguments[2];
@@ -663,16 +676,21 @@ void Bridge::send_irc_kick(const Iid& iid, const std::string& target, const std:
         {
           const std::string chan_name_later = utils::tolower(message.arguments[1]);
           if (chan_name_later != iid.get_local())
-            return false;
+            return IrcResponse::ignored;
           std::string error_message = "You're not channel operator";
           if (message.arguments.size() >= 3)
             error_message = message.arguments[2];
           this->xmpp.send_stanza_error("iq", to_jid, std::to_string(iid), iq_id, "cancel", "not-allowed",
                                         error_message, false);
         }
-      return true;
+      return IrcResponse::done;
     };
-  this->add_waiting_irc(std::move(cb));
+  this->add_waiting_irc(iid.get_server(), {"KICK", "401", "482"}, std::move(cb),
+                        [this, iid, iq_id, to_jid]()
+                        {
+                          this->xmpp.send_stanza_error("iq", to_jid, std::to_string(iid), iq_id, "wait",
+                                                       "remote-server-timeout", "", false);
+                        });
 }
 
 void Bridge::set_channel_topic(const Iid& iid, std::string subject)
@@ -704,10 +722,10 @@ void Bridge::send_irc_user_ping_request(const std::string& irc_hostname, const s
   this->send_private_message(iid, "\01PING " + iq_id + "\01");
 
   irc_responder_callback_t cb = [this, nick=utils::tolower(nick), iq_id, to_jid, irc_hostname, from_jid]
-          (const std::string& hostname, const IrcMessage& message) -> bool
+          (const std::string& hostname, const IrcMessage& message) -> IrcResponse
     {
       if (irc_hostname != hostname || message.arguments.size() < 2)
-        return false;
+        return IrcResponse::ignored;
       IrcUser user(message.prefix);
       const std::string body = message.arguments[1];
       if (message.command == "NOTICE" && utils::tolower(user.nick) == nick
@@ -715,9 +733,9 @@ void Bridge::send_irc_user_ping_request(const std::string& irc_hostname, const s
         {
           const std::string id = body.substr(6, body.size() - 7);
           if (id != iq_id)
-            return false;
+            return IrcResponse::ignored;
           this->xmpp.send_iq_result_full_jid(iq_id, to_jid, from_jid);
-          return true;
+          return IrcResponse::done;
         }
       if (message.command == "401" && message.arguments[1] == nick)
         {
@@ -726,12 +744,17 @@ void Bridge::send_irc_user_ping_request(const std::string& irc_hostname, const s
             error_message = message.arguments[2];
           this->xmpp.send_stanza_error("iq", to_jid, from_jid, iq_id, "cancel", "service-unavailable",
                                         error_message, true);
-          return true;
+          return IrcResponse::done;
         }
 
-      return false;
+      return IrcResponse::ignored;
     };
-  this->add_waiting_irc(std::move(cb));
+  this->add_waiting_irc(irc_hostname, {"NOTICE", "401"}, std::move(cb),
+                        [this, iq_id, to_jid, from_jid]()
+                        {
+                          this->xmpp.send_stanza_error("iq", to_jid, from_jid, iq_id, "wait",
+                                                       "remote-server-timeout", "", true);
+                        });
 }
 
 void Bridge::send_irc_participant_ping_request(const Iid& iid, const std::string& nick,
@@ -747,7 +770,7 @@ void Bridge::send_irc_participant_ping_request(const Iid& iid, const std::string
                                     "", true);
       return;
     }
-  if (chan->get_self()->nick != nick && !chan->find_user(nick))
+  if (chan->get_self()->user->nick != nick && !chan->find_user(nick))
     {
       this->xmpp.send_stanza_error("iq", to_jid, from_jid, iq_id, "cancel", "item-not-found",
                                     "Recipient not in room", true);
@@ -791,13 +814,11 @@ void Bridge::send_irc_version_request(const std::string& irc_hostname, const std
 {
   Iid iid(target, irc_hostname, Iid::Type::User);
   this->send_private_message(iid, "\01VERSION\01");
-  // TODO, add a timer to remove that waiting iq if the server does not
-  // respond with a matching command before n seconds
   irc_responder_callback_t cb = [this, target, iq_id, to_jid, irc_hostname, from_jid]
-          (const std::string& hostname, const IrcMessage& message) -> bool
+          (const std::string& hostname, const IrcMessage& message) -> IrcResponse
     {
       if (irc_hostname != hostname)
-        return false;
+        return IrcResponse::ignored;
       IrcUser user(message.prefix);
       if (message.command == "NOTICE" && utils::tolower(user.nick) == utils::tolower(target) &&
           message.arguments.size() >= 2 && message.arguments[1].substr(0, 9) == "\01VERSION ")
@@ -805,7 +826,7 @@ void Bridge::send_irc_version_request(const std::string& irc_hostname, const std
           // remove the "\01VERSION " and the "\01" parts from the string
           const std::string version = message.arguments[1].substr(9, message.arguments[1].size() - 10);
           this->xmpp.send_version(iq_id, to_jid, from_jid, version);
-          return true;
+          return IrcResponse::done;
         }
       if (message.command == "401" && message.arguments.size() >= 2
           && message.arguments[1] == target)
@@ -815,11 +836,16 @@ void Bridge::send_irc_version_request(const std::string& irc_hostname, const std
             error_message = message.arguments[2];
           this->xmpp.send_stanza_error("iq", to_jid, from_jid, iq_id, "cancel", "item-not-found",
                                         error_message, true);
-          return true;
+          return IrcResponse::done;
         }
-      return false;
+      return IrcResponse::ignored;
     };
-  this->add_waiting_irc(std::move(cb));
+  this->add_waiting_irc(irc_hostname, {"NOTICE", "401"}, std::move(cb),
+                        [this, iq_id, to_jid, from_jid]()
+                        {
+                          this->xmpp.send_stanza_error("iq", to_jid, from_jid, iq_id, "wait",
+                                                       "remote-server-timeout", "", true);
+                        });
 }
 
 void Bridge::send_message(const Iid& iid, const std::string& nick, const std::string& body, const bool muc, const bool log)
@@ -869,7 +895,7 @@ void Bridge::send_presence_error(const Iid& iid, const std::string& nick,
   this->xmpp.send_presence_error(std::to_string(iid), nick, this->user_jid, type, condition, error_code, text);
 }
 
-void Bridge::send_muc_leave(const Iid& iid, const IrcUser& user,
+void Bridge::send_muc_leave(const Iid& iid, const IrcChannelUser& user,
                             const std::string& message, const bool self,
                             const bool user_requested,
                             const std::string& resource,
@@ -877,15 +903,15 @@ void Bridge::send_muc_leave(const Iid& iid, const IrcUser& user,
 {
   std::string affiliation;
   std::string role;
-  std::tie(role, affiliation) = get_role_affiliation_from_irc_mode(user.get_most_significant_mode(client->get_sorted_user_modes()));
+  std::tie(role, affiliation) = get_role_affiliation_from_irc_mode(user.get_most_significant_mode(client->get_user_mode_ranks()));
 
   if (!resource.empty())
-    this->xmpp.send_muc_leave(std::to_string(iid), user.nick, this->make_xmpp_body(message),
+    this->xmpp.send_muc_leave(std::to_string(iid), user.user->nick, this->make_xmpp_body(message),
                               this->user_jid + "/" + resource, self, user_requested, affiliation, role);
   else
     {
       for (const auto &res: this->resources_in_chan[iid.to_tuple()])
-        this->xmpp.send_muc_leave(std::to_string(iid), user.nick, this->make_xmpp_body(message),
+        this->xmpp.send_muc_leave(std::to_string(iid), user.user->nick, this->make_xmpp_body(message),
                                   this->user_jid + "/" + res, self, user_requested, affiliation, role);
       if (self)
         {
@@ -947,7 +973,7 @@ void Bridge::send_xmpp_message(const std::string& from, const std::string& autho
 void Bridge::send_user_join(const std::string& hostname, const std::string& chan_name,
                             const IrcUser* user, const char user_mode, const bool self)
 {
-  const auto resources = this->resources_in_chan[ChannelKey{chan_name, hostname}];
+  const auto& resources = this->resources_in_chan[ChannelKey{chan_name, hostname}];
   if (self && resources.empty())
     { // This was a forced join: no client ever asked to join this room,
       // but the server tells us we are in that room anyway.  XMPP can’t
@@ -1071,7 +1097,7 @@ void Bridge::send_affiliation_role_change(const Iid& iid, const std::string& tar
 
 void Bridge::send_iq_version_request(const std::string& nick, const std::string& hostname)
 {
-  const auto resources = this->resources_in_server[hostname];
+  const auto& resources = this->resources_in_server[hostname];
   if (resources.begin() != resources.end())
     this->xmpp.send_iq_version_request(utils::tolower(nick) + utils::empty_if_fixed_server("%" + hostname),
                                        this->user_jid + "/" + *resources.begin());
@@ -1084,7 +1110,7 @@ void Bridge::send_xmpp_ping_request(const std::string& nick, const std::string&
   // the same as the request iq, but we also need to get it back easily
   // (revstr again)
   // Forward to the first resource (arbitrary, based on the “order” of the std::set) only
-  const auto resources = this->resources_in_server[hostname];
+  const auto& resources = this->resources_in_server[hostname];
   if (resources.begin() != resources.end())
     this->xmpp.send_ping_request(utils::tolower(nick) + utils::empty_if_fixed_server("%" + hostname),
                                  this->user_jid + "/" + *resources.begin(), utils::revstr(id));
@@ -1103,6 +1129,7 @@ void Bridge::on_irc_client_connected(const std::string& hostname)
 
 void Bridge::on_irc_client_disconnected(const std::string& hostname)
 {
+  this->cancel_waiting_irc(hostname);
   this->xmpp.on_irc_client_disconnected(hostname, this->user_jid);
 }
 
@@ -1134,21 +1161,122 @@ void Bridge::remove_all_preferred_from_jid_of_room(const std::string& channel_na
     }
 }
 
-void Bridge::add_waiting_irc(irc_responder_callback_t&& callback)
+constexpr std::chrono::seconds Bridge::waiting_irc_timeout;
+
+void Bridge::add_waiting_irc(const std::string& irc_hostname, std::vector<std::string> commands,
+                             irc_responder_callback_t&& callback, irc_responder_timeout_t&& on_timeout,
+                             const std::chrono::milliseconds timeout)
 {
-  this->waiting_irc.emplace_back(std::move(callback));
+  const auto id = this->next_waiting_irc_id++;
+  auto& index = this->waiting_irc_index[irc_hostname];
+  for (const auto& command: commands)
+    index[command].push_back(id);
+  const auto deadline = std::chrono::steady_clock::now() + timeout;
+  this->waiting_irc.emplace(id, WaitingIrc{irc_hostname, std::move(commands), std::move(callback),
+                                           std::move(on_timeout), timeout, deadline});
+  TimedEventsManager::instance().add_event(TimedEvent(std::chrono::steady_clock::time_point(deadline),
+                                                      std::bind(&Bridge::on_waiting_irc_timeout, this, id),
+                                                      this->waiting_irc_event_name(id)));
 }
 
 void Bridge::trigger_on_irc_message(const std::string& irc_hostname, const IrcMessage& message)
 {
-  auto it = this->waiting_irc.begin();
-  while (it != this->waiting_irc.end())
+  const auto server_it = this->waiting_irc_index.find(irc_hostname);
+  if (server_it == this->waiting_irc_index.end())
+    return;
+  const auto command_it = server_it->second.find(message.command);
+  if (command_it == server_it->second.end())
+    return;
+  // A callback may add or remove other callbacks, so we iterate over a copy
+  const std::vector<std::size_t> ids = command_it->second;
+  for (const auto id: ids)
+    {
+      auto it = this->waiting_irc.find(id);
+      if (it == this->waiting_irc.end())
+        continue;
+      // Keep a copy, the callback may be removed while it is running
+      const auto callback = it->second.callback;
+      const auto response = callback(irc_hostname, message);
+      if (response == IrcResponse::done)
+        this->remove_waiting_irc(id);
+      else if (response == IrcResponse::partial &&
+               (it = this->waiting_irc.find(id)) != this->waiting_irc.end())
+        it->second.deadline = std::chrono::steady_clock::now() + it->second.timeout;
+    }
+}
+
+void Bridge::remove_waiting_irc(const std::size_t id)
+{
+  const auto it = this->waiting_irc.find(id);
+  if (it == this->waiting_irc.end())
+    return;
+  TimedEventsManager::instance().cancel(this->waiting_irc_event_name(id));
+  const auto server_it = this->waiting_irc_index.find(it->second.irc_hostname);
+  if (server_it != this->waiting_irc_index.end())
     {
-      if ((*it)(irc_hostname, message) == true)
-        it = this->waiting_irc.erase(it);
-      else
-        ++it;
+      for (const auto& command: it->second.commands)
+        {
+          const auto command_it = server_it->second.find(command);
+          if (command_it == server_it->second.end())
+            continue;
+          auto& ids = command_it->second;
+          ids.erase(std::remove(ids.begin(), ids.end(), id), ids.end());
+          if (ids.empty())
+            server_it->second.erase(command_it);
+        }
+      if (server_it->second.empty())
+        this->waiting_irc_index.erase(server_it);
+    }
+  this->waiting_irc.erase(it);
+}
+
+void Bridge::cancel_waiting_irc(const std::string& irc_hostname)
+{
+  const auto server_it = this->waiting_irc_index.find(irc_hostname);
+  if (server_it != this->waiting_irc_index.end())
+    {
+      std::set<std::size_t> ids;
+      for (const auto& pair: server_it->second)
+        ids.insert(pair.second.begin(), pair.second.end());
+      // No answer will ever come from that server
+      for (const auto id: ids)
+        {
+          const auto it = this->waiting_irc.find(id);
+          if (it == this->waiting_irc.end())
+            continue;
+          const auto on_timeout = std::move(it->second.on_timeout);
+          this->remove_waiting_irc(id);
+          if (on_timeout)
+            on_timeout();
+        }
+    }
+  this->xmpp.get_channel_list_cache().abort_fetch(irc_hostname, this);
+}
+
+void Bridge::on_waiting_irc_timeout(const std::size_t id)
+{
+  const auto it = this->waiting_irc.find(id);
+  if (it == this->waiting_irc.end())
+    return;
+  // A partial response pushed the deadline back: check again at that time
+  const auto deadline = it->second.deadline;
+  if (deadline > std::chrono::steady_clock::now())
+    {
+      TimedEventsManager::instance().add_event(TimedEvent(std::chrono::steady_clock::time_point(deadline),
+                                                          std::bind(&Bridge::on_waiting_irc_timeout, this, id),
+                                                          this->waiting_irc_event_name(id)));
+      return;
     }
+  log_debug("Waiting IRC callback for ", it->second.irc_hostname, " expired");
+  const auto on_timeout = std::move(it->second.on_timeout);
+  this->remove_waiting_irc(id);
+  if (on_timeout)
+    on_timeout();
+}
+
+std::string Bridge::waiting_irc_event_name(const std::size_t id) const
+{
+  return "waitingirc" + std::to_string(id) + this->user_jid;
 }
 
 std::unordered_map<std::string, std::shared_ptr<IrcClient>>& Bridge::get_irc_clients()
@@ -1176,6 +1304,7 @@ void Bridge::add_resource_to_chan(const Bridge::ChannelKey& channel, const std::
     this->resources_in_chan[channel] = {resource};
   else
     it->second.insert(resource);
+  this->channels_of_resource[resource].insert(channel);
 }
 
 void Bridge::remove_resource_from_chan(const Bridge::ChannelKey& channel, const std::string& resource)
@@ -1187,6 +1316,18 @@ void Bridge::remove_resource_from_chan(const Bridge::ChannelKey& channel, const
       if (it->second.empty())
         this->resources_in_chan.erase(it);
     }
+  this->remove_channel_of_resource(resource, channel);
+}
+
+void Bridge::remove_channel_of_resource(const std::string& resource, const Bridge::ChannelKey& channel)
+{
+  auto it = this->channels_of_resource.find(resource);
+  if (it != this->channels_of_resource.end())
+    {
+      it->second.erase(channel);
+      if (it->second.empty())
+        this->channels_of_resource.erase(it);
+    }
 }
 
 bool Bridge::is_resource_in_chan(const Bridge::ChannelKey& channel, const std::string& resource) const
@@ -1200,7 +1341,12 @@ bool Bridge::is_resource_in_chan(const Bridge::ChannelKey& channel, const std::s
 
 void Bridge::remove_all_resources_from_chan(const Bridge::ChannelKey& channel)
 {
-  this->resources_in_chan.erase(channel);
+  auto it = this->resources_in_chan.find(channel);
+  if (it == this->resources_in_chan.end())
+    return;
+  for (const auto& resource: it->second)
+    this->remove_channel_of_resource(resource, channel);
+  this->resources_in_chan.erase(it);
 }
 
 void Bridge::add_resource_to_server(const Bridge::IrcHostname& irc_hostname, const std::string& resource)
@@ -1242,10 +1388,13 @@ std::size_t Bridge::number_of_resources_in_chan(const Bridge::ChannelKey& channe
 
 std::size_t Bridge::number_of_channels_the_resource_is_in(const std::string& irc_hostname, const std::string& resource) const
 {
+  const auto it = this->channels_of_resource.find(resource);
+  if (it == this->channels_of_resource.end())
+    return 0;
   std::size_t res = 0;
-  for (auto pair: this->resources_in_chan)
+  for (const ChannelKey& channel: it->second)
     {
-      if (std::get<1>(pair.first) == irc_hostname && pair.second.count(resource) != 0)
+      if (std::get<1>(channel) == irc_hostname)
         res++;
     }
 
@@ -1258,18 +1407,19 @@ void Bridge::generate_channel_join_for_resource(const Iid& iid, const std::strin
   IrcChannel* channel = irc->get_channel(iid.get_local());
   const auto self = channel->get_self();
 
-  // Send the occupant list
+  // Send the occupant list.  The users that are not announced yet will be
+  // sent to all the resources later
   for (const auto& user: channel->get_users())
     {
-      if (user->nick != self->nick)
+      if (&user != self && user.announced)
         {
           this->send_user_join(iid.get_server(), iid.get_encoded_local(),
-                               user.get(), user->get_most_significant_mode(irc->get_sorted_user_modes()),
+                               user.user.get(), user.get_most_significant_mode(irc->get_user_mode_ranks()),
                                false, resource);
         }
     }
   this->send_user_join(iid.get_server(), iid.get_encoded_local(),
-                       self, self->get_most_significant_mode(irc->get_sorted_user_modes()),
+                       self->user.get(), self->get_most_significant_mode(irc->get_user_mode_ranks()),
                        true, resource);
   this->send_room_history(iid.get_server(), iid.get_local(), resource, irc->history_limit);
   this->send_topic(iid.get_server(), iid.get_encoded_local(), channel->topic, channel->topic_author, resource);
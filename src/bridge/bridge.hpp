@@ -1,6 +1,7 @@
 #pragma once
 
 #include <bridge/result_set_management.hpp>
+#include <bridge/channel_directory.hpp>
 #include <bridge/list_element.hpp>
 #include <bridge/history_limit.hpp>
 
@@ -13,7 +14,11 @@
 #include <unordered_map>
 #include <functional>
 #include <exception>
+#include <chrono>
+#include <vector>
+#include <map>
 #include <string>
+#include <set>
 #include <memory>
 
 #include <biboumi.h>
@@ -23,12 +28,29 @@ class Poller;
 struct ResultSetInfo;
 
 /**
- * A callback called for each IrcMessage we receive. If the message triggers
- * a response, it must send ore or more iq and return true (in that case it
- * is removed from the list), otherwise it must do nothing and just return
- * false.
+ * What a waiting IRC callback did with a message
  */
-using irc_responder_callback_t = std::function<bool(const std::string& irc_hostname, const IrcMessage& message)>;
+enum class IrcResponse
+{
+  // The message is not related to that callback
+  ignored,
+  // The message is part of the response, but more are expected
+  partial,
+  // The response is complete, the callback can be removed
+  done,
+};
+/**
+ * A callback called for each IrcMessage we receive. If the message
+ * completes a response, it must send one or more iq and return
+ * IrcResponse::done (in that case it is removed from the list), otherwise
+ * it must return IrcResponse::partial if it used that message, or just
+ * IrcResponse::ignored.
+ */
+using irc_responder_callback_t = std::function<IrcResponse(const std::string& irc_hostname, const IrcMessage& message)>;
+/**
+ * Called instead, if no message triggered a response for too long
+ */
+using irc_responder_timeout_t = std::function<void()>;
 
 /**
  * One bridge is spawned for each XMPP user that uses the component.  The
@@ -40,7 +62,7 @@ class Bridge
 {
 public:
   explicit Bridge(std::string  user_jid, BiboumiComponent& xmpp, std::shared_ptr<Poller>& poller);
-  ~Bridge() = default;
+  ~Bridge();
 
   Bridge(const Bridge&) = delete;
   Bridge(Bridge&& other) = delete;
@@ -55,9 +77,15 @@ public:
    */
   void remove_resource(const std::string& resource, const std::string& part_message);
   /**
-   * Remove all inactive IrcClients
+   * Remove the inactive IrcClients among the ones marked with
+   * mark_irc_client_dirty(), or among all of them if all is true.
    */
-  void clean();
+  void clean(const bool all=false);
+  /**
+   * Remember that the state of this IrcClient changed (for example it got
+   * disconnected), and that it must be checked by the next clean()
+   */
+  void mark_irc_client_dirty(const std::string& hostname);
   /**
    * Return the jid of the XMPP user using this bridge
    */
@@ -98,16 +126,12 @@ public:
   void send_irc_channel_list_request(const Iid& iid, const std::string& iq_id, const std::string& to_jid,
                                      ResultSetInfo rs_info);
   /**
-   * Check if the channel list contains what is needed to answer the RSM request,
-   * if it does, send the iq result. If the list is complete but does not contain
-   * everything, send the result anyway (because there are no more available
-   * channels that could complete the list).
-   *
-   * Returns true if we sent the answer.
+   * Send the channels of that server whose name or topic contain the text,
+   * at most max of them, once the whole list is known
    */
-  bool send_matching_channel_list(const ChannelList& channel_list,
-                                  const ResultSetInfo& rs_info, const std::string& id, const std::string& to_jid,
-                                  const std::string& from);
+  void send_irc_channel_search(const Iid& iid, const std::string& iq_id, const std::string& to_jid,
+                               const std::string& text, const ChannelDirectory::Order order,
+                               const std::size_t max);
   void forward_affiliation_role_change(const Iid& iid, const std::string& from, const std::string& nick,
                                        const std::string& affiliation, const std::string& role, const std::string& id);
   /**
@@ -174,7 +198,7 @@ public:
   /**
    * Send an unavailable presence from this participant
    */
-  void send_muc_leave(const Iid& iid, const IrcUser& nick,
+  void send_muc_leave(const Iid& iid, const IrcChannelUser& user,
                       const std::string& message, const bool self,
                       const bool user_requested,
                       const std::string& resource,
@@ -232,13 +256,19 @@ public:
    */
   void remove_all_preferred_from_jid_of_room(const std::string& channel_name);
   /**
-   * Add a callback to the waiting list of irc callbacks.
+   * Add a callback to the waiting list of irc callbacks.  It is only called
+   * for the messages received from that IRC server, with one of the given
+   * commands.  If it is not done after that timeout, it is removed and
+   * on_timeout (if any) is called.  Each partial response gives it that
+   * timeout again.
    */
-  void add_waiting_irc(irc_responder_callback_t&& callback);
+  void add_waiting_irc(const std::string& irc_hostname, std::vector<std::string> commands,
+                       irc_responder_callback_t&& callback, irc_responder_timeout_t&& on_timeout={},
+                       const std::chrono::milliseconds timeout=waiting_irc_timeout);
   /**
-   * Iter over all the waiting_iq, call the iq_responder_filter_t for each,
-   * whenever one of them returns true: call the corresponding
-   * iq_responder_callback_t and remove the callback from the list.
+   * Call, in the order they were added, the waiting callbacks interested in
+   * this message.  Whenever one of them is done, it is removed from the
+   * list.
    */
   void trigger_on_irc_message(const std::string& irc_hostname, const IrcMessage& message);
   std::unordered_map<std::string, std::shared_ptr<IrcClient>>& get_irc_clients();
@@ -276,6 +306,10 @@ private:
    * The pointer is shared by the bridge and the poller.
    */
   std::unordered_map<std::string, std::shared_ptr<IrcClient>> irc_clients;
+  /**
+   * The hostnames of the IrcClients to check in the next clean()
+   */
+  std::set<std::string> dirty_irc_clients;
   /**
    * To communicate back with the XMPP component
    */
@@ -293,13 +327,43 @@ private:
    * from='#somechan%server@biboumi/ToTo'
    */
   std::unordered_map<std::string, std::string> preferred_user_from;
-  /**
-   * A list of callbacks that are waiting for some IrcMessage to trigger a
-   * response.  We add callbacks in this list whenever we received an IQ
-   * request and we need a response from IRC to be able to provide the
+  struct WaitingIrc
+  {
+    std::string irc_hostname;
+    std::vector<std::string> commands;
+    irc_responder_callback_t callback;
+    irc_responder_timeout_t on_timeout;
+    std::chrono::milliseconds timeout;
+    std::chrono::steady_clock::time_point deadline;
+  };
+  /**
+   * The callbacks that are waiting for some IrcMessage to trigger a
+   * response, by id.  We add callbacks in this list whenever we received an
+   * IQ request and we need a response from IRC to be able to provide the
    * response iq.
    */
-  std::vector<irc_responder_callback_t> waiting_irc;
+  std::map<std::size_t, WaitingIrc> waiting_irc;
+  /**
+   * The ids of the waiting callbacks, in the order they were added, by IRC
+   * hostname and command
+   */
+  std::unordered_map<std::string, std::unordered_map<std::string, std::vector<std::size_t>>> waiting_irc_index;
+  std::size_t next_waiting_irc_id{0};
+  static constexpr std::chrono::seconds waiting_irc_timeout{300};
+  /**
+   * Send a LIST command to that server, unless the shared channels list
+   * does not need it (see ChannelListCache::start_fetch)
+   */
+  void request_channel_list(const Iid& iid, const bool first_page);
+  void remove_waiting_irc(const std::size_t id);
+  /**
+   * Remove the callbacks waiting for that server (calling their on_timeout),
+   * and fail the channels list we are fetching from it, when its IrcClient
+   * is disconnected or removed
+   */
+  void cancel_waiting_irc(const std::string& irc_hostname);
+  void on_waiting_irc_timeout(const std::size_t id);
+  std::string waiting_irc_event_name(const std::size_t id) const;
   /**
    * Resources to IRC channel/server mapping:
    */
@@ -311,6 +375,11 @@ public:
   std::map<ChannelKey, std::set<Resource>> resources_in_chan;
   std::map<IrcHostname, std::set<Resource>> resources_in_server;
 private:
+  /**
+   * The reverse of resources_in_chan: the channels each resource is in.
+   * Kept up to date by the functions below.
+   */
+  std::map<Resource, std::set<ChannelKey>> channels_of_resource;
   /**
    * Manage which resource is in which channel
    */
@@ -320,6 +389,7 @@ public:
   bool is_resource_in_chan(const ChannelKey& channel, const std::string& resource) const;
 private:
   void remove_all_resources_from_chan(const ChannelKey& channel);
+  void remove_channel_of_resource(const std::string& resource, const ChannelKey& channel);
   std::size_t number_of_resources_in_chan(const ChannelKey& channel) const;
 
   void add_resource_to_server(const IrcHostname& irc_hostname, const std::string& resource);
@@ -333,12 +403,6 @@ private:
    * TODO: send message history
    */
   void generate_channel_join_for_resource(const Iid& iid, const std::string& resource);
-  /**
-   * A cache of the channels list (as returned by the server on a LIST
-   * request), to be re-used on a subsequent XMPP list request that
-   * uses result-set-management.
-   */
-  std::map<IrcHostname, ChannelList> channel_list_cache;
 
 #ifdef USE_DATABASE
   bool record_history { true };
@@ -0,0 +1,74 @@
+#include <bridge/channel_directory.hpp>
+#include <utils/tolower.hpp>
+
+#include <algorithm>
+#include <cstdlib>
+
+void ChannelDirectory::build(const ChannelList& list)
+{
+  this->clear();
+  this->texts.reserve(list.channels.size());
+  this->users.reserve(list.channels.size());
+  for (const ListElement& element: list.channels)
+    {
+      const auto position = static_cast<uint32_t>(this->texts.size());
+      std::string text = utils::tolower(element.channel) + "\n" + utils::tolower(element.topic);
+      for (std::size_t i = 0; i + 3 <= text.size(); ++i)
+        {
+          auto& positions = this->trigrams[trigram(text, i)];
+          // The positions are added in increasing order, this skips the
+          // trigrams found more than once in the same channel
+          if (positions.empty() || positions.back() != position)
+            positions.push_back(position);
+        }
+      this->texts.push_back(std::move(text));
+      this->users.push_back(std::strtol(element.nb_users.data(), nullptr, 10));
+    }
+}
+
+void ChannelDirectory::clear()
+{
+  this->texts.clear();
+  this->users.clear();
+  this->trigrams.clear();
+}
+
+std::vector<std::size_t> ChannelDirectory::search(const std::string& text, const Order order) const
+{
+  const std::string needle = utils::tolower(text);
+  std::vector<std::size_t> res;
+  if (needle.size() < 3)
+    {
+      for (std::size_t i = 0; i < this->texts.size(); ++i)
+        if (this->texts[i].find(needle) != std::string::npos)
+          res.push_back(i);
+    }
+  else
+    {
+      const std::vector<uint32_t>* candidates = nullptr;
+      for (std::size_t i = 0; i + 3 <= needle.size(); ++i)
+        {
+          const auto it = this->trigrams.find(trigram(needle, i));
+          if (it == this->trigrams.end())
+            return res;
+          if (!candidates || it->second.size() < candidates->size())
+            candidates = &it->second;
+        }
+      for (const auto position: *candidates)
+        if (this->texts[position].find(needle) != std::string::npos)
+          res.push_back(position);
+    }
+  if (order == Order::users)
+    std::stable_sort(res.begin(), res.end(), [this](const std::size_t a, const std::size_t b)
+    {
+      return this->users[a] > this->users[b];
+    });
+  return res;
+}
+
+uint32_t ChannelDirectory::trigram(const std::string& text, const std::size_t pos)
+{
+  return static_cast<uint32_t>(static_cast<unsigned char>(text[pos])) << 16 |
+      static_cast<uint32_t>(static_cast<unsigned char>(text[pos + 1])) << 8 |
+      static_cast<uint32_t>(static_cast<unsigned char>(text[pos + 2]));
+}
@@ -0,0 +1,49 @@
+#pragma once
+
+#include <bridge/list_element.hpp>
+
+#include <unordered_map>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+/**
+ * An index of a complete ChannelList, to find the channels whose name or
+ * topic contains some text without going through the whole list.
+ *
+ * The lowercase name and topic of each channel are cut in trigrams (all
+ * their substrings of 3 bytes), and each trigram points to the channels
+ * that contain it.  A search for a text of at least 3 bytes only checks the
+ * channels containing its rarest trigram.
+ */
+class ChannelDirectory
+{
+public:
+  enum class Order
+  {
+    list,                       // The order given by the IRC server
+    users,                      // The most populated channels first
+  };
+
+  ChannelDirectory() = default;
+
+  void build(const ChannelList& list);
+  void clear();
+  /**
+   * Return the positions, in the indexed list, of the channels whose name
+   * or topic contains that text, case-insensitively.  An empty text
+   * matches all the channels.
+   */
+  std::vector<std::size_t> search(const std::string& text, const Order order) const;
+  std::size_t size() const
+  { return this->texts.size(); }
+
+private:
+  static uint32_t trigram(const std::string& text, const std::size_t pos);
+  /**
+   * The lowercase name and topic of each channel, separated by a newline
+   */
+  std::vector<std::string> texts;
+  std::vector<long> users;
+  std::unordered_map<uint32_t, std::vector<uint32_t>> trigrams;
+};
@@ -0,0 +1,143 @@
+#include <bridge/channel_list_cache.hpp>
+#include <config/config.hpp>
+
+const ChannelList& ChannelListCache::get(const std::string& irc_hostname)
+{
+  return this->lists[irc_hostname].list;
+}
+
+const ChannelDirectory& ChannelListCache::get_directory(const std::string& irc_hostname)
+{
+  auto& entry = this->lists[irc_hostname];
+  // Most lists are only browsed page by page, and never searched
+  if (entry.fetched && entry.list.complete && !entry.directory_built)
+    {
+      entry.directory.build(entry.list);
+      entry.directory_built = true;
+    }
+  return entry.directory;
+}
+
+bool ChannelListCache::start_fetch(const std::string& irc_hostname, const void* fetcher, const bool first_page)
+{
+  if (!this->needs_fetch(irc_hostname, first_page))
+    return false;
+  auto& entry = this->lists[irc_hostname];
+  entry.list.clear();
+  entry.directory.clear();
+  entry.directory_built = false;
+  entry.list.complete = false;
+  entry.fetcher = fetcher;
+  return true;
+}
+
+bool ChannelListCache::needs_fetch(const std::string& irc_hostname, const bool first_page) const
+{
+  const auto it = this->lists.find(irc_hostname);
+  if (it == this->lists.end())
+    return true;
+  const Entry& entry = it->second;
+  // A request is already ongoing
+  if (!entry.list.complete)
+    return false;
+  return !entry.fetched || (first_page && is_expired(entry));
+}
+
+void ChannelListCache::add(const std::string& irc_hostname, ListElement&& element)
+{
+  const auto it = this->lists.find(irc_hostname);
+  if (it == this->lists.end() || it->second.list.complete)
+    return;
+  it->second.list.add(std::move(element));
+  this->notify_waiters(it->second);
+}
+
+void ChannelListCache::complete(const std::string& irc_hostname)
+{
+  const auto it = this->lists.find(irc_hostname);
+  if (it == this->lists.end() || it->second.list.complete)
+    return;
+  it->second.fetched = true;
+  it->second.fetched_at = std::chrono::steady_clock::now();
+  this->finish(it->second);
+}
+
+void ChannelListCache::fail(const std::string& irc_hostname, const std::string& error)
+{
+  const auto it = this->lists.find(irc_hostname);
+  if (it == this->lists.end() || it->second.list.complete)
+    return;
+  // The next request will try again
+  it->second.fetched = false;
+  it->second.list.failed = true;
+  it->second.list.error = error;
+  this->finish(it->second);
+}
+
+void ChannelListCache::abort_fetches(const void* fetcher)
+{
+  for (auto& pair: this->lists)
+    {
+      if (!pair.second.list.complete && pair.second.fetcher == fetcher)
+        this->fail(pair.first, "");
+    }
+}
+
+void ChannelListCache::abort_fetch(const std::string& irc_hostname, const void* fetcher)
+{
+  const auto it = this->lists.find(irc_hostname);
+  if (it != this->lists.end() && !it->second.list.complete && it->second.fetcher == fetcher)
+    this->fail(irc_hostname, "");
+}
+
+void ChannelListCache::add_waiter(const std::string& irc_hostname, channel_list_waiter_t&& waiter)
+{
+  auto& entry = this->lists[irc_hostname];
+  if (entry.list.complete)
+    waiter(entry.list);
+  else if (!waiter(entry.list))
+    entry.waiters.push_back(std::move(waiter));
+}
+
+void ChannelListCache::remove_expired()
+{
+  auto it = this->lists.begin();
+  while (it != this->lists.end())
+    {
+      const Entry& entry = it->second;
+      if (entry.list.complete && entry.waiters.empty() && (!entry.fetched || is_expired(entry)))
+        it = this->lists.erase(it);
+      else
+        ++it;
+    }
+}
+
+bool ChannelListCache::is_expired(const Entry& entry)
+{
+  const std::chrono::seconds ttl{Config::get_int("channel_list_cache_ttl", 600)};
+  return std::chrono::steady_clock::now() - entry.fetched_at >= ttl;
+}
+
+void ChannelListCache::notify_waiters(Entry& entry)
+{
+  // A waiter may add other waiters while we iterate
+  auto waiters = std::move(entry.waiters);
+  entry.waiters.clear();
+  std::vector<channel_list_waiter_t> remaining;
+  for (auto& waiter: waiters)
+    if (!waiter(entry.list))
+      remaining.push_back(std::move(waiter));
+  for (auto& waiter: entry.waiters)
+    remaining.push_back(std::move(waiter));
+  entry.waiters = std::move(remaining);
+}
+
+void ChannelListCache::finish(Entry& entry)
+{
+  entry.list.complete = true;
+  entry.fetcher = nullptr;
+  auto waiters = std::move(entry.waiters);
+  entry.waiters.clear();
+  for (auto& waiter: waiters)
+    waiter(entry.list);
+}
@@ -0,0 +1,96 @@
+#pragma once
+
+#include <bridge/channel_directory.hpp>
+#include <bridge/list_element.hpp>
+
+#include <unordered_map>
+#include <functional>
+#include <chrono>
+#include <string>
+#include <vector>
+
+/**
+ * Called each time the list of channels of an IRC server grows, or is
+ * complete, or failed.  It must return true once it does not need to be
+ * called anymore, and it is then removed.  It is always removed once the
+ * list is complete or failed.
+ */
+using channel_list_waiter_t = std::function<bool(const ChannelList& list)>;
+
+/**
+ * The channels list of each IRC server (as returned by the server on a LIST
+ * request), shared by all the users of the component.
+ *
+ * Only one LIST request is sent at a time for a given server: the other
+ * requests wait for the ongoing one.  A complete list is then re-used until
+ * it is older than the channel_list_cache_ttl option.
+ */
+class ChannelListCache
+{
+public:
+  ChannelListCache() = default;
+  ~ChannelListCache() = default;
+
+  ChannelListCache(const ChannelListCache&) = delete;
+  ChannelListCache(ChannelListCache&&) = delete;
+  ChannelListCache& operator=(const ChannelListCache&) = delete;
+  ChannelListCache& operator=(ChannelListCache&&) = delete;
+
+  const ChannelList& get(const std::string& irc_hostname);
+  /**
+   * The index of the list, to search it.  It is built by the first call
+   * once the list is complete, and empty until then.
+   */
+  const ChannelDirectory& get_directory(const std::string& irc_hostname);
+  /**
+   * Return true if the caller must send a LIST command to the server, and
+   * then fill the list with add(), complete() or fail().  That is the case
+   * if the list is not being fetched already, and if it has never been
+   * fetched or if it is expired and first_page is true: a request for an
+   * other page keeps using the list it started with.
+   */
+  bool start_fetch(const std::string& irc_hostname, const void* fetcher, const bool first_page);
+  /**
+   * Whether or not start_fetch() would return true, without changing anything
+   */
+  bool needs_fetch(const std::string& irc_hostname, const bool first_page) const;
+  void add(const std::string& irc_hostname, ListElement&& element);
+  void complete(const std::string& irc_hostname);
+  void fail(const std::string& irc_hostname, const std::string& error);
+  /**
+   * Fail all the lists being fetched by that fetcher, because it will never
+   * be able to complete them
+   */
+  void abort_fetches(const void* fetcher);
+  /**
+   * Same thing, only for the list of that server
+   */
+  void abort_fetch(const std::string& irc_hostname, const void* fetcher);
+  /**
+   * Call the waiter whenever the list changes.  If the list is already
+   * complete, the waiter is immediately called once.
+   */
+  void add_waiter(const std::string& irc_hostname, channel_list_waiter_t&& waiter);
+  /**
+   * Remove the lists that are complete and expired
+   */
+  void remove_expired();
+  std::size_t size() const
+  { return this->lists.size(); }
+
+private:
+  struct Entry
+  {
+    ChannelList list;
+    ChannelDirectory directory;
+    bool directory_built{false};
+    const void* fetcher{nullptr};
+    bool fetched{false};
+    std::chrono::steady_clock::time_point fetched_at{};
+    std::vector<channel_list_waiter_t> waiters{};
+  };
+  static bool is_expired(const Entry& entry);
+  void notify_waiters(Entry& entry);
+  void finish(Entry& entry);
+  std::unordered_map<std::string, Entry> lists;
+};
@@ -1,5 +1,6 @@
 #pragma once
 
+#include <unordered_map>
 #include <vector>
 #include <string>
 
@@ -20,5 +21,39 @@ struct ListElement
 struct ChannelList
 {
     bool complete{true};
+    /**
+     * Set if the IRC server refused to give us the list, with the reason it
+     * gave (if any)
+     */
+    bool failed{false};
+    std::string error{};
     std::vector<ListElement> channels{};
+    /**
+     * The position of each channel in the channels vector
+     */
+    std::unordered_map<std::string, std::size_t> positions{};
+
+    void add(ListElement&& element)
+    {
+      this->positions.emplace(element.channel, this->channels.size());
+      this->channels.push_back(std::move(element));
+    }
+    /**
+     * Return the position of that channel, or the size of the list if it is
+     * not in it
+     */
+    std::size_t find(const std::string& channel) const
+    {
+      const auto it = this->positions.find(channel);
+      if (it == this->positions.end())
+        return this->channels.size();
+      return it->second;
+    }
+    void clear()
+    {
+      this->failed = false;
+      this->error.clear();
+      this->channels.clear();
+      this->positions.clear();
+    }
 };
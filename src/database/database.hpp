@@ -89,6 +89,9 @@ class Database
   struct ThrottleLimit: Column<long int> { static constexpr auto name = "throttlelimit_";
       ThrottleLimit(): Column<long int>(10) {} };
 
+  struct LazyUserList: Column<bool> { static constexpr auto name = "lazyuserlist_";
+    LazyUserList(): Column<bool>(false) {} };
+
   using MucLogLineTable = Table<Id, Uuid, Owner, IrcChanName, IrcServerName, Date, Body, Nick>;
   using MucLogLine = MucLogLineTable::RowType;
 
@@ -98,7 +101,7 @@ class Database
   using IrcServerOptionsTable = Table<Id, Owner, Server, Pass, TlsPorts, Ports, Username, Realname, VerifyCert, TrustedFingerprint, EncodingOut, EncodingIn, MaxHistoryLength, Address, Nick, ThrottleLimit>;
   using IrcServerOptions = IrcServerOptionsTable::RowType;
 
-  using IrcChannelOptionsTable = Table<Id, Owner, Server, Channel, EncodingOut, EncodingIn, MaxHistoryLength, Persistent, RecordHistoryOptional>;
+  using IrcChannelOptionsTable = Table<Id, Owner, Server, Channel, EncodingOut, EncodingIn, MaxHistoryLength, Persistent, RecordHistoryOptional, LazyUserList>;
   using IrcChannelOptions = IrcChannelOptionsTable::RowType;
 
   using RosterTable = Table<LocalJid, RemoteJid>;
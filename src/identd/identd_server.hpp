@@ -25,8 +25,15 @@ class IdentdServer: public TcpSocketServer<IdentdSocket>
       this->poller->remove_socket_handler(this->socket);
     ::close(this->socket);
   }
-  void clean()
+  /**
+   * Remove the closed sockets.  Nothing is done unless a socket was closed
+   * since the last call, or if all is true.
+   */
+  void clean(const bool all=false)
   {
+    if (!this->dirty && !all)
+      return;
+    this->dirty = false;
     this->sockets.erase(std::remove_if(this->sockets.begin(), this->sockets.end(),
                                        [](const std::unique_ptr<IdentdSocket>& socket)
                                        {
@@ -34,6 +41,14 @@ class IdentdServer: public TcpSocketServer<IdentdSocket>
                                        }),
                         this->sockets.end());
   }
+  void mark_dirty()
+  {
+    this->dirty = true;
+  }
  private:
   const BiboumiComponent& biboumi_component;
+  /**
+   * Whether or not a socket was closed since the last clean()
+   */
+  bool dirty{false};
 };
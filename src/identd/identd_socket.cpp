@@ -29,32 +29,31 @@ void IdentdSocket::parse_in_buffer(const std::size_t)
       uint16_t remote_port;
       char sep;
       line >> local_port >> sep >> remote_port;
-      const auto& xmpp = this->server.get_biboumi_component();
-      auto response = this->generate_answer(xmpp, local_port, remote_port);
+      auto response = this->generate_answer(local_port, remote_port);
 
       this->send_data(std::move(response));
     }
 }
 
+void IdentdSocket::on_connection_close(const std::string&)
+{
+  this->server.mark_dirty();
+}
+
 static std::string hash_jid(const std::string& jid)
 {
   return sha1(jid);
 }
 
-std::string IdentdSocket::generate_answer(const BiboumiComponent& biboumi, uint16_t local, uint16_t remote)
+std::string IdentdSocket::generate_answer(uint16_t local, uint16_t remote)
 {
-  for (const Bridge* bridge: biboumi.get_bridges())
+  const auto* client = TCPClientSocketHandler::find_by_ports<IrcClient>(local, remote);
+  if (client)
     {
-      for (const auto& pair: bridge->get_irc_clients())
-        {
-          if (pair.second->match_port_pairt(local, remote))
-            {
-              std::ostringstream os;
-              os << local << " , " << remote << " : USERID : OTHER : " << hash_jid(bridge->get_bare_jid()) << "\r\n";
-              log_debug("Identd, sending: ", os.str());
-              return os.str();
-            }
-        }
+      std::ostringstream os;
+      os << local << " , " << remote << " : USERID : OTHER : " << hash_jid(client->get_bridge().get_bare_jid()) << "\r\n";
+      log_debug("Identd, sending: ", os.str());
+      return os.str();
     }
   std::ostringstream os;
   os << local << " , " << remote << " ERROR : NO-USER" << "\r\n";
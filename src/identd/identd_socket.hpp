@@ -18,9 +18,10 @@ class IdentdSocket: public TCPSocketHandler
  public:
   IdentdSocket(std::shared_ptr<Poller>& poller, const socket_t socket, TcpSocketServer<IdentdSocket>& server);
   ~IdentdSocket() = default;
-  std::string generate_answer(const BiboumiComponent& biboumi, uint16_t local, uint16_t remote);
+  std::string generate_answer(uint16_t local, uint16_t remote);
 
   void parse_in_buffer(const std::size_t size) override final;
+  void on_connection_close(const std::string&) override final;
 
   bool is_connected() const override final
   {
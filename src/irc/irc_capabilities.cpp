@@ -0,0 +1,128 @@
+#include <irc/irc_capabilities.hpp>
+#include <utils/split.hpp>
+#include <logger/logger.hpp>
+
+#include <algorithm>
+
+IrcCapabilities::IrcCapabilities(std::vector<std::string> wanted):
+  wanted(std::move(wanted))
+{
+}
+
+IrcMessage IrcCapabilities::start()
+{
+  this->state = State::listing;
+  this->available.clear();
+  this->enabled.clear();
+  this->pending_requests = 0;
+  return {"CAP", {"LS", "302"}};
+}
+
+std::vector<IrcMessage> IrcCapabilities::on_cap(const IrcMessage& message)
+{
+  // CAP <target> <subcommand> [*] :<capabilities>
+  if (message.arguments.size() < 3)
+    return {};
+  const std::string& subcommand = message.arguments[1];
+  const bool more = message.arguments.size() >= 4 && message.arguments[2] == "*";
+  const std::string& caps = message.arguments.back();
+  if (subcommand == "LS" && this->state == State::listing)
+    return this->on_ls(caps, !more);
+  else if ((subcommand == "ACK" || subcommand == "NAK") && this->state == State::requesting)
+    return this->on_answer(caps, subcommand == "ACK");
+  else if (subcommand == "DEL")
+    {
+      for (const auto& name: utils::split(caps, ' ', false))
+        {
+          this->enabled.erase(name);
+          this->available.erase(name);
+        }
+    }
+  return {};
+}
+
+void IrcCapabilities::abort()
+{
+  this->state = State::done;
+}
+
+bool IrcCapabilities::is_enabled(const std::string& name) const
+{
+  return this->enabled.find(name) != this->enabled.end();
+}
+
+const std::string& IrcCapabilities::get_value(const std::string& name) const
+{
+  static const std::string empty;
+  const auto it = this->available.find(name);
+  if (it == this->available.end())
+    return empty;
+  return it->second;
+}
+
+std::vector<IrcMessage> IrcCapabilities::on_ls(const std::string& caps, const bool last)
+{
+  for (const auto& cap: utils::split(caps, ' ', false))
+    {
+      const auto equal = cap.find('=');
+      if (equal == std::string::npos)
+        this->available[cap];
+      else
+        this->available[cap.substr(0, equal)] = cap.substr(equal + 1);
+    }
+  if (!last)
+    return {};
+
+  std::string req;
+  for (const auto& name: this->wanted)
+    if (this->available.find(name) != this->available.end())
+      req += (req.empty() ? "" : " ") + name;
+  std::vector<IrcMessage> res;
+  if (req.empty())
+    {
+      this->state = State::done;
+      res.emplace_back("CAP", std::vector<std::string>{"END"});
+    }
+  else
+    {
+      log_debug("Requesting IRC capabilities: ", req);
+      this->state = State::requesting;
+      this->pending_requests = 1;
+      res.emplace_back("CAP", std::vector<std::string>{"REQ", req});
+    }
+  return res;
+}
+
+std::vector<IrcMessage> IrcCapabilities::on_answer(const std::string& caps, const bool ack)
+{
+  std::vector<IrcMessage> res;
+  const auto names = utils::split(caps, ' ', false);
+  if (this->pending_requests > 0)
+    this->pending_requests--;
+  if (ack)
+    {
+      for (const auto& name: names)
+        {
+          // A leading - means that the capability is disabled
+          if (!name.empty() && name[0] == '-')
+            this->enabled.erase(name.substr(1));
+          else
+            this->enabled.insert(name);
+        }
+    }
+  else if (names.size() > 1)
+    {
+      // The whole request is refused if one of them is, ask them one by one
+      for (const auto& name: names)
+        {
+          res.emplace_back("CAP", std::vector<std::string>{"REQ", name});
+          this->pending_requests++;
+        }
+    }
+  if (this->pending_requests == 0)
+    {
+      this->state = State::done;
+      res.emplace_back("CAP", std::vector<std::string>{"END"});
+    }
+  return res;
+}
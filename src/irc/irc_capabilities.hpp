@@ -0,0 +1,72 @@
+#pragma once
+
+#include <irc/irc_message.hpp>
+
+#include <vector>
+#include <string>
+#include <map>
+#include <set>
+
+/**
+ * The IRCv3 capabilities negotiation (CAP LS, REQ, ACK, etc) with one IRC
+ * server.  We request the capabilities that we want, among the ones that
+ * the server advertises, and we end the negotiation once the server
+ * answered all our requests.
+ */
+class IrcCapabilities
+{
+public:
+  explicit IrcCapabilities(std::vector<std::string> wanted);
+
+  IrcCapabilities(const IrcCapabilities&) = delete;
+  IrcCapabilities(IrcCapabilities&&) = delete;
+  IrcCapabilities& operator=(const IrcCapabilities&) = delete;
+  IrcCapabilities& operator=(IrcCapabilities&&) = delete;
+
+  /**
+   * Forget everything about the previous negotiation, and return the
+   * message that starts a new one
+   */
+  IrcMessage start();
+  /**
+   * Handle a CAP message received from the server, and return the messages
+   * to send in response
+   */
+  std::vector<IrcMessage> on_cap(const IrcMessage& message);
+  /**
+   * The server did not take part in the negotiation (it does not know the
+   * CAP command, or it is too late)
+   */
+  void abort();
+  bool is_negotiating() const
+  { return this->state != State::done; }
+  bool is_enabled(const std::string& name) const;
+  /**
+   * Return the value given by the server with that capability (for example
+   * "max-bytes=4096" for draft/multiline), or an empty string
+   */
+  const std::string& get_value(const std::string& name) const;
+  const std::set<std::string>& get_enabled() const
+  { return this->enabled; }
+
+private:
+  enum class State
+  {
+    listing,                    // Waiting for the end of CAP LS
+    requesting,                 // Waiting for the ACK or NAK of our requests
+    done,
+  };
+  std::vector<IrcMessage> on_ls(const std::string& caps, const bool last);
+  std::vector<IrcMessage> on_answer(const std::string& caps, const bool ack);
+  const std::vector<std::string> wanted;
+  State state{State::done};
+  /**
+   * The capabilities offered by the server, with their value
+   */
+  std::map<std::string, std::string> available;
+  std::set<std::string> enabled;
+  /**
+   * The number of CAP REQ that have not been answered yet
+   */
+  std::size_t pending_requests{0};
+};
@@ -1,57 +1,107 @@
 #include <irc/irc_channel.hpp>
 #include <algorithm>
 
-void IrcChannel::set_self(IrcUser* user)
+IrcChannel::IrcChannel(IrcUserTable& user_table):
+  user_table(user_table)
+{}
+
+void IrcChannel::set_self(const IrcChannelUser* user)
 {
-  this->self = user;
+  this->self = user ? user->user.get() : nullptr;
 }
 
-IrcUser* IrcChannel::add_user(const std::string& name,
-                              const std::map<char, char>& prefix_to_mode)
+IrcChannelUser* IrcChannel::add_user(const std::string& name,
+                                     const IrcUserModeRanks& ranks)
 {
-  auto new_user = std::make_unique<IrcUser>(name, prefix_to_mode);
-  auto old_user = this->find_user(new_user->nick);
+  const IrcUser new_user(name, ranks);
+  auto old_user = this->find_user(new_user.nick);
   if (old_user)
     return old_user;
-  this->users.emplace_back(std::move(new_user));
-  return this->users.back().get();
+  this->users.push_back({this->user_table.get(new_user.nick, new_user.host),
+                         IrcUserModes::from_prefixes(name, ranks)});
+  this->positions.emplace(this->users.back().user.get(), this->users.size() - 1);
+  return &this->users.back();
+}
+
+IrcChannelUser* IrcChannel::get_self()
+{
+  const auto* self = static_cast<const IrcChannel*>(this)->get_self();
+  return const_cast<IrcChannelUser*>(self);
+}
+
+const IrcChannelUser* IrcChannel::get_self() const
+{
+  return this->find_user(this->self);
+}
+
+IrcChannelUser* IrcChannel::find_user(const std::string& name)
+{
+  const auto* user = static_cast<const IrcChannel*>(this)->find_user(name);
+  return const_cast<IrcChannelUser*>(user);
 }
 
-IrcUser* IrcChannel::get_self() const
+const IrcChannelUser* IrcChannel::find_user(const std::string& name) const
 {
-  return this->self;
+  return this->find_user(this->user_table.find(IrcUser(name).nick));
 }
 
-IrcUser* IrcChannel::find_user(const std::string& name) const
+const IrcChannelUser* IrcChannel::find_user(const IrcUser* user) const
 {
-  IrcUser user(name);
-  for (const auto& u: this->users)
+  if (!user)
+    return nullptr;
+  const auto it = this->positions.find(user);
+  if (it == this->positions.end())
+    return nullptr;
+  return &this->users[it->second];
+}
+
+IrcChannelUser IrcChannel::remove_user(const IrcChannelUser* user)
+{
+  IrcChannelUser result{};
+  if (!user)
+    return result;
+  const auto it = this->positions.find(user->user.get());
+  if (it == this->positions.end())
+    return result;
+  const std::size_t position = it->second;
+  this->positions.erase(it);
+  result = std::move(this->users[position]);
+  // Move the last user into the hole, instead of shifting all the
+  // following ones
+  if (position != this->users.size() - 1)
+    {
+      this->users[position] = std::move(this->users.back());
+      this->positions[this->users[position].user.get()] = position;
+    }
+  this->users.pop_back();
+  if (result.user.get() == this->self)
     {
-      if (u->nick == user.nick)
-        return u.get();
+      this->self = nullptr;
+      this->joined = false;
     }
-  return nullptr;
+  return result;
 }
 
-std::unique_ptr<IrcUser> IrcChannel::remove_user(const IrcUser* user)
+std::vector<const IrcChannelUser*> IrcChannel::announce_users(const std::size_t max)
 {
-  std::unique_ptr<IrcUser> result{};
-  const auto nick = user->nick;
-  const bool is_self = (user == this->self);
-  const auto it = std::find_if(this->users.begin(), this->users.end(),
-                               [nick](const std::unique_ptr<IrcUser>& u)
-                               {
-                                 return nick == u->nick;
-                               });
-  if (it != this->users.end())
+  std::vector<const IrcChannelUser*> res;
+  for (auto& u: this->users)
     {
-      result = std::move(*it);
-      this->users.erase(it);
-      if (is_self)
-        {
-          this->self = nullptr;
-          this->joined = false;
-        }
+      if (max != 0 && res.size() == max)
+        break;
+      if (u.announced)
+        continue;
+      u.announced = true;
+      res.push_back(&u);
     }
-  return result;
+  return res;
+}
+
+bool IrcChannel::has_unannounced_users() const
+{
+  return std::any_of(this->users.begin(), this->users.end(),
+                     [](const IrcChannelUser& u)
+                     {
+                       return !u.announced;
+                     });
 }
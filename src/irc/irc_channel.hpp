@@ -6,6 +6,7 @@
 #include <string>
 #include <vector>
 #include <map>
+#include <unordered_map>
 
 /**
  * Keep the state of a joined channel (the list of occupants with their
@@ -14,7 +15,7 @@
 class IrcChannel
 {
 public:
-  IrcChannel() = default;
+  explicit IrcChannel(IrcUserTable& user_table);
 
   IrcChannel(const IrcChannel&) = delete;
   IrcChannel(IrcChannel&&) = delete;
@@ -27,17 +28,43 @@ public:
   bool parting{false};
   std::string topic{};
   std::string topic_author{};
-  void set_self(IrcUser* user);
-  IrcUser* get_self() const;
-  IrcUser* add_user(const std::string& name,
-                    const std::map<char, char>& prefix_to_mode);
-  IrcUser* find_user(const std::string& name) const;
-  std::unique_ptr<IrcUser> remove_user(const IrcUser* user);
-  const std::vector<std::unique_ptr<IrcUser>>& get_users() const
+  /**
+   * If true, only the users with a mode (and our own user) are announced to
+   * the XMPP users when the channel is joined.  The others are announced
+   * later, a few at a time.
+   */
+  bool lazy_user_list{false};
+  void set_self(const IrcChannelUser* user);
+  IrcChannelUser* get_self();
+  const IrcChannelUser* get_self() const;
+  /**
+   * The returned pointers (and the ones returned by find_user) are only
+   * valid until the next call to add_user or remove_user.  Removing a user
+   * does not keep the order of the other ones.
+   */
+  IrcChannelUser* add_user(const std::string& name,
+                           const IrcUserModeRanks& ranks);
+  IrcChannelUser* find_user(const std::string& name);
+  const IrcChannelUser* find_user(const std::string& name) const;
+  IrcChannelUser remove_user(const IrcChannelUser* user);
+  const std::vector<IrcChannelUser>& get_users() const
   { return this->users; }
+  /**
+   * Mark at most max users that were not announced yet (all of them if max
+   * is 0) as announced, and return them.  The returned pointers are valid
+   * as long as the ones returned by add_user.
+   */
+  std::vector<const IrcChannelUser*> announce_users(const std::size_t max=0);
+  bool has_unannounced_users() const;
 
 protected:
-  // Pointer to one IrcUser stored in users
-  IrcUser* self{nullptr};
-  std::vector<std::unique_ptr<IrcUser>> users{};
+  IrcUserTable& user_table;
+  // The IrcUser of our own entry in users
+  const IrcUser* self{nullptr};
+  std::vector<IrcChannelUser> users{};
+  // The position of each user in users
+  std::unordered_map<const IrcUser*, std::size_t> positions{};
+
+private:
+  const IrcChannelUser* find_user(const IrcUser* user) const;
 };
@@ -72,6 +72,8 @@ static const std::unordered_map<std::string,
   {"475", {&IrcClient::on_channel_bad_key, {3, 0}}},
   {"ERR_USERONCHANNEL", {&IrcClient::on_useronchannel, {3, 0}}},
   {"001", {&IrcClient::on_welcome_message, {1, 0}}},
+  {"CAP", {&IrcClient::on_cap, {3, 0}}},
+  {"BATCH", {&IrcClient::on_batch, {1, 0}}},
   {"PART", {&IrcClient::on_part, {1, 0}}},
   {"ERROR", {&IrcClient::on_error, {1, 0}}},
   {"QUIT", {&IrcClient::on_quit, {0, 0}}},
@@ -119,6 +121,7 @@ static const std::unordered_map<std::string,
   {"474", {&IrcClient::on_generic_error, {2, 0}}},
   {"476", {&IrcClient::on_generic_error, {2, 0}}},
   {"477", {&IrcClient::on_generic_error, {2, 0}}},
+  {"489", {&IrcClient::on_generic_error, {2, 0}}},
   {"481", {&IrcClient::on_generic_error, {2, 0}}},
   {"482", {&IrcClient::on_generic_error, {2, 0}}},
   {"483", {&IrcClient::on_generic_error, {2, 0}}},
@@ -144,13 +147,13 @@ IrcClient::IrcClient(std::shared_ptr<Poller>& poller, std::string hostname,
   welcomed(false),
   chanmodes({"", "", "", ""}),
   chantypes({'#', '&'}),
-  tokens_bucket(this->get_throttle_limit(), 1s, [this]() {
-    if (message_queue.empty())
-      return true;
-    this->actual_send(std::move(this->message_queue.front()));
-    this->message_queue.pop_front();
-    return false;
-  }, "TokensBucket" + this->hostname + this->bridge.get_jid())
+  tokens_bucket(this->get_throttle_limit(),
+                std::chrono::milliseconds(Config::get_int("irc_throttle_interval", 1000)),
+                [this]() { this->send_queued_messages(); },
+                "TokensBucket" + this->hostname + this->bridge.get_jid()),
+  capabilities({"multi-prefix", "batch", "draft/multiline", "userhost-in-names", "echo-message",
+                "labeled-response"}),
+  read_size(static_cast<std::size_t>(std::min(std::max(Config::get_int("irc_read_size", 4096), 512), 1 << 20)))
 {
 #ifdef USE_DATABASE
   auto options = Database::get_irc_server_options(this->bridge.get_bare_jid(),
@@ -178,7 +181,8 @@ IrcClient::~IrcClient()
   // This event may or may not exist (if we never got connected, it
   // doesn't), but it's ok
   TimedEventsManager::instance().cancel("PING" + this->hostname + this->bridge.get_jid());
-  TimedEventsManager::instance().cancel("TokensBucket" + this->hostname + this->bridge.get_jid());
+  TimedEventsManager::instance().cancel("Netsplit" + this->hostname + this->bridge.get_jid());
+  TimedEventsManager::instance().cancel("LazyUsers" + this->hostname + this->bridge.get_jid());
 }
 
 void IrcClient::start()
@@ -217,6 +221,7 @@ void IrcClient::on_connection_failed(const std::string& reason)
 {
   this->bridge.send_xmpp_message(this->hostname, "",
                                   "Connection failed: " + reason);
+  this->bridge.mark_irc_client_dirty(this->hostname);
 
   if (this->hostname_resolution_failed)
     while (!this->ports_to_try.empty())
@@ -272,8 +277,11 @@ void IrcClient::on_connected()
         }
     }
 
-  this->send_message({"CAP", {"REQ", "multi-prefix"}});
-  this->send_message({"CAP", {"END"}});
+  // The registration is suspended until the end of the capabilities
+  // negotiation, if the server supports it
+  this->batches.clear();
+  this->echo_callbacks.clear();
+  this->send_message(this->capabilities.start());
 
 #ifdef USE_DATABASE
   auto options = Database::get_irc_server_options(this->bridge.get_bare_jid(),
@@ -314,32 +322,25 @@ void IrcClient::on_connection_close(const std::string& error_msg)
   this->on_error(error);
   log_warning(message);
   this->bridge.on_irc_client_disconnected(this->get_hostname());
+  this->bridge.mark_irc_client_dirty(this->hostname);
 }
 
 IrcChannel* IrcClient::get_channel(const std::string& n)
 {
   const std::string name = utils::tolower(n);
-  try
-    {
-      return this->channels.at(name).get();
-    }
-  catch (const std::out_of_range& exception)
-    {
-      return this->channels.emplace(name, std::make_unique<IrcChannel>()).first->second.get();
-    }
+  auto it = this->channels.find(name);
+  if (it == this->channels.end())
+    it = this->channels.emplace(name, std::make_unique<IrcChannel>(this->user_table)).first;
+  return it->second.get();
 }
 
 const IrcChannel* IrcClient::find_channel(const std::string& n) const
 {
   const std::string name = utils::tolower(n);
-  try
-    {
-      return this->channels.at(name).get();
-    }
-  catch (const std::out_of_range& exception)
-    {
-      return nullptr;
-    }
+  const auto it = this->channels.find(name);
+  if (it == this->channels.end())
+    return nullptr;
+  return it->second.get();
 }
 
 bool IrcClient::is_channel_joined(const std::string& name)
@@ -353,6 +354,11 @@ std::string IrcClient::get_own_nick() const
   return this->current_nick;
 }
 
+std::size_t IrcClient::get_read_size() const
+{
+  return this->read_size;
+}
+
 void IrcClient::parse_in_buffer(const size_t)
 {
   while (true)
@@ -363,39 +369,53 @@ void IrcClient::parse_in_buffer(const size_t)
       IrcMessage message(this->in_buf.substr(0, pos));
       this->consume_in_buffer(pos + 2);
       log_debug("IRC RECEIVING: (", this->get_hostname(), ") ", message);
+      this->dispatch_message(std::move(message));
+    }
+}
 
-      // Call the standard callback (if any), associated with the command
-      // name that we just received.
-      auto it = irc_callbacks.find(message.command);
-      if (it != irc_callbacks.end())
+void IrcClient::dispatch_message(IrcMessage&& message)
+{
+  if (message.has_tag("batch"))
+    {
+      const auto batch = this->batches.find(message.get_tag("batch"));
+      if (batch != this->batches.end())
         {
-          const auto& limits = it->second.second;
-          // Check that the Message is well formed before actually calling
-          // the callback. limits.first is the min number of arguments,
-          // second is the max
-          if (message.arguments.size() < limits.first ||
-              (limits.second > 0 && message.arguments.size() > limits.second))
-            log_warning("Invalid number of arguments for IRC command “", message.command,
-                        "”: ", message.arguments.size());
-          else
-            {
-              const auto& cb = it->second.first;
-              try {
-                (this->*(cb))(message);
-              } catch (const std::exception& e) {
-                log_error("Unhandled exception: ", e.what());
-              }
-            }
+          batch->second.messages.push_back(std::move(message));
+          return;
         }
+    }
+
+  // Call the standard callback (if any), associated with the command
+  // name that we just received.
+  auto it = irc_callbacks.find(message.command);
+  if (it != irc_callbacks.end())
+    {
+      const auto& limits = it->second.second;
+      // Check that the Message is well formed before actually calling
+      // the callback. limits.first is the min number of arguments,
+      // second is the max
+      if (message.arguments.size() < limits.first ||
+          (limits.second > 0 && message.arguments.size() > limits.second))
+        log_warning("Invalid number of arguments for IRC command “", message.command,
+                    "”: ", message.arguments.size());
       else
         {
-          log_info("No handler for command ", message.command,
-                   ", forwarding the arguments to the user");
-          this->on_unknown_message(message);
+          const auto& cb = it->second.first;
+          try {
+            (this->*(cb))(message);
+          } catch (const std::exception& e) {
+            log_error("Unhandled exception: ", e.what());
+          }
         }
-      // Try to find a waiting_iq, which response will be triggered by this IrcMessage
-      this->bridge.trigger_on_irc_message(this->hostname, message);
     }
+  else
+    {
+      log_info("No handler for command ", message.command,
+               ", forwarding the arguments to the user");
+      this->on_unknown_message(message);
+    }
+  // Try to find a waiting_iq, which response will be triggered by this IrcMessage
+  this->bridge.trigger_on_irc_message(this->hostname, message);
 }
 
 void IrcClient::actual_send(std::pair<IrcMessage, MessageCallback> message_pair)
@@ -404,6 +424,8 @@ void IrcClient::actual_send(std::pair<IrcMessage, MessageCallback> message_pair)
   const MessageCallback& callback = message_pair.second;
    log_debug("IRC SENDING: (", this->get_hostname(), ") ", message);
     std::string res;
+    if (!message.tags.empty())
+      res += "@" + irc::serialize_tags(message.tags) + " ";
     if (!message.prefix.empty())
       res += ":" + message.prefix + " ";
     res += message.command;
@@ -426,11 +448,37 @@ void IrcClient::actual_send(std::pair<IrcMessage, MessageCallback> message_pair)
 
 void IrcClient::send_message(IrcMessage message, MessageCallback callback, bool throttle)
 {
-  auto message_pair = std::make_pair(std::move(message), std::move(callback));
-  if (this->tokens_bucket.use_token() || !throttle)
-    this->actual_send(std::move(message_pair));
+  MessageGroup group;
+  group.emplace_back(std::move(message), std::move(callback));
+  this->send_message_group(std::move(group), throttle);
+}
+
+void IrcClient::send_message_group(MessageGroup group, bool throttle)
+{
+  // Throttled messages must not overtake the ones already waiting
+  if (!throttle || (this->message_queue.empty() && this->tokens_bucket.use_token()))
+    {
+      for (auto& message_pair: group)
+        this->actual_send(std::move(message_pair));
+    }
   else
-    message_queue.push_back(std::move(message_pair));
+    {
+      this->message_queue.push_back(std::move(group));
+      this->tokens_bucket.wait_for_token();
+    }
+}
+
+void IrcClient::send_queued_messages()
+{
+  while (!this->message_queue.empty() && this->tokens_bucket.use_token())
+    {
+      MessageGroup group = std::move(this->message_queue.front());
+      this->message_queue.pop_front();
+      for (auto& message_pair: group)
+        this->actual_send(std::move(message_pair));
+    }
+  if (!this->message_queue.empty())
+    this->tokens_bucket.wait_for_token();
 }
 
 void IrcClient::send_raw(const std::string& txt)
@@ -524,10 +572,154 @@ bool IrcClient::send_channel_message(const std::string& chan_name, const std::st
                          ::strlen(":!@ PRIVMSG ") - chan_name.length() - ::strlen(" :\r\n");
   const auto lines = cut(body, line_size);
   for (const auto& line: lines)
-    this->send_message(IrcMessage("PRIVMSG", {chan_name, line}), callback);
+    {
+      IrcMessage message("PRIVMSG", {chan_name, line});
+      auto message_callback = this->wait_for_echo(chan_name, message, callback);
+      this->send_message(std::move(message), std::move(message_callback));
+    }
   return true;
 }
 
+/**
+ * The number of bytes available for the text of a PRIVMSG, after our own
+ * nick, user, host, etc.  The tags do not count.
+ */
+static std::size_t get_privmsg_text_size(const std::string& nick, const std::string& chan_name)
+{
+  constexpr auto max_username_size = 10;
+  constexpr auto max_hostname_size = 63;
+  return 512 - nick.size() - max_username_size - max_hostname_size -
+      ::strlen(":!@ PRIVMSG ") - chan_name.length() - ::strlen(" :\r\n");
+}
+
+/**
+ * Return the value of that key in a capability value like
+ * "max-bytes=4096,max-lines=24", or 0
+ */
+static std::size_t get_cap_limit(const std::string& cap_value, const std::string& key)
+{
+  for (const auto& item: utils::split(cap_value, ',', false))
+    if (item.compare(0, key.size() + 1, key + "=") == 0)
+      return static_cast<std::size_t>(std::strtoul(item.data() + key.size() + 1, nullptr, 10));
+  return 0;
+}
+
+bool IrcClient::can_send_multiline_message(const std::string& chan_name, const std::vector<std::string>& lines) const
+{
+  if (!this->capabilities.is_enabled("batch") || !this->capabilities.is_enabled("draft/multiline"))
+    return false;
+  const IrcChannel* channel = this->find_channel(chan_name);
+  if (!channel || !channel->joined)
+    return false;
+  const std::string& value = this->capabilities.get_value("draft/multiline");
+  // max-bytes is mandatory, max-lines is not
+  const auto max_bytes = get_cap_limit(value, "max-bytes");
+  const auto max_lines = get_cap_limit(value, "max-lines");
+  const auto text_size = get_privmsg_text_size(this->current_nick, chan_name);
+  std::size_t bytes = 0;
+  std::size_t nb_lines = 0;
+  for (const auto& line: lines)
+    {
+      bytes += line.size() + 1;
+      nb_lines += std::max<std::size_t>(1, (line.size() + text_size - 1) / text_size);
+    }
+  return bytes - 1 <= max_bytes && (max_lines == 0 || nb_lines <= max_lines);
+}
+
+void IrcClient::send_channel_multiline_message(const std::string& chan_name, const std::vector<std::string>& lines,
+                                               MessageCallback callback)
+{
+  const std::string ref = "biboumi" + std::to_string(this->next_batch_id++);
+  const auto text_size = get_privmsg_text_size(this->current_nick, chan_name);
+  MessageGroup group;
+  group.emplace_back(IrcMessage("BATCH", {"+" + ref, "draft/multiline", chan_name}), MessageCallback{});
+  for (const auto& line: lines)
+    {
+      bool concat = false;
+      for (const auto& part: cut(line, text_size))
+        {
+          IrcMessage message("PRIVMSG", {chan_name, part});
+          message.tags["batch"] = ref;
+          // The parts of a line that is too long are concatenated back
+          // together by the receiver, without a line break
+          if (concat)
+            message.tags["draft/multiline-concat"];
+          concat = true;
+          group.emplace_back(std::move(message), MessageCallback{});
+        }
+    }
+  // The server sends the whole batch back as one message, labeled like
+  // the opening BATCH
+  auto batch_callback = this->wait_for_echo(chan_name, group.front().first, std::move(callback));
+  group.emplace_back(IrcMessage("BATCH", {"-" + ref}), std::move(batch_callback));
+  this->send_message_group(std::move(group));
+}
+
+MessageCallback IrcClient::wait_for_echo(const std::string& chan_name, IrcMessage& message,
+                                         MessageCallback callback)
+{
+  if (!callback || !this->capabilities.is_enabled("echo-message"))
+    return callback;
+  std::string label;
+  if (this->capabilities.is_enabled("labeled-response"))
+    {
+      label = "biboumi" + std::to_string(this->next_label_id++);
+      message.tags["label"] = label;
+    }
+  // The server sends our message back once it has been delivered to the
+  // channel, the callback is called with it instead
+  this->echo_callbacks[utils::tolower(chan_name)].push_back({std::move(label), std::move(callback)});
+  return {};
+}
+
+bool IrcClient::on_echo_message(const std::string& chan_name, const IrcMessage& message)
+{
+  const auto it = this->echo_callbacks.find(chan_name);
+  if (it == this->echo_callbacks.end())
+    return false;
+  auto& callbacks = it->second;
+  const auto label = message.tags.find("label");
+  // Without a label, we cannot know which message it is (the server may
+  // change its text, for example by removing the colors): it is the
+  // oldest one that was not refused
+  auto found = callbacks.begin();
+  if (label != message.tags.end())
+    found = std::find_if(callbacks.begin(), callbacks.end(),
+                         [&label](const EchoCallback& echo)
+                         {
+                           return echo.label == label->second;
+                         });
+  if (found == callbacks.end())
+    return false;
+  // The server answers our messages in order: the ones before it were
+  // refused or dropped silently
+  const MessageCallback callback = std::move(found->callback);
+  callbacks.erase(callbacks.begin(), found + 1);
+  if (callbacks.empty())
+    this->echo_callbacks.erase(it);
+  callback(this, message);
+  return true;
+}
+
+void IrcClient::drop_echo_callback(const std::string& chan_name, const IrcMessage& message)
+{
+  const auto it = this->echo_callbacks.find(utils::tolower(chan_name));
+  if (it == this->echo_callbacks.end())
+    return;
+  auto& callbacks = it->second;
+  const auto label = message.tags.find("label");
+  if (label == message.tags.end())
+    callbacks.pop_front();
+  else
+    callbacks.erase(std::remove_if(callbacks.begin(), callbacks.end(),
+                                   [&label](const EchoCallback& echo)
+                                   {
+                                     return echo.label == label->second;
+                                   }), callbacks.end());
+  if (callbacks.empty())
+    this->echo_callbacks.erase(it);
+}
+
 void IrcClient::send_private_message(const std::string& username, const std::string& body, const std::string& type)
 {
   std::string::size_type pos = 0;
@@ -585,6 +777,11 @@ void IrcClient::on_notice(const IrcMessage& message)
   std::string to = message.arguments[0];
   const std::string body = message.arguments[1];
 
+  // Our own notices, sent back by the server
+  if (this->capabilities.is_enabled("echo-message") &&
+      utils::tolower(IrcUser(from).nick) == utils::tolower(this->current_nick))
+    return ;
+
   // Handle notices starting with [#channame] as if they were sent to that channel
   if (body.size() > 3 && body[0] == '[')
     {
@@ -646,11 +843,14 @@ void IrcClient::on_isupport_message(const IrcMessage& message)
         while (j < token.size() && token[j] != ')')
           j++;
         j++;
+        std::string modes;
+        std::string prefixes;
         while (j < token.size() && token[i] != ')')
           {
-            this->sorted_user_modes.push_back(token[i]);
-            this->prefix_to_mode[token[j++]] = token[i++];
+            modes += token[i++];
+            prefixes += token[j++];
           }
+        this->user_mode_ranks.set(modes, prefixes);
       }
     else if (token.substr(0, 10) == "CHANTYPES=")
       {
@@ -683,20 +883,25 @@ void IrcClient::set_and_forward_user_list(const IrcMessage& message)
       return;
     }
   std::vector<std::string> nicks = utils::split(message.arguments[3], ' ');
+  const IrcChannelUser* self = channel->get_self();
+  const IrcUser* self_user = self ? self->user.get() : nullptr;
   for (const std::string& nick: nicks)
     {
-      // Just create this dummy user to parse and get its modes
-      IrcUser tmp_user{nick, this->prefix_to_mode};
+      // Just create this dummy user to parse its nick
+      IrcUser tmp_user{nick, this->user_mode_ranks};
       // Does this concern ourself
-      if (channel->get_self() && channel->find_user(tmp_user.nick) == channel->get_self())
+      if (self_user && tmp_user.nick == self_user->nick)
         {
           // We now know our own modes, that’s all.
-          channel->get_self()->modes = tmp_user.modes;
+          channel->get_self()->modes = IrcUserModes::from_prefixes(nick, this->user_mode_ranks);
         }
       else
         { // Otherwise this is a new user
-          const IrcUser *user = channel->add_user(nick, this->prefix_to_mode);
-          this->bridge.send_user_join(this->hostname, chan_name, user, user->get_most_significant_mode(this->sorted_user_modes), false);
+          IrcChannelUser* user = channel->add_user(nick, this->user_mode_ranks);
+          if (channel->lazy_user_list && user->modes.empty())
+            user->announced = false;
+          else
+            this->bridge.send_user_join(this->hostname, chan_name, user->user.get(), user->get_most_significant_mode(this->user_mode_ranks), false);
         }
     }
 }
@@ -707,11 +912,25 @@ void IrcClient::on_channel_join(const IrcMessage& message)
   IrcChannel* channel;
   channel = this->get_channel(chan_name);
   const std::string nick = message.prefix;
-  IrcUser* user = channel->add_user(nick, this->prefix_to_mode);
+  const IrcChannelUser* user = channel->add_user(nick, this->user_mode_ranks);
   if (channel->joined == false)
-    channel->set_self(user);
+    {
+      channel->set_self(user);
+#ifdef USE_DATABASE
+      channel->lazy_user_list = Database::get_irc_channel_options(this->bridge.get_bare_jid(), this->hostname,
+                                                                  chan_name).col<Database::LazyUserList>();
+#endif
+    }
   else
-    this->bridge.send_user_join(this->hostname, chan_name, user, user->get_most_significant_mode(this->sorted_user_modes), false);
+    {
+      const char mode = user->get_most_significant_mode(this->user_mode_ranks);
+      // The user is back from a netsplit: the XMPP users never saw it
+      // leave.  Its role is only compared at the end of the netsplit_delay,
+      // once the servers gave its modes back.
+      if (this->netsplit_buffer.cancel(chan_name, user->user->nick))
+        return;
+      this->bridge.send_user_join(this->hostname, chan_name, user->user.get(), mode, false);
+    }
 }
 
 void IrcClient::on_channel_message(const IrcMessage& message)
@@ -730,7 +949,27 @@ void IrcClient::on_channel_message(const IrcMessage& message)
       muc = false;
     }
   else
-    iid.type = Iid::Type::Channel;
+    {
+      iid.type = Iid::Type::Channel;
+      // Someone who talks is listed right away
+      IrcChannelUser* channel_user = this->get_channel(iid.get_local())->find_user(nick);
+      if (channel_user && !channel_user->announced)
+        {
+          channel_user->announced = true;
+          this->bridge.send_user_join(this->hostname, utils::tolower(iid.get_local()), channel_user->user.get(),
+                                      channel_user->get_most_significant_mode(this->user_mode_ranks), false);
+        }
+    }
+  if (this->capabilities.is_enabled("echo-message") &&
+      utils::tolower(nick) == utils::tolower(this->current_nick))
+    {
+      // Our own message, sent back by the server.  The private messages are
+      // already displayed by the XMPP clients, and the channel messages are
+      // reflected by their callback.  A message without a callback (sent
+      // with a raw command for example) is forwarded as any other.
+      if (!muc || this->on_echo_message(utils::tolower(iid.get_local()), message))
+        return;
+    }
   if (!body.empty() && body[0] == '\01')
     {
       if (body.substr(1, 6) == "ACTION")
@@ -828,10 +1067,58 @@ void IrcClient::on_channel_completely_joined(const IrcMessage& message)
       return;
     }
   channel->joined = true;
-  this->bridge.send_user_join(this->hostname, chan_name, channel->get_self(),
-                              channel->get_self()->get_most_significant_mode(this->sorted_user_modes), true);
+  if (channel->lazy_user_list &&
+      channel->get_users().size() <= static_cast<std::size_t>(Config::get_int("lazy_user_list_threshold", 1000)))
+    { // Not that big: everyone is listed before our own presence, as usual
+      for (const IrcChannelUser* user: channel->announce_users())
+        this->bridge.send_user_join(this->hostname, chan_name, user->user.get(),
+                                    user->get_most_significant_mode(this->user_mode_ranks), false);
+    }
+  this->bridge.send_user_join(this->hostname, chan_name, channel->get_self()->user.get(),
+                              channel->get_self()->get_most_significant_mode(this->user_mode_ranks), true);
   this->bridge.send_room_history(this->hostname, chan_name, this->history_limit);
   this->bridge.send_topic(this->hostname, chan_name, channel->topic, channel->topic_author);
+  if (channel->has_unannounced_users() &&
+      !TimedEventsManager::instance().find_event("LazyUsers" + this->hostname + this->bridge.get_jid()))
+    this->announce_lazy_users();
+}
+
+void IrcClient::announce_lazy_users()
+{
+  std::size_t remaining = lazy_users_per_second;
+  for (const auto& pair: this->channels)
+    {
+      IrcChannel* channel = pair.second.get();
+      if (!channel->joined)
+        continue;
+      for (const IrcChannelUser* user: channel->announce_users(remaining))
+        {
+          this->bridge.send_user_join(this->hostname, pair.first, user->user.get(),
+                                      user->get_most_significant_mode(this->user_mode_ranks), false);
+          remaining--;
+        }
+      if (remaining == 0)
+        break;
+    }
+  const bool done = std::none_of(this->channels.begin(), this->channels.end(),
+                                 [](const auto& pair)
+                                 {
+                                   return pair.second->joined && pair.second->has_unannounced_users();
+                                 });
+  if (!done)
+    TimedEventsManager::instance().add_event(TimedEvent(std::chrono::steady_clock::now() + 1s,
+                                                        std::bind(&IrcClient::announce_lazy_users, this),
+                                                        "LazyUsers" + this->hostname + this->bridge.get_jid()));
+}
+
+void IrcClient::announce_all_users(const std::string& chan_name)
+{
+  const auto it = this->channels.find(utils::tolower(chan_name));
+  if (it == this->channels.end() || !it->second->joined)
+    return;
+  for (const IrcChannelUser* user: it->second->announce_users())
+    this->bridge.send_user_join(this->hostname, it->first, user->user.get(),
+                                user->get_most_significant_mode(this->user_mode_ranks), false);
 }
 
 void IrcClient::on_banlist(const IrcMessage& message)
@@ -847,7 +1134,7 @@ void IrcClient::on_banlist(const IrcMessage& message)
       std::string body{message.arguments[2] + " banned"};
       if (message.arguments.size() >= 4)
         {
-          IrcUser by(message.arguments[3], this->prefix_to_mode);
+          IrcUser by(message.arguments[3], this->user_mode_ranks);
           body += " by " + by.nick;
         }
       if (message.arguments.size() >= 5)
@@ -926,6 +1213,7 @@ void IrcClient::on_generic_error(const IrcMessage& message)
 {
   const std::string error_msg = message.arguments.size() >= 3 ?
     message.arguments[2]: "Unspecified error";
+  this->drop_echo_callback(message.arguments[1], message);
   this->send_gateway_message(message.arguments[1] + ": " + error_msg, message.prefix);
 }
 
@@ -935,10 +1223,79 @@ void IrcClient::on_useronchannel(const IrcMessage& message)
                              + message.arguments[2]);
 }
 
+void IrcClient::on_cap(const IrcMessage& message)
+{
+  for (auto& response: this->capabilities.on_cap(message))
+    this->send_message(std::move(response));
+}
+
+void IrcClient::on_batch(const IrcMessage& message)
+{
+  const std::string& ref = message.arguments[0];
+  if (ref.size() < 2)
+    return;
+  if (ref[0] == '+' && message.arguments.size() >= 2)
+    {
+      auto& batch = this->batches[ref.substr(1)];
+      batch.type = message.arguments[1];
+      batch.params.assign(message.arguments.begin() + 2, message.arguments.end());
+      const auto label = message.tags.find("label");
+      if (label != message.tags.end())
+        batch.label = label->second;
+      return;
+    }
+  if (ref[0] != '-')
+    return;
+  const auto it = this->batches.find(ref.substr(1));
+  if (it == this->batches.end())
+    return;
+  Batch batch = std::move(it->second);
+  this->batches.erase(it);
+
+  if (batch.type == "draft/multiline" && !batch.messages.empty())
+    {
+      // Join all the lines into one message
+      std::string body;
+      for (const IrcMessage& line: batch.messages)
+        {
+          if (line.arguments.size() < 2)
+            continue;
+          if (!body.empty() && !line.has_tag("draft/multiline-concat"))
+            body += '\n';
+          body += line.arguments[1];
+        }
+      IrcMessage& first = batch.messages.front();
+      std::string target = first.arguments.empty() ? std::string{} : first.arguments[0];
+      IrcMessage joined(std::move(first.prefix), std::move(first.command), {std::move(target), std::move(body)});
+      joined.tags = std::move(first.tags);
+      joined.tags.erase("batch");
+      if (!batch.label.empty())
+        joined.tags["label"] = batch.label;
+      this->dispatch_message(std::move(joined));
+    }
+  else
+    {
+      // The messages of other batches (netsplit, netjoin, chathistory,
+      // etc) are handled together, in order
+      this->in_netsplit_batch = batch.type == "netsplit";
+      for (IrcMessage& batched: batch.messages)
+        {
+          batched.tags.erase("batch");
+          // All the messages of a labeled-response batch answer that label
+          if (!batch.label.empty())
+            batched.tags.emplace("label", batch.label);
+          this->dispatch_message(std::move(batched));
+        }
+      this->in_netsplit_batch = false;
+    }
+}
+
 void IrcClient::on_welcome_message(const IrcMessage& message)
 {
   this->current_nick = message.arguments[0];
   this->welcomed = true;
+  // The server ignored the negotiation
+  this->capabilities.abort();
 #ifdef USE_DATABASE
   auto options = Database::get_irc_server_options(this->bridge.get_bare_jid(),
                                                   this->get_hostname());
@@ -1002,15 +1359,17 @@ void IrcClient::on_part(const IrcMessage& message)
   std::string txt;
   if (message.arguments.size() >= 2)
     txt = message.arguments[1];
-  const IrcUser* user = channel->find_user(message.prefix);
+  const IrcChannelUser* user = channel->find_user(message.prefix);
   if (user)
     {
-      std::string nick = user->nick;
-      bool self = channel->get_self() && channel->get_self()->nick == nick;
-      auto user_ptr = channel->remove_user(user);
+      bool self = channel->get_self() == user;
+      auto removed_user = channel->remove_user(user);
+      if (!removed_user.announced)
+        return;
       if (self)
       {
         this->channels.erase(utils::tolower(chan_name));
+        this->echo_callbacks.erase(utils::tolower(chan_name));
         // channel pointer is now invalid
         channel = nullptr;
       }
@@ -1018,7 +1377,7 @@ void IrcClient::on_part(const IrcMessage& message)
       iid.set_local(chan_name);
       iid.set_server(this->hostname);
       iid.type = Iid::Type::Channel;
-      this->bridge.send_muc_leave(iid, *user_ptr, txt, self, true, {}, this);
+      this->bridge.send_muc_leave(iid, removed_user, txt, self, true, {}, this);
     }
 }
 
@@ -1038,6 +1397,9 @@ void IrcClient::on_error(const IrcMessage& message)
     this->bridge.send_muc_leave(iid, *channel->get_self(), leave_message, true, false, {}, this);
   }
   this->channels.clear();
+  this->echo_callbacks.clear();
+  this->netsplit_buffer.clear();
+  TimedEventsManager::instance().cancel("Netsplit" + this->hostname + this->bridge.get_jid());
   this->send_gateway_message("ERROR: " + leave_message);
 }
 
@@ -1046,16 +1408,31 @@ void IrcClient::on_quit(const IrcMessage& message)
   std::string txt;
   if (message.arguments.size() >= 1)
     txt = message.arguments[0];
+  // The leave presences of the users quitting in a netsplit are delayed,
+  // because most of them come back as soon as the servers are linked again
+  const auto netsplit_delay = std::chrono::seconds(Config::get_int("netsplit_delay", 15));
+  const bool netsplit = netsplit_delay.count() > 0 &&
+      (this->in_netsplit_batch || NetsplitBuffer::is_netsplit_message(txt));
   for (const auto& pair: this->channels)
     {
       const std::string& chan_name = pair.first;
       IrcChannel* channel = pair.second.get();
-      const IrcUser* user = channel->find_user(message.prefix);
+      const IrcChannelUser* user = channel->find_user(message.prefix);
       if (!user)
         continue;
       bool self = false;
       if (user == channel->get_self())
         self = true;
+      if (!user->announced)
+        {
+          channel->remove_user(user);
+          continue;
+        }
+      if (netsplit && !self)
+        {
+          this->netsplit_buffer.add(chan_name, channel->remove_user(user), txt);
+          continue;
+        }
       Iid iid;
       iid.set_local(chan_name);
       iid.set_server(this->hostname);
@@ -1063,32 +1440,48 @@ void IrcClient::on_quit(const IrcMessage& message)
       this->bridge.send_muc_leave(iid, *user, txt, self, false, {}, this);
       channel->remove_user(user);
     }
+  const std::string event_name = "Netsplit" + this->hostname + this->bridge.get_jid();
+  if (!this->netsplit_buffer.empty() && !TimedEventsManager::instance().find_event(event_name))
+    TimedEventsManager::instance().add_event(TimedEvent(std::chrono::steady_clock::now() + netsplit_delay,
+                                                        std::bind(&IrcClient::send_netsplit_departures, this),
+                                                        event_name));
+}
+
+void IrcClient::send_netsplit_departures()
+{
+  for (const auto& departure: this->netsplit_buffer.take_all())
+    {
+      const auto it = this->channels.find(departure.channel);
+      if (it == this->channels.end() || !it->second->joined)
+        continue;
+      Iid iid(departure.channel, this->hostname, Iid::Type::Channel);
+      // The user may also be back through a NAMES reply
+      const IrcChannelUser* user = it->second->find_user(departure.user.user->nick);
+      if (user)
+        {
+          const char mode = user->get_most_significant_mode(this->user_mode_ranks);
+          if (user->announced && mode != departure.user.get_most_significant_mode(this->user_mode_ranks))
+            this->bridge.send_affiliation_role_change(iid, user->user->nick, mode);
+        }
+      else if (!departure.returned)
+        this->bridge.send_muc_leave(iid, departure.user, departure.message, false, false, {}, this);
+    }
 }
 
 void IrcClient::on_nick(const IrcMessage& message)
 {
   const std::string new_nick = IrcUser(message.arguments[0]).nick;
   const std::string current_nick = IrcUser(message.prefix).nick;
-  const auto change_nick_func = [this, &new_nick, &current_nick](const std::string& chan_name, const IrcChannel* channel)
+  bool self = false;
+  const auto change_nick_func = [this, &new_nick, &current_nick, &self](const std::string& chan_name, const IrcChannel* channel)
   {
-    IrcUser* user;
-    if (channel->get_self() && channel->get_self()->nick == current_nick)
-      user = channel->get_self();
-    else
-      user = channel->find_user(current_nick);
-    if (user)
+    const IrcChannelUser* user = channel->find_user(current_nick);
+    if (user && user->announced)
       {
-        std::string old_nick = user->nick;
         Iid iid(chan_name, this->hostname, Iid::Type::Channel);
-        const bool self = channel->get_self()->nick == old_nick;
-        const char user_mode = user->get_most_significant_mode(this->sorted_user_modes);
-        this->bridge.send_nick_change(std::move(iid), old_nick, new_nick, user_mode, self);
-        user->nick = new_nick;
-        if (self)
-          {
-            channel->get_self()->nick = new_nick;
-            this->current_nick = new_nick;
-          }
+        self = channel->get_self() == user;
+        const char user_mode = user->get_most_significant_mode(this->user_mode_ranks);
+        this->bridge.send_nick_change(std::move(iid), current_nick, new_nick, user_mode, self);
       }
   };
 
@@ -1096,6 +1489,10 @@ void IrcClient::on_nick(const IrcMessage& message)
     {
       change_nick_func(pair.first, pair.second.get());
     }
+  // The user is shared by all the channels, it is renamed only once
+  this->user_table.rename(current_nick, new_nick);
+  if (self)
+    this->current_nick = new_nick;
 }
 
 void IrcClient::on_kick(const IrcMessage& message)
@@ -1106,7 +1503,7 @@ void IrcClient::on_kick(const IrcMessage& message)
   IrcChannel* channel = this->get_channel(chan_name);
   if (!channel->joined)
     return ;
-  const IrcUser* target = channel->find_user(target_nick);
+  const IrcChannelUser* target = channel->find_user(target_nick);
   if (!target)
     {
       log_warning("Received a KICK command from a nick absent from the channel.");
@@ -1114,7 +1511,15 @@ void IrcClient::on_kick(const IrcMessage& message)
     }
   const bool self = channel->get_self() == target;
   if (self)
-    channel->joined = false;
+    {
+      channel->joined = false;
+      this->echo_callbacks.erase(chan_name);
+    }
+  if (!target->announced)
+    {
+      channel->remove_user(target);
+      return;
+    }
   IrcUser author(message.prefix);
   Iid iid;
   iid.set_local(chan_name);
@@ -1176,7 +1581,7 @@ void IrcClient::on_channel_mode(const IrcMessage& message)
   this->bridge.send_message(iid, "", "Mode " + iid.get_local() +
                                       " [" + mode_arguments + "] by " + user.nick,
                              true, this->is_channel_joined(iid.get_local()));
-  const IrcChannel* channel = this->get_channel(iid.get_local());
+  IrcChannel* channel = this->get_channel(iid.get_local());
   if (!channel)
     return;
 
@@ -1186,7 +1591,7 @@ void IrcClient::on_channel_mode(const IrcMessage& message)
   // modes that now applies to each of them, and send a notification for
   // each one. This is to disallow sending two notifications or more when a
   // single MODE command changes two or more modes on the same participant
-  std::set<const IrcUser*> modified_users;
+  std::set<const IrcChannelUser*> modified_users;
   // If it is true, the modes are added, if it’s false they are
   // removed. When we encounter the '+' char, the value is changed to true,
   // and with '-' it is changed to false.
@@ -1208,14 +1613,10 @@ void IrcClient::on_channel_mode(const IrcMessage& message)
               break;
           if (type == 4)        // if mode was not found
             {
-              // That mode can also be of type B if it is present in the
-              // prefix_to_mode map
-              for (const auto& pair: this->prefix_to_mode)
-                if (pair.second == c)
-                  {
-                    type = 1;
-                    break;
-                  }
+              // That mode can also be of type B if it is one of the user
+              // modes given by PREFIX
+              if (this->user_mode_ranks.get_rank(c) != -1)
+                type = 1;
             }
           // modes of type A, B or C (but only with add == true)
           if (type == 0 || type == 1 ||
@@ -1226,7 +1627,7 @@ void IrcClient::on_channel_mode(const IrcMessage& message)
           if (use_arg == true && message.arguments.size() > arg_pos)
             {
               const std::string target = message.arguments[arg_pos++];
-              IrcUser* user = channel->find_user(target);
+              IrcChannelUser* user = channel->find_user(target);
               if (!user)
                 {
                   log_warning("Trying to set mode for non-existing user '", target
@@ -1234,23 +1635,30 @@ void IrcClient::on_channel_mode(const IrcMessage& message)
                   return;
                 }
               if (add)
-                user->add_mode(c);
+                user->modes.add(c, this->user_mode_ranks);
               else
-                user->remove_mode(c);
+                user->modes.remove(c, this->user_mode_ranks);
               modified_users.insert(user);
             }
         }
     }
-  for (const IrcUser* u: modified_users)
+  for (const IrcChannelUser* u: modified_users)
     {
-      char most_significant_mode = u->get_most_significant_mode(this->sorted_user_modes);
-      this->bridge.send_affiliation_role_change(iid, u->nick, most_significant_mode);
+      // It will be listed with its new mode
+      if (!u->announced)
+        continue;
+      // Its role is compared at the end of the netsplit
+      if (this->netsplit_buffer.has_returned(utils::tolower(iid.get_local()), u->user->nick))
+        continue;
+      char most_significant_mode = u->get_most_significant_mode(this->user_mode_ranks);
+      this->bridge.send_affiliation_role_change(iid, u->user->nick, most_significant_mode);
     }
 }
 
 void IrcClient::set_throttle_limit(long int limit)
 {
   this->tokens_bucket.set_limit(limit);
+  this->send_queued_messages();
 }
 
 void IrcClient::on_user_mode(const IrcMessage& message)
@@ -20,10 +20,16 @@
 #include <map>
 #include <set>
 #include <utils/tokens_bucket.hpp>
+#include <irc/irc_capabilities.hpp>
+#include <irc/netsplit_buffer.hpp>
 
 class IrcClient;
 
 using MessageCallback = std::function<void(const IrcClient*, const IrcMessage&)>;
+/**
+ * Messages that are throttled together, as if they were only one
+ */
+using MessageGroup = std::vector<std::pair<IrcMessage, MessageCallback>>;
 
 class Bridge;
 
@@ -66,6 +72,10 @@ public:
    * complete messages from it.
    */
   void parse_in_buffer(const size_t) override final;
+  /**
+   * Configured with the irc_read_size option
+   */
+  std::size_t get_read_size() const override final;
 #ifdef BOTAN_FOUND
   virtual bool abort_on_invalid_cert() const override final;
 #endif
@@ -91,8 +101,17 @@ public:
    * for send events to be ready)
    */
   void send_message(IrcMessage message, MessageCallback callback={}, bool throttle=true);
+  /**
+   * Send these messages in a row, using only one throttling token for all
+   * of them
+   */
+  void send_message_group(MessageGroup group, bool throttle=true);
   void send_raw(const std::string& txt);
   void actual_send(std::pair<IrcMessage, MessageCallback> message_pair);
+  /**
+   * Send the throttled messages, as long as the tokens bucket allows it
+   */
+  void send_queued_messages();
   /**
    * Send the PONG irc command
    */
@@ -123,6 +142,37 @@ public:
    */
   bool send_channel_message(const std::string& chan_name, const std::string& body,
                             MessageCallback callback);
+  /**
+   * Whether or not these lines can be sent as one message, in a
+   * draft/multiline batch.  That depends on the capabilities of the server
+   * and on the limits it announced.
+   */
+  bool can_send_multiline_message(const std::string& chan_name, const std::vector<std::string>& lines) const;
+  /**
+   * Send the lines in a draft/multiline batch.  The callback is called once,
+   * when the batch is sent (or when the server sends it back to us, with
+   * echo-message).
+   */
+  void send_channel_multiline_message(const std::string& chan_name, const std::vector<std::string>& lines,
+                                      MessageCallback callback);
+  /**
+   * With the echo-message capability, keep the callback of that message
+   * sent to that channel, and return an empty one: it
+   * is called by on_echo_message once the server sends the message back to
+   * us, so that the XMPP users only see the messages that were actually
+   * delivered.  With labeled-response, the message is given a label, to
+   * recognize its echo and its errors.  Otherwise the callback is returned
+   * as is, to be called when the message is sent.
+   */
+  MessageCallback wait_for_echo(const std::string& chan_name, IrcMessage& message,
+                                MessageCallback callback);
+  /**
+   * Call the callback kept for the message that the server sent back (found
+   * by its label, or else the oldest one).  The messages sent before it are
+   * never going to be sent back, their callbacks are dropped.  Return false
+   * if there is no callback for that message.
+   */
+  bool on_echo_message(const std::string& chan_name, const IrcMessage& message);
   /**
    * Send a PRIVMSG command for an user
    */
@@ -236,6 +286,17 @@ public:
    * received etc), send the self presence and topic to the XMPP user.
    */
   void on_channel_completely_joined(const IrcMessage& message);
+  /**
+   * Send the presences of some of the users that were not announced yet in
+   * the joined channels (see IrcChannel::lazy_user_list), and do it again a
+   * second later if some remain
+   */
+  void announce_lazy_users();
+  /**
+   * Send the presences of all the users of that channel that were not
+   * announced yet
+   */
+  void announce_all_users(const std::string& chan_name);
   void on_banlist(const IrcMessage& message);
   void on_banlist_end(const IrcMessage& message);
   /**
@@ -260,13 +321,28 @@ public:
    */
   void on_useronchannel(const IrcMessage& message);
   /**
-   * Handles most errors from the server by just forwarding the message to the user.
+   * Handles most errors from the server by just forwarding the message to
+   * the user.  If it concerns a message sent to a channel (which is refused
+   * because the channel is moderated, etc), that message will never be sent
+   * back to us: its echo callback is dropped.
    */
   void on_generic_error(const IrcMessage& message);
   /**
    * When a message 001 is received, join the rooms we wanted to join, and set our actual nickname
    */
   void on_welcome_message(const IrcMessage& message);
+  /**
+   * Handle the IRCv3 capabilities negotiation
+   */
+  void on_cap(const IrcMessage& message);
+  /**
+   * Start or end an IRCv3 batch.  The messages received with the tag of an
+   * open batch are kept until the end of the batch, and then handled
+   * together.
+   */
+  void on_batch(const IrcMessage& message);
+  const IrcCapabilities& get_capabilities() const
+  { return this->capabilities; }
   void on_part(const IrcMessage& message);
   void on_error(const IrcMessage& message);
   void on_invite(const IrcMessage& message);
@@ -286,6 +362,11 @@ public:
    */
   void on_channel_mode(const IrcMessage& message);
   void on_quit(const IrcMessage& message);
+  /**
+   * Send the leave presences of the users that left in a netsplit and did
+   * not come back during the netsplit_delay
+   */
+  void send_netsplit_departures();
   void on_unknown_message(const IrcMessage& message);
   /**
    * Return the number of joined channels
@@ -298,7 +379,9 @@ public:
 
   const Resolver& get_resolver() const { return this->dns_resolver; }
 
-  const std::vector<char>& get_sorted_user_modes() const { return this->sorted_user_modes; }
+  const Bridge& get_bridge() const { return this->bridge; }
+
+  const IrcUserModeRanks& get_user_mode_ranks() const { return this->user_mode_ranks; }
 
   std::set<char> get_chantypes() const { return this->chantypes; }
   void set_throttle_limit(long int limit);
@@ -341,7 +424,11 @@ private:
   /**
    * Where messaged are stored when they are throttled.
    */
-  std::deque<std::pair<IrcMessage, MessageCallback>> message_queue{};
+  std::deque<MessageGroup> message_queue{};
+  /**
+   * The users of all the channels below.  Must be destroyed after them.
+   */
+  IrcUserTable user_table;
   /**
    * The list of joined channels, indexed by name
    */
@@ -377,15 +464,10 @@ private:
   std::string motd;
   /**
    * See http://www.irc.org/tech_docs/draft-brocklesby-irc-isupport-03.txt section 3.14
-   * The example given would be transformed into
-   * modes_to_prefix = {{'&', 'a'}, {'*', 'b'}}
-   */
-  std::map<char, char> prefix_to_mode;
-  /**
-   * Available user modes, sorted from most significant to least significant
-   * (for example 'ahov' is a common order).
+   * The available user modes and their prefixes, ranked from most
+   * significant to least significant (for example 'ahov' is a common order).
    */
-  std::vector<char> sorted_user_modes;
+  IrcUserModeRanks user_mode_ranks;
   /**
    * A list of ports to which we will try to connect, in reverse. Each port
    * is associated with a boolean telling if we should use TLS or not if the
@@ -403,6 +485,62 @@ private:
   Resolver dns_resolver;
   TokensBucket tokens_bucket;
   long int get_throttle_limit() const;
+  IrcCapabilities capabilities;
+  struct Batch
+  {
+    std::string type;
+    std::vector<std::string> params;
+    std::vector<IrcMessage> messages;
+    // The label of our own message this batch responds to (labeled-response)
+    std::string label;
+  };
+  /**
+   * The batches received from the server that are not yet closed, by
+   * reference tag
+   */
+  std::map<std::string, Batch> batches;
+  /**
+   * Used to generate the reference tags of our batches
+   */
+  std::size_t next_batch_id{0};
+  /**
+   * Whether or not the messages of a netsplit batch are being handled
+   */
+  bool in_netsplit_batch{false};
+  NetsplitBuffer netsplit_buffer;
+  /**
+   * The maximum number of presences sent by each call of announce_lazy_users
+   */
+  static constexpr std::size_t lazy_users_per_second = 100;
+  struct EchoCallback
+  {
+    std::string label;
+    MessageCallback callback;
+  };
+  /**
+   * The callbacks of the messages sent to each channel, waiting for the
+   * server to send them back (see wait_for_echo), in the order they were
+   * sent
+   */
+  std::map<std::string, std::deque<EchoCallback>> echo_callbacks;
+  /**
+   * Used to generate the labels of our messages
+   */
+  std::size_t next_label_id{0};
+  /**
+   * Drop the oldest echo callback of that channel, or the one with the label
+   * of that message
+   */
+  void drop_echo_callback(const std::string& chan_name, const IrcMessage& message);
+  /**
+   * Call the handler associated with the command of that message, or keep
+   * it in its batch
+   */
+  void dispatch_message(IrcMessage&& message);
+  /**
+   * See get_read_size()
+   */
+  const std::size_t read_size;
 };
 
 
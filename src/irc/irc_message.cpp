@@ -1,10 +1,71 @@
 #include <irc/irc_message.hpp>
 #include <iostream>
 
+static std::string unescape_tag_value(const std::string& value)
+{
+  std::string res;
+  res.reserve(value.size());
+  for (std::string::size_type i = 0; i < value.size(); ++i)
+    {
+      if (value[i] != '\\')
+        res += value[i];
+      else if (++i < value.size())
+        {
+          switch (value[i])
+            {
+            case ':': res += ';'; break;
+            case 's': res += ' '; break;
+            case 'r': res += '\r'; break;
+            case 'n': res += '\n'; break;
+            default: res += value[i];
+            }
+        }
+    }
+  return res;
+}
+
+static std::string escape_tag_value(const std::string& value)
+{
+  std::string res;
+  res.reserve(value.size());
+  for (const char c: value)
+    {
+      switch (c)
+        {
+        case ';': res += "\\:"; break;
+        case ' ': res += "\\s"; break;
+        case '\\': res += "\\\\"; break;
+        case '\r': res += "\\r"; break;
+        case '\n': res += "\\n"; break;
+        default: res += c;
+        }
+    }
+  return res;
+}
+
 IrcMessage::IrcMessage(std::string&& line)
 {
   std::string::size_type pos;
 
+  // optional IRCv3 tags
+  if (line[0] == '@')
+    {
+      pos = line.find(' ');
+      std::string::size_type start = 1;
+      while (start < pos && start < line.size())
+        {
+          auto end = line.find(';', start);
+          if (end == std::string::npos || end > pos)
+            end = pos;
+          const auto equal = line.find('=', start);
+          if (equal == std::string::npos || equal > end)
+            this->tags[line.substr(start, end - start)];
+          else
+            this->tags[line.substr(start, equal - start)] = unescape_tag_value(line.substr(equal + 1, end - equal - 1));
+          start = end + 1;
+        }
+      line = line.substr(pos + 1, std::string::npos);
+    }
   // optional prefix
   if (line[0] == ':')
     {
@@ -47,6 +108,34 @@ IrcMessage::IrcMessage(std::string&& command,
 {
 }
 
+const std::string& IrcMessage::get_tag(const std::string& name) const
+{
+  static const std::string empty;
+  const auto it = this->tags.find(name);
+  if (it == this->tags.end())
+    return empty;
+  return it->second;
+}
+
+bool IrcMessage::has_tag(const std::string& name) const
+{
+  return this->tags.find(name) != this->tags.end();
+}
+
+std::string irc::serialize_tags(const std::map<std::string, std::string>& tags)
+{
+  std::string res;
+  for (const auto& pair: tags)
+    {
+      if (!res.empty())
+        res += ';';
+      res += pair.first;
+      if (!pair.second.empty())
+        res += '=' + escape_tag_value(pair.second);
+    }
+  return res;
+}
+
 std::ostream& operator<<(std::ostream& os, const IrcMessage& message)
 {
   os << "IrcMessage";
@@ -4,6 +4,7 @@
 #include <vector>
 #include <string>
 #include <ostream>
+#include <map>
 
 class IrcMessage
 {
@@ -18,11 +19,29 @@ public:
   IrcMessage& operator=(const IrcMessage&) = delete;
   IrcMessage& operator=(IrcMessage&&) = default;
 
+  /**
+   * Return the value of that IRCv3 tag, or an empty string
+   */
+  const std::string& get_tag(const std::string& name) const;
+  bool has_tag(const std::string& name) const;
+  /**
+   * The IRCv3 message tags, with their unescaped value (empty for the tags
+   * without value)
+   */
+  std::map<std::string, std::string> tags;
   std::string prefix;
   std::string command;
   std::vector<std::string> arguments;
 };
 
+namespace irc
+{
+  /**
+   * Return the tags, escaped and ready to be sent, without the leading @
+   */
+  std::string serialize_tags(const std::map<std::string, std::string>& tags);
+}
+
 std::ostream& operator<<(std::ostream& os, const IrcMessage& message);
 
 
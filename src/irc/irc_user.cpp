@@ -1,9 +1,89 @@
 #include <irc/irc_user.hpp>
 
-#include <iostream>
+constexpr std::size_t IrcUserModeRanks::max_modes;
+constexpr uint8_t IrcUserModeRanks::unknown;
+
+IrcUserModeRanks::IrcUserModeRanks()
+{
+  this->mode_ranks.fill(unknown);
+  this->prefix_ranks.fill(unknown);
+}
+
+void IrcUserModeRanks::set(const std::string& modes, const std::string& prefixes)
+{
+  this->sorted_modes.clear();
+  this->mode_ranks.fill(unknown);
+  this->prefix_ranks.fill(unknown);
+  for (std::size_t i = 0; i < modes.size() && i < prefixes.size() && i < max_modes; ++i)
+    {
+      const auto rank = static_cast<uint8_t>(i);
+      this->sorted_modes.push_back(modes[i]);
+      this->mode_ranks[static_cast<unsigned char>(modes[i])] = rank;
+      this->prefix_ranks[static_cast<unsigned char>(prefixes[i])] = rank;
+    }
+}
+
+IrcUserModes IrcUserModes::from_prefixes(const std::string& name,
+                                         const IrcUserModeRanks& ranks)
+{
+  IrcUserModes modes;
+  for (const char c: name)
+    {
+      const int rank = ranks.get_prefix_rank(c);
+      // This is not a prefix
+      if (rank == -1)
+        break;
+      modes.bits |= rank_to_bit(rank);
+    }
+  return modes;
+}
+
+uint64_t IrcUserModes::rank_to_bit(const int rank)
+{
+  if (rank == -1)
+    return 0;
+  return uint64_t{1} << (63 - rank);
+}
+
+void IrcUserModes::add(const char mode, const IrcUserModeRanks& ranks)
+{
+  this->bits |= rank_to_bit(ranks.get_rank(mode));
+}
+
+void IrcUserModes::remove(const char mode, const IrcUserModeRanks& ranks)
+{
+  this->bits &= ~rank_to_bit(ranks.get_rank(mode));
+}
+
+bool IrcUserModes::has(const char mode, const IrcUserModeRanks& ranks) const
+{
+  const auto bit = rank_to_bit(ranks.get_rank(mode));
+  return bit != 0 && (this->bits & bit) == bit;
+}
+
+bool IrcUserModes::empty() const
+{
+  return this->bits == 0;
+}
+
+std::size_t IrcUserModes::size() const
+{
+  return static_cast<std::size_t>(__builtin_popcountll(this->bits));
+}
+
+char IrcUserModes::get_most_significant(const IrcUserModeRanks& ranks) const
+{
+  if (this->bits == 0)
+    return 0;
+  const auto rank = static_cast<std::size_t>(__builtin_clzll(this->bits));
+  // The ranks may have changed since the modes were set
+  if (rank >= ranks.get_sorted_modes().size())
+    return 0;
+  return ranks.get_mode(rank);
+}
 
 IrcUser::IrcUser(const std::string& name,
-                 const std::map<char, char>& prefix_to_mode)
+                 const IrcUserModeRanks& ranks)
 {
   if (name.empty())
     return ;
@@ -11,15 +91,9 @@ IrcUser::IrcUser(const std::string& name,
   // One or more prefix (with multi-prefix support) may come before the
   // actual nick
   std::string::size_type name_begin = 0;
-  while (name_begin != name.size())
-    {
-      const auto prefix = prefix_to_mode.find(name[name_begin]);
-      // This is not a prefix
-      if (prefix == prefix_to_mode.end())
-        break;
-      this->modes.insert(prefix->second);
-      name_begin++;
-    }
+  while (name_begin != name.size() &&
+         ranks.get_prefix_rank(name[name_begin]) != -1)
+    name_begin++;
 
   const std::string::size_type sep = name.find('!', name_begin);
   if (sep == std::string::npos)
@@ -31,27 +105,60 @@ IrcUser::IrcUser(const std::string& name,
     }
 }
 
+static const IrcUserModeRanks& no_mode_ranks()
+{
+  static const IrcUserModeRanks ranks;
+  return ranks;
+}
+
 IrcUser::IrcUser(const std::string& name):
-  IrcUser(name, {})
+  IrcUser(name, no_mode_ranks())
+{
+}
+
+std::shared_ptr<IrcUser> IrcUserTable::get(const std::string& nick, const std::string& host)
 {
+  auto& entry = this->users[nick];
+  auto user = entry.lock();
+  if (!user)
+    {
+      user = std::shared_ptr<IrcUser>(new IrcUser(nick),
+                                      [this](IrcUser* u)
+                                      {
+                                        this->forget(u);
+                                        delete u;
+                                      });
+      entry = user;
+    }
+  if (!host.empty())
+    user->host = host;
+  return user;
 }
 
-void IrcUser::add_mode(const char mode)
+IrcUser* IrcUserTable::find(const std::string& nick) const
 {
-  this->modes.insert(mode);
+  const auto it = this->users.find(nick);
+  if (it == this->users.end())
+    return nullptr;
+  return it->second.lock().get();
 }
 
-void IrcUser::remove_mode(const char mode)
+void IrcUserTable::rename(const std::string& old_nick, const std::string& new_nick)
 {
-  this->modes.erase(mode);
+  const auto it = this->users.find(old_nick);
+  if (it == this->users.end())
+    return;
+  auto user = it->second.lock();
+  this->users.erase(it);
+  if (!user)
+    return;
+  user->nick = new_nick;
+  this->users[new_nick] = user;
 }
 
-char IrcUser::get_most_significant_mode(const std::vector<char>& modes) const
+void IrcUserTable::forget(const IrcUser* user)
 {
-  for (const char mode: modes)
-    {
-      if (this->modes.find(mode) != this->modes.end())
-        return mode;
-    }
-  return 0;
+  const auto it = this->users.find(user->nick);
+  if (it != this->users.end() && it->second.expired())
+    this->users.erase(it);
 }
@@ -1,19 +1,99 @@
 #pragma once
 
 
+#include <unordered_map>
+#include <cstdint>
+#include <memory>
 #include <vector>
 #include <string>
-#include <map>
-#include <set>
+#include <array>
 
 /**
- * Keeps various information about one IRC channel user
+ * The user modes that can be given in a channel (o, v, etc) and their
+ * prefixes (@, +, etc), as announced by the PREFIX ISUPPORT token.  Each
+ * mode gets a rank: 0 for the most significant one, 1 for the next, etc.
+ */
+class IrcUserModeRanks
+{
+public:
+  /**
+   * At most that many modes are kept, the next ones are ignored
+   */
+  static constexpr std::size_t max_modes = 64;
+
+  IrcUserModeRanks();
+  /**
+   * Replace the known modes.  Both strings are given from the most to the
+   * least significant mode, for example "ov" and "@+"
+   */
+  void set(const std::string& modes, const std::string& prefixes);
+  /**
+   * Return the rank of that mode, or -1 if it is not a known user mode
+   */
+  int get_rank(const char mode) const
+  { return rank_or_minus_one(this->mode_ranks[static_cast<unsigned char>(mode)]); }
+  /**
+   * Return the rank of the mode given by that prefix, or -1 if it is not a
+   * known prefix
+   */
+  int get_prefix_rank(const char prefix) const
+  { return rank_or_minus_one(this->prefix_ranks[static_cast<unsigned char>(prefix)]); }
+  char get_mode(const std::size_t rank) const
+  { return this->sorted_modes[rank]; }
+  const std::vector<char>& get_sorted_modes() const
+  { return this->sorted_modes; }
+
+private:
+  static constexpr uint8_t unknown = 0xff;
+  static int rank_or_minus_one(const uint8_t rank)
+  { return rank == unknown ? -1 : rank; }
+  std::vector<char> sorted_modes;
+  std::array<uint8_t, 256> mode_ranks;
+  std::array<uint8_t, 256> prefix_ranks;
+};
+
+/**
+ * The modes (o, v, etc) of one user in one channel, kept as a bitmask:
+ * the mode of rank 0 is the highest bit, so the most significant mode is
+ * found by counting the leading zeros.
+ */
+class IrcUserModes
+{
+public:
+  IrcUserModes() = default;
+  /**
+   * Return the modes given by the prefixes (@, +, etc, and more than one
+   * of them with multi-prefix support) at the start of that name
+   */
+  static IrcUserModes from_prefixes(const std::string& name,
+                                    const IrcUserModeRanks& ranks);
+
+  void add(const char mode, const IrcUserModeRanks& ranks);
+  void remove(const char mode, const IrcUserModeRanks& ranks);
+  bool has(const char mode, const IrcUserModeRanks& ranks) const;
+  bool empty() const;
+  std::size_t size() const;
+  /**
+   * Return the most significant mode that is set, or 0 if none is
+   */
+  char get_most_significant(const IrcUserModeRanks& ranks) const;
+
+private:
+  /**
+   * Modes that are not known are ignored
+   */
+  static uint64_t rank_to_bit(const int rank);
+  uint64_t bits{0};
+};
+
+/**
+ * Keeps various information about one IRC user
  */
 class IrcUser
 {
 public:
   explicit IrcUser(const std::string& name,
-                   const std::map<char, char>& prefix_to_mode);
+                   const IrcUserModeRanks& ranks);
   explicit IrcUser(const std::string& name);
 
   IrcUser(const IrcUser&) = delete;
@@ -21,13 +101,54 @@ public:
   IrcUser& operator=(const IrcUser&) = delete;
   IrcUser& operator=(IrcUser&&) = delete;
 
-  void add_mode(const char mode);
-  void remove_mode(const char mode);
-  char get_most_significant_mode(const std::vector<char>& modes) const;
-
   std::string nick;
   std::string host;
-  std::set<char> modes;
 };
 
+/**
+ * One user in one IrcChannel: the IrcUser, shared with all the other
+ * channels of the same IrcClient, and its modes in that channel
+ */
+struct IrcChannelUser
+{
+  std::shared_ptr<IrcUser> user;
+  IrcUserModes modes;
+  /**
+   * Whether or not the XMPP users received the presence of that user in
+   * the channel (see IrcChannel::lazy_user_list)
+   */
+  bool announced{true};
+
+  char get_most_significant_mode(const IrcUserModeRanks& ranks) const
+  { return this->modes.get_most_significant(ranks); }
+};
 
+/**
+ * All the IrcUsers present in the channels of one IrcClient, indexed by
+ * nick, so that a user sitting in many channels is only stored once.  A
+ * user is forgotten as soon as it is not referenced by any channel anymore.
+ */
+class IrcUserTable
+{
+public:
+  IrcUserTable() = default;
+
+  IrcUserTable(const IrcUserTable&) = delete;
+  IrcUserTable(IrcUserTable&&) = delete;
+  IrcUserTable& operator=(const IrcUserTable&) = delete;
+  IrcUserTable& operator=(IrcUserTable&&) = delete;
+
+  /**
+   * Return the user with that nick, creating it if needed.  The host is
+   * updated if the given one is not empty.
+   */
+  std::shared_ptr<IrcUser> get(const std::string& nick, const std::string& host);
+  IrcUser* find(const std::string& nick) const;
+  void rename(const std::string& old_nick, const std::string& new_nick);
+  std::size_t size() const
+  { return this->users.size(); }
+
+private:
+  void forget(const IrcUser* user);
+  std::unordered_map<std::string, std::weak_ptr<IrcUser>> users;
+};
@@ -0,0 +1,67 @@
+#include <irc/netsplit_buffer.hpp>
+
+bool NetsplitBuffer::is_netsplit_message(const std::string& message)
+{
+  const auto space = message.find(' ');
+  if (space == std::string::npos || space == 0 || space == message.size() - 1)
+    return false;
+  const std::string first = message.substr(0, space);
+  const std::string second = message.substr(space + 1);
+  const auto is_server_name = [](const std::string& name)
+  {
+    const auto dot = name.find('.');
+    if (dot == std::string::npos || dot == 0 || dot == name.size() - 1)
+      return false;
+    for (const char c: name)
+      {
+        if (!((c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z') ||
+              (c >= '0' && c <= '9') || c == '.' || c == '-' || c == '*'))
+          return false;
+      }
+    return true;
+  };
+  return first != second && is_server_name(first) && is_server_name(second);
+}
+
+void NetsplitBuffer::add(const std::string& channel, IrcChannelUser&& user, const std::string& message)
+{
+  if (!user.user)
+    return;
+  auto key = std::make_pair(channel, user.user->nick);
+  const auto it = this->index.find(key);
+  if (it != this->index.end())
+    { // It came back and left again: the XMPP users still know it with
+      // the modes it had when it first left
+      Departure& departure = this->departures[it->second];
+      user.modes = departure.user.modes;
+      departure = {channel, std::move(user), message};
+      return;
+    }
+  this->index.emplace(std::move(key), this->departures.size());
+  this->departures.push_back({channel, std::move(user), message});
+}
+
+bool NetsplitBuffer::cancel(const std::string& channel, const std::string& nick)
+{
+  const auto it = this->index.find(std::make_pair(channel, nick));
+  if (it == this->index.end())
+    return false;
+  Departure& departure = this->departures[it->second];
+  if (departure.returned)
+    return false;
+  departure.returned = true;
+  return true;
+}
+
+bool NetsplitBuffer::has_returned(const std::string& channel, const std::string& nick) const
+{
+  const auto it = this->index.find(std::make_pair(channel, nick));
+  return it != this->index.end() && this->departures[it->second].returned;
+}
+
+std::vector<NetsplitBuffer::Departure> NetsplitBuffer::take_all()
+{
+  std::vector<Departure> res = std::move(this->departures);
+  this->clear();
+  return res;
+}
@@ -0,0 +1,81 @@
+#pragma once
+
+#include <irc/irc_user.hpp>
+
+#include <utility>
+#include <string>
+#include <vector>
+#include <map>
+
+/**
+ * The users that left some channels because of a netsplit, and for which
+ * the leave presences are not sent yet.  If they join the same channel
+ * again before the end of the netsplit_delay, their departure is forgotten
+ * and nothing at all is sent to the XMPP users, except a role change if
+ * their modes are not the same at the end of the netsplit_delay as before
+ * the netsplit.
+ */
+class NetsplitBuffer
+{
+public:
+  struct Departure
+  {
+    std::string channel;
+    /**
+     * The user, with the modes it had before the netsplit
+     */
+    IrcChannelUser user;
+    std::string message;
+    /**
+     * Whether or not the user joined the channel again
+     */
+    bool returned{false};
+  };
+
+  NetsplitBuffer() = default;
+  ~NetsplitBuffer() = default;
+
+  NetsplitBuffer(const NetsplitBuffer&) = delete;
+  NetsplitBuffer(NetsplitBuffer&&) = delete;
+  NetsplitBuffer& operator=(const NetsplitBuffer&) = delete;
+  NetsplitBuffer& operator=(NetsplitBuffer&&) = delete;
+
+  /**
+   * Whether or not that QUIT message is the one sent by the servers when a
+   * netsplit happens: the names of the two servers that got disconnected
+   * from each other, for example "irc.example.com irc.example.org", or
+   * "*.net *.split" on the networks that hide their servers.
+   */
+  static bool is_netsplit_message(const std::string& message);
+
+  void add(const std::string& channel, IrcChannelUser&& user, const std::string& message);
+  /**
+   * If that nick left that channel in a netsplit, mark it as returned and
+   * return true.  Its departure is kept until take_all(), to compare its
+   * modes then: the servers usually give back the modes of the users a
+   * little after they join again.
+   */
+  bool cancel(const std::string& channel, const std::string& nick);
+  bool has_returned(const std::string& channel, const std::string& nick) const;
+  /**
+   * Return all the departures, in the order they happened, and forget
+   * about them.
+   */
+  std::vector<Departure> take_all();
+  bool empty() const
+  { return this->departures.empty(); }
+  std::size_t size() const
+  { return this->departures.size(); }
+  void clear()
+  { this->departures.clear(); this->index.clear(); }
+
+private:
+  /**
+   * The departures, by order of arrival
+   */
+  std::vector<Departure> departures;
+  /**
+   * The position of each departure in the list, by channel and nick
+   */
+  std::map<std::pair<std::string, std::string>, std::size_t> index;
+};
@@ -1,9 +1,15 @@
 #include <logger/logger.hpp>
 #include <config/config.hpp>
 
+#include <utils/scopeguard.hpp>
+
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <unistd.h>
+#include <pthread.h>
+#include <csignal>
+
+using namespace std::chrono_literals;
 
 Logger::Logger(const int log_level):
   log_level(log_level),
@@ -41,6 +47,16 @@ Logger::Logger(const int log_level, const std::string& log_file):
 {
 }
 
+Logger::~Logger()
+{
+  if (this->writer.joinable())
+    {
+      this->stopping = true;
+      this->condition.notify_one();
+      this->writer.join();
+    }
+}
+
 std::unique_ptr<Logger>& Logger::instance()
 {
   static std::unique_ptr<Logger> instance;
@@ -53,6 +69,10 @@ std::unique_ptr<Logger>& Logger::instance()
         instance = std::make_unique<Logger>(log_level);
       else
         instance = std::make_unique<Logger>(log_level, log_file);
+      const int buffer_size = Config::get_int("log_buffer_size", 0);
+      if (buffer_size > 0)
+        instance->start_writer_thread(static_cast<std::size_t>(buffer_size),
+                                      Config::get("log_buffer_full", "drop") == "block");
     }
   return instance;
 }
@@ -63,3 +83,88 @@ std::ostream& Logger::get_stream(const int lvl)
     return this->stream;
   return this->null_stream;
 }
+
+void Logger::start_writer_thread(const std::size_t buffer_size, const bool block_when_full)
+{
+  this->queue = std::make_unique<utils::RingBuffer<LogLine>>(buffer_size);
+  this->block_when_full = block_when_full;
+  // The signals must only be delivered to the main thread, whose poller
+  // is interrupted by them: the writer thread is started with all of them
+  // blocked, whether or not the main thread already blocked them
+  sigset_t all_signals;
+  sigset_t previous_signals;
+  ::sigfillset(&all_signals);
+  ::pthread_sigmask(SIG_SETMASK, &all_signals, &previous_signals);
+  utils::ScopeGuard restore_signals([&previous_signals]()
+  {
+    ::pthread_sigmask(SIG_SETMASK, &previous_signals, nullptr);
+  });
+  this->writer = std::thread(&Logger::writer_loop, this);
+}
+
+void Logger::push(LogLine&& line)
+{
+  while (!this->queue->push(std::move(line)))
+    {
+      if (!this->block_when_full)
+        {
+          this->dropped_lines++;
+          this->unreported_dropped_lines++;
+          return;
+        }
+      this->condition.notify_one();
+      std::this_thread::yield();
+    }
+  this->condition.notify_one();
+}
+
+void Logger::write(const LogLine& line)
+{
+#ifdef SYSTEMD_FOUND
+  if (this->use_systemd)
+    {
+      sd_journal_send("MESSAGE=%s", line.message.data(),
+                      "PRIORITY=%i", line.syslog_level,
+                      "CODE_FILE=%s", line.src_file,
+                      "CODE_LINE=%i", line.line,
+                      nullptr);
+      return;
+    }
+#endif
+  static const char* priority_names[] = {"DEBUG", "INFO", "WARNING", "ERROR"};
+  this->stream << '[' << priority_names[line.level] << "]: " << line.src_file << ':' << line.line << ":\t"
+               << line.message;
+}
+
+void Logger::writer_loop()
+{
+  LogLine line;
+  while (true)
+    {
+      // Read this before emptying the queue, to be sure that everything
+      // pushed before the stop request is written
+      const bool stop = this->stopping;
+      bool written = false;
+      while (this->queue->pop(line))
+        {
+          this->write(line);
+          written = true;
+        }
+      const auto dropped = this->unreported_dropped_lines.exchange(0);
+      if (dropped > 0)
+        {
+          this->write({warning_lvl, LOG_WARNING, __FILENAME__, __LINE__,
+                       std::to_string(dropped) + " log lines dropped, because the log buffer was full\n"});
+          written = true;
+        }
+      // Flush once for the whole batch, instead of once per line
+      if (written)
+        this->stream.flush();
+      if (stop)
+        return;
+      std::unique_lock<std::mutex> lock(this->mutex);
+      this->condition.wait_for(lock, 100ms, [this]() {
+        return !this->queue->empty() || this->stopping;
+      });
+    }
+}
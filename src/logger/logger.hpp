@@ -8,18 +8,30 @@
  * @class Logger
  */
 
+#include <condition_variable>
 #include <memory>
 #include <string>
+#include <atomic>
+#include <thread>
+#include <mutex>
 #include <iostream>
 #include <fstream>
 #include <sstream>
 
+#include <utils/ring_buffer.hpp>
+
 #define debug_lvl 0
 #define info_lvl 1
 #define warning_lvl 2
 #define error_lvl 3
 
 #include "biboumi.h"
+
+// The log lines with a level lower than this are removed at compile time,
+// whatever the log_level value in the configuration is
+#ifndef MIN_LOG_LEVEL
+# define MIN_LOG_LEVEL debug_lvl
+#endif
 #ifdef SYSTEMD_FOUND
 #define SD_JOURNAL_SUPPRESS_LOCATION
 # include <systemd/sd-daemon.h>
@@ -52,6 +64,18 @@ class NullBuffer: public std::streambuf
   int overflow(int c) { return c; }
 };
 
+/**
+ * A log line waiting to be written by the writer thread
+ */
+struct LogLine
+{
+  int level;
+  int syslog_level;
+  const char* src_file;
+  int line;
+  std::string message;
+};
+
 class Logger
 {
 public:
@@ -59,6 +83,7 @@ public:
   std::ostream& get_stream(const int);
   Logger(const int log_level, const std::string& log_file);
   Logger(const int log_level);
+  ~Logger();
 
   Logger(const Logger&) = delete;
   Logger& operator=(const Logger&) = delete;
@@ -74,17 +99,67 @@ public:
   bool use_systemd{false};
 #endif
 
+  /**
+   * Start a thread that writes all the log lines, so that the caller
+   * never waits for the disk or journald.  The lines are queued in a
+   * buffer of the given size.  When it is full, the new lines are dropped,
+   * or the caller waits for some room if block_when_full is true.
+   */
+  void start_writer_thread(const std::size_t buffer_size, const bool block_when_full);
+  bool is_asynchronous() const
+  {
+    return this->queue != nullptr;
+  }
+  /**
+   * Queue the line, to be written by the writer thread
+   */
+  void push(LogLine&& line);
+  /**
+   * Write the line right now
+   */
+  void write(const LogLine& line);
+  /**
+   * The total number of lines dropped because the buffer was full
+   */
+  std::size_t get_dropped_lines() const
+  {
+    return this->dropped_lines;
+  }
+
   const int log_level;
 private:
+  void writer_loop();
+
   std::ofstream ofstream{};
   std::ostream stream;
 
   NullBuffer null_buffer;
   std::ostream null_stream;
+
+  std::unique_ptr<utils::RingBuffer<LogLine>> queue;
+  bool block_when_full{false};
+  std::thread writer;
+  std::mutex mutex;
+  std::condition_variable condition;
+  std::atomic<bool> stopping{false};
+  std::atomic<std::size_t> dropped_lines{0};
+  /**
+   * The dropped lines that the writer thread did not yet report in the logs
+   */
+  std::atomic<std::size_t> unreported_dropped_lines{0};
 };
 
 namespace logging_details
 {
+  /**
+   * Whether a line with the given level would be written.  The macros check
+   * this before evaluating their arguments.
+   */
+  inline bool is_enabled(const int level)
+  {
+    return level >= MIN_LOG_LEVEL && level >= Logger::instance()->log_level;
+  }
+
   template <typename T>
   void log(std::ostream& os, const T& arg)
   {
@@ -101,6 +176,13 @@ namespace logging_details
   template <typename... U>
   void do_logging(const int level, int syslog_level, const char* src_file, int line, U&&... args)
   {
+    if (Logger::instance()->is_asynchronous())
+      {
+        std::ostringstream os;
+        log(os, std::forward<U>(args)...);
+        Logger::instance()->push({level, syslog_level, src_file, line, os.str()});
+        return;
+      }
   #ifdef SYSTEMD_FOUND
     if (Logger::instance()->use_systemd)
       {
@@ -130,10 +212,15 @@ namespace logging_details
   }
 }
 
-#define log_debug(...) logging_details::do_logging(debug_lvl, LOG_DEBUG, __FILENAME__, __LINE__, __VA_ARGS__)
+#define log_with_level(level, syslog_level, ...) do { \
+    if (logging_details::is_enabled(level)) \
+      logging_details::do_logging(level, syslog_level, __FILENAME__, __LINE__, __VA_ARGS__); \
+  } while (false)
+
+#define log_debug(...) log_with_level(debug_lvl, LOG_DEBUG, __VA_ARGS__)
 
-#define log_info(...) logging_details::do_logging(info_lvl, LOG_INFO, __FILENAME__, __LINE__, __VA_ARGS__)
+#define log_info(...) log_with_level(info_lvl, LOG_INFO, __VA_ARGS__)
 
-#define log_warning(...) logging_details::do_logging(warning_lvl, LOG_WARNING, __FILENAME__, __LINE__, __VA_ARGS__)
+#define log_warning(...) log_with_level(warning_lvl, LOG_WARNING, __VA_ARGS__)
 
-#define log_error(...) logging_details::do_logging(error_lvl, LOG_ERR, __FILENAME__, __LINE__, __VA_ARGS__)
+#define log_error(...) log_with_level(error_lvl, LOG_ERR, __VA_ARGS__)
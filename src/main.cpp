@@ -101,12 +101,24 @@ static int main_loop(std::string hostname, std::string password)
 
   auto xmpp_component =
     std::make_shared<BiboumiComponent>(p, hostname, password);
-  xmpp_component->start();
+  const auto streams = xmpp_component->get_streams();
+  for (XmppComponent* stream: streams)
+    stream->start();
 
   std::unique_ptr<IdentdServer> identd;
   if (Config::get_int("identd_port", 113) != 0)
     identd = std::make_unique<IdentdServer>(*xmpp_component, p, static_cast<uint16_t>(Config::get_int("identd_port", 113)));
 
+  // The bridges, IrcClients and identd sockets are marked as dirty whenever
+  // they may need to be removed, and only those are checked after each
+  // poll.  Everything is still checked from time to time, just in case
+  TimedEventsManager::instance().add_event(TimedEvent(60s, [&xmpp_component, &identd]()
+                                                      {
+                                                        xmpp_component->clean(true);
+                                                        if (identd)
+                                                          identd->clean(true);
+                                                      }, "Full clean"));
+
   auto timeout = TimedEventsManager::instance().get_timeout();
   while (p->poll(timeout) != -1)
   {
@@ -130,8 +142,11 @@ static int main_loop(std::string hostname, std::string password)
 #endif
       if (identd)
         identd->shutdown();
-      // Cancel the timer for a potential reconnection
+      TimedEventsManager::instance().cancel("Full clean");
+      // Cancel the timers for a potential reconnection
       TimedEventsManager::instance().cancel("XMPP reconnection");
+      for (std::size_t i = 1; i < streams.size(); ++i)
+        TimedEventsManager::instance().cancel("XMPP reconnection " + std::to_string(i));
     }
     if (reload)
     {
@@ -145,42 +160,53 @@ static int main_loop(std::string hostname, std::string password)
     // still reconnect automatically instead of dropping everything
     if (!exiting &&
         !xmpp_component->is_connected() &&
-        !xmpp_component->is_connecting())
-    {
-      if (xmpp_component->ever_auth)
-        {
-          static const std::string reconnect_name{"XMPP reconnection"};
-          if (xmpp_component->first_connection_try == true)
-            { // immediately re-try to connect
-              xmpp_component->reset();
-              xmpp_component->start();
-            }
-          else if (!TimedEventsManager::instance().find_event(reconnect_name))
-            { // Re-connecting failed, we now try only each few seconds
-              auto reconnect_later = [xmpp_component]()
-              {
-                xmpp_component->reset();
-                xmpp_component->start();
-              };
-              TimedEvent event(std::chrono::steady_clock::now() + 2s, reconnect_later, reconnect_name);
-              TimedEventsManager::instance().add_event(std::move(event));
-            }
-        }
-      else
-        {
+        !xmpp_component->is_connecting() &&
+        !xmpp_component->ever_auth)
+      {
 #ifdef UDNS_FOUND
-          dns_handler.destroy();
+        dns_handler.destroy();
 #endif
-          if (identd)
-            identd->shutdown();
-        }
-    }
-    // If the only existing connection is the one to the XMPP component:
-    // close the XMPP stream.
-    if (exiting && xmpp_component->is_connecting())
-      xmpp_component->close();
-    if (exiting && p->size() == 1 && xmpp_component->is_document_open())
-      xmpp_component->close_document();
+        if (identd)
+          identd->shutdown();
+        for (XmppComponent* stream: streams)
+          if (stream->is_connected() || stream->is_connecting())
+            stream->close();
+      }
+    std::size_t connected_streams = 0;
+    for (std::size_t i = 0; i < streams.size(); ++i)
+      {
+        XmppComponent* stream = streams[i];
+        if (!exiting && xmpp_component->ever_auth &&
+            !stream->is_connected() && !stream->is_connecting())
+          {
+            const std::string reconnect_name = i == 0 ? std::string{"XMPP reconnection"}: "XMPP reconnection " + std::to_string(i);
+            if (stream->first_connection_try == true && stream->ever_auth)
+              { // immediately re-try to connect
+                stream->reset();
+                stream->start();
+              }
+            else if (!TimedEventsManager::instance().find_event(reconnect_name))
+              { // Re-connecting failed, we now try only each few seconds
+                auto reconnect_later = [stream]()
+                {
+                  stream->reset();
+                  stream->start();
+                };
+                TimedEvent event(std::chrono::steady_clock::now() + 2s, reconnect_later, reconnect_name);
+                TimedEventsManager::instance().add_event(std::move(event));
+              }
+          }
+        if (exiting && stream->is_connecting())
+          stream->close();
+        if (stream->is_connected())
+          connected_streams++;
+      }
+    // If the only existing connections are the ones to the XMPP server:
+    // close the XMPP streams.
+    if (exiting && p->size() == connected_streams)
+      for (XmppComponent* stream: streams)
+        if (stream->is_document_open())
+          stream->close_document();
     if (exiting) // If we are exiting, do not wait for any timed event
       timeout = utils::no_timeout;
     else
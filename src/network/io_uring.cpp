@@ -0,0 +1,219 @@
+#include <network/io_uring.hpp>
+
+#if POLLER == IO_URING
+
+#include <sys/mman.h>
+#include <sys/syscall.h>
+#include <unistd.h>
+
+#include <algorithm>
+#include <cerrno>
+#include <cstdint>
+#include <cstring>
+#include <stdexcept>
+#include <string>
+
+using namespace std::string_literals;
+
+namespace
+{
+  int io_uring_setup(const unsigned entries, struct io_uring_params* params)
+  {
+    return static_cast<int>(::syscall(__NR_io_uring_setup, entries, params));
+  }
+
+  int io_uring_register(const int fd, const unsigned opcode, const void* arg, const unsigned nr_args)
+  {
+    return static_cast<int>(::syscall(__NR_io_uring_register, fd, opcode, arg, nr_args));
+  }
+
+  void* map(const std::size_t size, const int fd, const off_t offset)
+  {
+    void* res;
+    if (fd == -1)
+      res = ::mmap(nullptr, size, PROT_READ|PROT_WRITE, MAP_PRIVATE|MAP_ANONYMOUS, -1, 0);
+    else
+      res = ::mmap(nullptr, size, PROT_READ|PROT_WRITE, MAP_SHARED|MAP_POPULATE, fd, offset);
+    if (res == MAP_FAILED)
+      throw std::runtime_error("mmap failed: "s + std::strerror(errno));
+    return res;
+  }
+
+  template <typename T>
+  T* at_offset(void* base, const unsigned offset)
+  {
+    return reinterpret_cast<T*>(static_cast<char*>(base) + offset);
+  }
+}
+
+IoUring::IoUring(const unsigned entries, const unsigned buffers_number,
+                 const std::size_t buffer_size):
+  fd(-1),
+  sq_ring(nullptr),
+  sq_ring_size(0),
+  cq_ring(nullptr),
+  cq_ring_size(0),
+  sqes(nullptr),
+  sqes_size(0),
+  sq_tail(0),
+  buf_ring(nullptr),
+  buf_ring_size(0),
+  buf_ring_tail(0),
+  buffers(nullptr),
+  buffer_size(buffer_size),
+  buffers_number(buffers_number)
+{
+  struct io_uring_params params{};
+  // The task work is only run when we enter the kernel to wait for
+  // completions anyway: no need to interrupt us for that
+  params.flags = IORING_SETUP_COOP_TASKRUN|IORING_SETUP_SUBMIT_ALL;
+  this->fd = io_uring_setup(entries, &params);
+  if (this->fd == -1 && errno == EINVAL)
+    {
+      params = {};
+      this->fd = io_uring_setup(entries, &params);
+    }
+  if (this->fd == -1)
+    throw std::runtime_error("io_uring_setup failed: "s + std::strerror(errno));
+
+  try {
+    if (!(params.features & IORING_FEAT_EXT_ARG))
+      throw std::runtime_error("the kernel does not support IORING_FEAT_EXT_ARG");
+
+    this->sq_ring_size = params.sq_off.array + params.sq_entries * sizeof(unsigned);
+    this->cq_ring_size = params.cq_off.cqes + params.cq_entries * sizeof(struct io_uring_cqe);
+    if (params.features & IORING_FEAT_SINGLE_MMAP)
+      this->sq_ring_size = this->cq_ring_size = std::max(this->sq_ring_size, this->cq_ring_size);
+    this->sq_ring = map(this->sq_ring_size, this->fd, IORING_OFF_SQ_RING);
+    if (params.features & IORING_FEAT_SINGLE_MMAP)
+      this->cq_ring = this->sq_ring;
+    else
+      this->cq_ring = map(this->cq_ring_size, this->fd, IORING_OFF_CQ_RING);
+    this->sqes_size = params.sq_entries * sizeof(struct io_uring_sqe);
+    this->sqes = static_cast<struct io_uring_sqe*>(map(this->sqes_size, this->fd, IORING_OFF_SQES));
+
+    this->sq_khead = at_offset<unsigned>(this->sq_ring, params.sq_off.head);
+    this->sq_ktail = at_offset<unsigned>(this->sq_ring, params.sq_off.tail);
+    this->sq_mask = *at_offset<unsigned>(this->sq_ring, params.sq_off.ring_mask);
+    this->sq_entries = params.sq_entries;
+    this->sq_tail = *this->sq_ktail;
+    // Each slot of the array always designates the sqe at the same index
+    unsigned* array = at_offset<unsigned>(this->sq_ring, params.sq_off.array);
+    for (unsigned i = 0; i < params.sq_entries; ++i)
+      array[i] = i;
+
+    this->cq_khead = at_offset<unsigned>(this->cq_ring, params.cq_off.head);
+    this->cq_ktail = at_offset<unsigned>(this->cq_ring, params.cq_off.tail);
+    this->cq_mask = *at_offset<unsigned>(this->cq_ring, params.cq_off.ring_mask);
+    this->cqes = at_offset<struct io_uring_cqe>(this->cq_ring, params.cq_off.cqes);
+
+    this->buf_ring_size = buffers_number * sizeof(struct io_uring_buf);
+    this->buf_ring = static_cast<struct io_uring_buf_ring*>(map(this->buf_ring_size, -1, 0));
+    this->buf_ring_mask = buffers_number - 1;
+    struct io_uring_buf_reg reg{};
+    reg.ring_addr = reinterpret_cast<std::uintptr_t>(this->buf_ring);
+    reg.ring_entries = buffers_number;
+    reg.bgid = buffer_group;
+    if (io_uring_register(this->fd, IORING_REGISTER_PBUF_RING, &reg, 1) == -1)
+      throw std::runtime_error("could not register the buffer ring: "s + std::strerror(errno));
+    this->buffers = static_cast<char*>(map(buffers_number * buffer_size, -1, 0));
+    for (unsigned bid = 0; bid < buffers_number; ++bid)
+      this->recycle_buffer(bid);
+  } catch (const std::runtime_error&) {
+    this->release();
+    throw;
+  }
+}
+
+IoUring::~IoUring()
+{
+  this->release();
+}
+
+void IoUring::release()
+{
+  // The Poller waits for all its requests to be done before destroying
+  // us, so the kernel does not write in our buffers anymore
+  if (this->fd != -1)
+    ::close(this->fd);
+  this->fd = -1;
+  if (this->buffers)
+    ::munmap(this->buffers, this->buffers_number * this->buffer_size);
+  if (this->buf_ring)
+    ::munmap(this->buf_ring, this->buf_ring_size);
+  if (this->sqes)
+    ::munmap(this->sqes, this->sqes_size);
+  if (this->cq_ring && this->cq_ring != this->sq_ring)
+    ::munmap(this->cq_ring, this->cq_ring_size);
+  if (this->sq_ring)
+    ::munmap(this->sq_ring, this->sq_ring_size);
+  this->buffers = nullptr;
+  this->buf_ring = nullptr;
+  this->sqes = nullptr;
+  this->cq_ring = this->sq_ring = nullptr;
+}
+
+struct io_uring_sqe* IoUring::get_sqe()
+{
+  if (this->sq_tail - __atomic_load_n(this->sq_khead, __ATOMIC_ACQUIRE) >= this->sq_entries)
+    {
+      const int res = this->enter(0, nullptr, nullptr);
+      if (res < 0)
+        throw std::runtime_error("io_uring_enter failed: "s + std::strerror(-res));
+    }
+  struct io_uring_sqe* sqe = &this->sqes[this->sq_tail & this->sq_mask];
+  std::memset(sqe, 0, sizeof(*sqe));
+  this->sq_tail++;
+  return sqe;
+}
+
+int IoUring::enter(const unsigned min_complete, const struct __kernel_timespec* timeout,
+                   const sigset_t* sigmask)
+{
+  __atomic_store_n(this->sq_ktail, this->sq_tail, __ATOMIC_RELEASE);
+  const unsigned to_submit = this->sq_tail - __atomic_load_n(this->sq_khead, __ATOMIC_ACQUIRE);
+  unsigned flags = 0;
+  struct io_uring_getevents_arg arg{};
+  if (min_complete > 0)
+    {
+      flags = IORING_ENTER_GETEVENTS|IORING_ENTER_EXT_ARG;
+      arg.sigmask = reinterpret_cast<std::uintptr_t>(sigmask);
+      arg.sigmask_sz = _NSIG / 8;
+      arg.ts = reinterpret_cast<std::uintptr_t>(timeout);
+    }
+  const long res = ::syscall(__NR_io_uring_enter, this->fd, to_submit, min_complete, flags,
+                             min_complete > 0 ? &arg : nullptr, sizeof(arg));
+  if (res == -1)
+    return -errno;
+  return static_cast<int>(res);
+}
+
+bool IoUring::pop_cqe(struct io_uring_cqe& cqe)
+{
+  const unsigned head = *this->cq_khead;
+  if (head == __atomic_load_n(this->cq_ktail, __ATOMIC_ACQUIRE))
+    return false;
+  cqe = this->cqes[head & this->cq_mask];
+  __atomic_store_n(this->cq_khead, head + 1, __ATOMIC_RELEASE);
+  return true;
+}
+
+const char* IoUring::get_buffer(const unsigned bid) const
+{
+  return this->buffers + bid * this->buffer_size;
+}
+
+void IoUring::recycle_buffer(const unsigned bid)
+{
+  // Not buf_ring->bufs: in C++, the empty struct that the kernel header
+  // puts before this flexible array member moves it by 8 bytes
+  struct io_uring_buf* bufs = reinterpret_cast<struct io_uring_buf*>(this->buf_ring);
+  struct io_uring_buf* buf = &bufs[this->buf_ring_tail & this->buf_ring_mask];
+  buf->addr = reinterpret_cast<std::uintptr_t>(this->buffers + bid * this->buffer_size);
+  buf->len = static_cast<__u32>(this->buffer_size);
+  buf->bid = static_cast<__u16>(bid);
+  this->buf_ring_tail++;
+  __atomic_store_n(&this->buf_ring->tail, this->buf_ring_tail, __ATOMIC_RELEASE);
+}
+
+#endif
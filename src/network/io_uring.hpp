@@ -0,0 +1,102 @@
+#pragma once
+
+#include <network/poller.hpp>
+
+#if POLLER == IO_URING
+
+#include <linux/io_uring.h>
+#include <signal.h>
+
+#include <cstddef>
+
+/**
+ * A minimal io_uring(7) instance, used by the Poller: the rings are set up
+ * and used directly with the system calls, without liburing.
+ *
+ * A ring of provided buffers is registered along with it, in which the
+ * multishot recv requests of the Poller receive their data.
+ *
+ * The constructor throws a std::runtime_error if the kernel does not
+ * provide everything that is needed (Linux 5.19 or later).
+ */
+class IoUring
+{
+public:
+  explicit IoUring(const unsigned entries, const unsigned buffers_number,
+                   const std::size_t buffer_size);
+  ~IoUring();
+  IoUring(const IoUring&) = delete;
+  IoUring(IoUring&&) = delete;
+  IoUring& operator=(const IoUring&) = delete;
+  IoUring& operator=(IoUring&&) = delete;
+
+  /**
+   * Returns a zeroed submission queue entry, to be filled by the caller.
+   * It is submitted by the next call to enter().  If the submission queue
+   * is full, the pending entries are submitted first.
+   */
+  struct io_uring_sqe* get_sqe();
+  /**
+   * Submit all the pending entries, and wait for at least min_complete
+   * completions, or until the timeout (if not nullptr) expires.  The given
+   * signal mask is used during the wait.  Returns what io_uring_enter(2)
+   * returned, or -errno.
+   */
+  int enter(const unsigned min_complete, const struct __kernel_timespec* timeout,
+            const sigset_t* sigmask);
+  /**
+   * Copy the next completion into cqe and remove it from the queue.
+   * Returns false if the completion queue is empty.
+   */
+  bool pop_cqe(struct io_uring_cqe& cqe);
+  /**
+   * The provided buffer with the given id, in which the kernel wrote some
+   * received data.
+   */
+  const char* get_buffer(const unsigned bid) const;
+  /**
+   * Give that buffer back to the kernel, once its data has been used.
+   */
+  void recycle_buffer(const unsigned bid);
+
+  /**
+   * The group of our provided buffers, to be used with IOSQE_BUFFER_SELECT.
+   */
+  static constexpr unsigned short buffer_group = 0;
+
+private:
+  void release();
+
+  int fd;
+  void* sq_ring;
+  std::size_t sq_ring_size;
+  void* cq_ring;
+  std::size_t cq_ring_size;
+  struct io_uring_sqe* sqes;
+  std::size_t sqes_size;
+
+  unsigned* sq_khead;
+  unsigned* sq_ktail;
+  unsigned sq_mask;
+  unsigned sq_entries;
+  /**
+   * Our own copy of the submission queue tail, only given to the kernel
+   * by enter().
+   */
+  unsigned sq_tail;
+
+  unsigned* cq_khead;
+  unsigned* cq_ktail;
+  unsigned cq_mask;
+  struct io_uring_cqe* cqes;
+
+  struct io_uring_buf_ring* buf_ring;
+  std::size_t buf_ring_size;
+  unsigned buf_ring_mask;
+  unsigned short buf_ring_tail;
+  char* buffers;
+  std::size_t buffer_size;
+  unsigned buffers_number;
+};
+
+#endif
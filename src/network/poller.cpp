@@ -12,11 +12,76 @@
 #include <iostream>
 #include <stdexcept>
 
+#if POLLER == IO_URING
+# include <network/io_uring.hpp>
+# include <config/config.hpp>
+# include <poll.h>
+
+namespace
+{
+  /**
+   * The size of our submission queue.  If more requests are prepared
+   * between two calls of poll(), they are submitted in several system
+   * calls.
+   */
+  constexpr unsigned uring_entries = 256;
+  /**
+   * The number and size of the buffers in which the multishot recv
+   * requests write the received data.  Each buffer is given back to the
+   * kernel as soon as its data has been handled.
+   */
+  constexpr unsigned uring_buffers = 128;
+  constexpr std::size_t uring_buffer_size = 16384;
+
+  enum RequestType: unsigned int
+  {
+    poll_in_request,
+    recv_request,
+    poll_out_request,
+    cancel_request_type,
+  };
+
+  socket_t request_socket(const std::uint64_t request)
+  {
+    return static_cast<socket_t>(request & 0xffffffff);
+  }
+
+  unsigned int request_type(const std::uint64_t request)
+  {
+    return static_cast<unsigned int>((request >> 32) & 0x3);
+  }
+
+  std::uint32_t poll_events(const std::uint32_t events)
+  {
+#if __BYTE_ORDER == __BIG_ENDIAN
+    return (events << 16) | (events >> 16);
+#else
+    return events;
+#endif
+  }
+}
+#endif
+
 Poller::Poller()
+#if POLLER == IO_URING
+  :epfd(-1),
+  generation(0),
+  requests_in_flight(0),
+  multishot_recv(true)
+#endif
 {
-#if POLLER == POLL
-  this->nfds = 0;
-#elif POLLER == EPOLL
+#if POLLER == IO_URING
+  if (Config::get_bool("io_uring", true))
+    {
+      try {
+        this->ring = std::make_unique<IoUring>(uring_entries, uring_buffers, uring_buffer_size);
+        return;
+      } catch (const std::runtime_error& error) {
+        log_warning("Could not use io_uring, falling back to epoll: ", error.what());
+      }
+    }
+#endif
+#if POLLER == EPOLL || POLLER == IO_URING
   this->epfd = ::epoll_create1(0);
   if (this->epfd == -1)
     {
@@ -28,7 +93,32 @@ Poller::Poller()
 
 Poller::~Poller()
 {
-#if POLLER == EPOLL
+#if POLLER == IO_URING
+  if (this->ring)
+    {
+      // The kernel may write in our buffers until all the requests are
+      // finished: cancel them, and wait for their completions
+      if (this->requests_in_flight > 0)
+        {
+          struct io_uring_sqe* sqe = this->ring->get_sqe();
+          sqe->opcode = IORING_OP_ASYNC_CANCEL;
+          sqe->fd = -1;
+          sqe->cancel_flags = IORING_ASYNC_CANCEL_ANY;
+          sqe->user_data = static_cast<std::uint64_t>(cancel_request_type) << 32;
+        }
+      struct __kernel_timespec timeout_ts{0, 100000000};
+      for (int i = 0; i < 10 && this->requests_in_flight > 0; ++i)
+        {
+          this->ring->enter(1, &timeout_ts, nullptr);
+          struct io_uring_cqe cqe;
+          while (this->ring->pop_cqe(cqe))
+            if (request_type(cqe.user_data) != cancel_request_type &&
+                !(cqe.flags & IORING_CQE_F_MORE))
+              this->requests_in_flight--;
+        }
+    }
+#endif
+#if POLLER == EPOLL || POLLER == IO_URING
   if (this->epfd > 0)
     ::close(this->epfd);
 #endif
@@ -42,14 +132,21 @@ void Poller::add_socket_handler(SocketHandler* socket_handler)
     return ;
 
   this->socket_handlers.emplace(socket_handler->get_socket(), socket_handler);
+  socket_handler->watching_send_events = false;
 
   // We always watch all sockets for receive events
+#if POLLER == IO_URING
+  if (this->ring)
+    {
+      this->uring_add_socket_handler(socket_handler);
+      return;
+    }
+#endif
 #if POLLER == POLL
-  this->fds[this->nfds].fd = socket_handler->get_socket();
-  this->fds[this->nfds].events = POLLIN;
-  this->nfds++;
+  this->fds_index[socket_handler->get_socket()] = this->fds.size();
+  this->fds.push_back({socket_handler->get_socket(), POLLIN, 0});
 #endif
-#if POLLER == EPOLL
+#if POLLER == EPOLL || POLLER == IO_URING
   struct epoll_event event = {EPOLLIN, {socket_handler}};
   const int res = ::epoll_ctl(this->epfd, EPOLL_CTL_ADD, socket_handler->get_socket(), &event);
   if (res == -1)
@@ -65,24 +162,32 @@ void Poller::remove_socket_handler(const socket_t socket)
   const auto it = this->socket_handlers.find(socket);
   if (it == this->socket_handlers.end())
     throw std::runtime_error("Trying to remove a SocketHandler that is not managed");
+  it->second->watching_send_events = false;
   this->socket_handlers.erase(it);
 
+#if POLLER == IO_URING
+  if (this->ring)
+    {
+      this->uring_remove_socket_handler(socket);
+      return;
+    }
+#endif
 #if POLLER == POLL
-  for (size_t i = 0; i < this->nfds; i++)
+  const auto index_it = this->fds_index.find(socket);
+  if (index_it != this->fds_index.end())
     {
-      if (this->fds[i].fd == socket)
+      // Replace the removed pollfd by the last one, instead of moving all
+      // the subsequent ones
+      const auto i = index_it->second;
+      this->fds_index.erase(index_it);
+      if (i != this->fds.size() - 1)
         {
-          // Move all subsequent pollfd by one on the left, erasing the
-          // value of the one we remove
-          for (size_t j = i; j < this->nfds - 1; ++j)
-            {
-              this->fds[j].fd = this->fds[j+1].fd;
-              this->fds[j].events= this->fds[j+1].events;
-            }
-          this->nfds--;
+          this->fds[i] = this->fds.back();
+          this->fds_index[this->fds[i].fd] = i;
         }
+      this->fds.pop_back();
     }
-#elif POLLER == EPOLL
+#elif POLLER == EPOLL || POLLER == IO_URING
   const int res = ::epoll_ctl(this->epfd, EPOLL_CTL_DEL, socket, nullptr);
   if (res == -1)
     {
@@ -94,17 +199,22 @@ void Poller::remove_socket_handler(const socket_t socket)
 
 void Poller::watch_send_events(SocketHandler* socket_handler)
 {
-#if POLLER == POLL
-  for (size_t i = 0; i < this->nfds; ++i)
+  if (socket_handler->watching_send_events)
+    return;
+  socket_handler->watching_send_events = true;
+#if POLLER == IO_URING
+  if (this->ring)
     {
-      if (this->fds[i].fd == socket_handler->get_socket())
-        {
-          this->fds[i].events = POLLIN|POLLOUT;
-          return;
-        }
+      this->uring_watch_send_events(socket_handler);
+      return;
     }
-  throw std::runtime_error("Cannot watch a non-registered socket for send events");
-#elif POLLER == EPOLL
+#endif
+#if POLLER == POLL
+  const auto it = this->fds_index.find(socket_handler->get_socket());
+  if (it == this->fds_index.end())
+    throw std::runtime_error("Cannot watch a non-registered socket for send events");
+  this->fds[it->second].events = POLLIN|POLLOUT;
+#elif POLLER == EPOLL || POLLER == IO_URING
   struct epoll_event event = {EPOLLIN|EPOLLOUT, {socket_handler}};
   const int res = ::epoll_ctl(this->epfd, EPOLL_CTL_MOD, socket_handler->get_socket(), &event);
   if (res == -1)
@@ -117,17 +227,20 @@ void Poller::watch_send_events(SocketHandler* socket_handler)
 
 void Poller::stop_watching_send_events(SocketHandler* socket_handler)
 {
+  if (!socket_handler->watching_send_events)
+    return;
+  socket_handler->watching_send_events = false;
+#if POLLER == IO_URING
+  // A pending poll request for POLLOUT is just ignored when it completes
+  if (this->ring)
+    return;
+#endif
 #if POLLER == POLL
-  for (size_t i = 0; i <= this->nfds; ++i)
-    {
-      if (this->fds[i].fd == socket_handler->get_socket())
-        {
-          this->fds[i].events = POLLIN;
-          return;
-        }
-    }
-  throw std::runtime_error("Cannot watch a non-registered socket for send events");
-#elif POLLER == EPOLL
+  const auto it = this->fds_index.find(socket_handler->get_socket());
+  if (it == this->fds_index.end())
+    throw std::runtime_error("Cannot watch a non-registered socket for send events");
+  this->fds[it->second].events = POLLIN;
+#elif POLLER == EPOLL || POLLER == IO_URING
   struct epoll_event event = {EPOLLIN, {socket_handler}};
   const int res = ::epoll_ctl(this->epfd, EPOLL_CTL_MOD, socket_handler->get_socket(), &event);
   if (res == -1)
@@ -142,6 +255,10 @@ int Poller::poll(const std::chrono::milliseconds& timeout)
 {
   if (this->socket_handlers.empty() && timeout == utils::no_timeout)
     return -1;
+#if POLLER == IO_URING
+  if (this->ring)
+    return this->uring_poll(timeout);
+#endif
 #if POLLER == POLL
   // Convert our nice timeout into this ugly struct
   struct timespec timeout_ts;
@@ -159,7 +276,7 @@ int Poller::poll(const std::chrono::milliseconds& timeout)
   // Unblock all signals, only during the ppoll call
   sigset_t empty_signal_set;
   sigemptyset(&empty_signal_set);
-  int nb_events = ::ppoll(this->fds, this->nfds, timeout_tsp,
+  int nb_events = ::ppoll(this->fds.data(), this->fds.size(), timeout_tsp,
                           &empty_signal_set);
   if (nb_events < 0)
     {
@@ -170,8 +287,11 @@ int Poller::poll(const std::chrono::milliseconds& timeout)
     }
   // We cannot possibly have more ready events than the number of fds we are
   // watching
-  assert(static_cast<unsigned int>(nb_events) <= this->nfds);
-  for (size_t i = 0; i < this->nfds && nb_events != 0; ++i)
+  assert(static_cast<unsigned int>(nb_events) <= this->fds.size());
+  // The callbacks may add or remove some sockets, which changes the
+  // order of the fds array: an event that is skipped because of that will
+  // just be returned again by the next poll call
+  for (size_t i = 0; i < this->fds.size() && nb_events != 0; ++i)
     {
       auto socket_handler = this->socket_handlers.at(this->fds[i].fd);
       if (this->fds[i].revents == 0)
@@ -194,7 +314,7 @@ int Poller::poll(const std::chrono::milliseconds& timeout)
         }
     }
   return 1;
-#elif POLLER == EPOLL
+#elif POLLER == EPOLL || POLLER == IO_URING
   static const size_t max_events = 12;
   struct epoll_event revents[max_events];
   // Unblock all signals, only during the epoll_pwait call
@@ -236,3 +356,262 @@ bool Poller::is_managing_socket(const socket_t socket) const
 {
   return (this->socket_handlers.find(socket) != this->socket_handlers.end());
 }
+
+bool Poller::is_using_io_uring() const
+{
+#if POLLER == IO_URING
+  return this->ring != nullptr;
+#else
+  return false;
+#endif
+}
+
+#if POLLER == IO_URING
+void Poller::uring_add_socket_handler(SocketHandler* socket_handler)
+{
+  const socket_t socket = socket_handler->get_socket();
+  UringWatch& watch = this->watches[socket];
+  watch = {};
+  this->arm_read_request(socket, watch, socket_handler);
+}
+
+void Poller::uring_remove_socket_handler(const socket_t socket)
+{
+  const auto it = this->watches.find(socket);
+  if (it == this->watches.end())
+    return;
+  // The completions of these requests, if any, will be ignored
+  if (it->second.read_request != 0)
+    this->cancel_request(it->second.read_request);
+  if (it->second.write_request != 0)
+    this->cancel_request(it->second.write_request);
+  this->watches.erase(it);
+}
+
+void Poller::uring_watch_send_events(SocketHandler* socket_handler)
+{
+  const socket_t socket = socket_handler->get_socket();
+  const auto it = this->watches.find(socket);
+  if (it == this->watches.end())
+    throw std::runtime_error("Cannot watch a non-registered socket for send events");
+  // Instead of waiting for a send event, we will try to send the data
+  // directly, at the beginning of the next poll() call
+  if (it->second.write_request == 0 && !it->second.send_queued)
+    {
+      it->second.send_queued = true;
+      this->send_queue.push_back(socket);
+    }
+}
+
+int Poller::uring_poll(const std::chrono::milliseconds& timeout)
+{
+  int nb_events = this->send_queued_data();
+
+  struct __kernel_timespec timeout_ts{};
+  if (timeout.count() >= 0)
+    {
+      auto seconds = std::chrono::duration_cast<std::chrono::seconds>(timeout);
+      timeout_ts.tv_sec = seconds.count();
+      timeout_ts.tv_nsec = std::chrono::duration_cast<std::chrono::nanoseconds>(timeout - seconds).count();
+    }
+  // Unblock all signals, only during the wait
+  sigset_t empty_signal_set{};
+  sigemptyset(&empty_signal_set);
+  // Submit all the requests prepared since the last call, and wait for
+  // at least one completion
+  const int res = this->ring->enter(1, timeout.count() >= 0 ? &timeout_ts : nullptr,
+                                    &empty_signal_set);
+  if (res < 0 && res != -EINTR && res != -ETIME && res != -EBUSY && res != -EAGAIN)
+    {
+      log_error("io_uring_enter failed: ", strerror(-res));
+      throw std::runtime_error("io_uring_enter failed");
+    }
+  struct io_uring_cqe cqe;
+  while (this->ring->pop_cqe(cqe))
+    {
+      this->on_uring_completion(cqe);
+      nb_events++;
+    }
+  return nb_events;
+}
+
+std::uint64_t Poller::make_request_data(const socket_t socket, const unsigned int type)
+{
+  // Never 0, which means “no request” in an UringWatch
+  this->generation = (this->generation + 1) & 0x3fffffff;
+  if (this->generation == 0)
+    this->generation = 1;
+  return (static_cast<std::uint64_t>(this->generation) << 34) |
+         (static_cast<std::uint64_t>(type) << 32) |
+         static_cast<std::uint32_t>(socket);
+}
+
+void Poller::arm_read_request(const socket_t socket, UringWatch& watch, SocketHandler* socket_handler)
+{
+  struct io_uring_sqe* sqe = this->ring->get_sqe();
+  sqe->fd = socket;
+  if (this->multishot_recv && socket_handler->accepts_received_data())
+    {
+      // Receives all the data into our buffers, until the connection is
+      // closed or we run out of buffers
+      sqe->opcode = IORING_OP_RECV;
+      sqe->ioprio = IORING_RECV_MULTISHOT;
+      sqe->flags = IOSQE_BUFFER_SELECT;
+      sqe->buf_group = IoUring::buffer_group;
+      sqe->user_data = this->make_request_data(socket, recv_request);
+    }
+  else
+    {
+      // A one-shot poll, armed again after each event, because the
+      // SocketHandler may not read everything that is available at once
+      sqe->opcode = IORING_OP_POLL_ADD;
+      sqe->poll32_events = poll_events(POLLIN);
+      sqe->user_data = this->make_request_data(socket, poll_in_request);
+    }
+  watch.read_request = sqe->user_data;
+  this->requests_in_flight++;
+}
+
+void Poller::arm_write_request(const socket_t socket, UringWatch& watch)
+{
+  struct io_uring_sqe* sqe = this->ring->get_sqe();
+  sqe->opcode = IORING_OP_POLL_ADD;
+  sqe->fd = socket;
+  sqe->poll32_events = poll_events(POLLOUT);
+  sqe->user_data = this->make_request_data(socket, poll_out_request);
+  watch.write_request = sqe->user_data;
+  this->requests_in_flight++;
+}
+
+void Poller::cancel_request(const std::uint64_t request)
+{
+  struct io_uring_sqe* sqe = this->ring->get_sqe();
+  sqe->opcode = IORING_OP_ASYNC_CANCEL;
+  sqe->fd = -1;
+  sqe->addr = request;
+  sqe->user_data = static_cast<std::uint64_t>(cancel_request_type) << 32;
+}
+
+int Poller::send_queued_data()
+{
+  int nb_events = 0;
+  // Sending some data may make other SocketHandlers want to send some
+  while (!this->send_queue.empty())
+    {
+      std::vector<socket_t> queue;
+      queue.swap(this->send_queue);
+      for (const socket_t socket: queue)
+        {
+          auto it = this->watches.find(socket);
+          if (it == this->watches.end() || !it->second.send_queued)
+            continue;
+          it->second.send_queued = false;
+          SocketHandler* socket_handler = this->socket_handlers.at(socket);
+          if (!socket_handler->watching_send_events)
+            continue;
+          // If we are not connected yet, the send event tells us when the
+          // connection is done
+          if (socket_handler->is_connected())
+            {
+              socket_handler->on_send();
+              nb_events++;
+              it = this->watches.find(socket);
+              if (it == this->watches.end() || this->socket_handlers.at(socket) != socket_handler)
+                continue;
+            }
+          // Wait for a send event if everything could not be sent
+          if (socket_handler->watching_send_events && it->second.write_request == 0)
+            this->arm_write_request(socket, it->second);
+        }
+    }
+  return nb_events;
+}
+
+void Poller::on_uring_completion(const struct io_uring_cqe& cqe)
+{
+  const auto type = request_type(cqe.user_data);
+  if (type == cancel_request_type)
+    return;
+  if (!(cqe.flags & IORING_CQE_F_MORE))
+    this->requests_in_flight--;
+  const char* data = nullptr;
+  unsigned int buffer_id = 0;
+  if (cqe.flags & IORING_CQE_F_BUFFER)
+    {
+      buffer_id = cqe.flags >> IORING_CQE_BUFFER_SHIFT;
+      data = this->ring->get_buffer(buffer_id);
+    }
+
+  const socket_t socket = request_socket(cqe.user_data);
+  const auto it = this->watches.find(socket);
+  std::uint64_t* request = nullptr;
+  if (it != this->watches.end())
+    request = type == poll_out_request ? &it->second.write_request : &it->second.read_request;
+  if (!request || *request != cqe.user_data)
+    { // A request that was canceled, or replaced by another one
+      if (data)
+        this->ring->recycle_buffer(buffer_id);
+      return;
+    }
+  if (!(cqe.flags & IORING_CQE_F_MORE))
+    *request = 0;
+
+  SocketHandler* socket_handler = this->socket_handlers.at(socket);
+  if (type == poll_in_request)
+    {
+      if (cqe.res > 0 && socket_handler->is_connected())
+        socket_handler->on_recv();
+    }
+  else if (type == recv_request)
+    {
+      // If we ran out of buffers, the request is armed again below, once
+      // the buffers of the other completions have been recycled
+      if (cqe.res == -EINVAL && !data)
+        {
+          log_warning("The kernel does not support multishot recv, using poll requests instead");
+          this->multishot_recv = false;
+        }
+      else if (cqe.res >= 0)
+        socket_handler->on_received_data(data, cqe.res);
+      else if (cqe.res != -ENOBUFS)
+        {
+          errno = -cqe.res;
+          socket_handler->on_received_data(nullptr, -1);
+        }
+    }
+  else if (socket_handler->watching_send_events)
+    {
+      if (socket_handler->is_connected())
+        socket_handler->on_send();
+      else
+        socket_handler->connect();
+    }
+  if (data)
+    this->ring->recycle_buffer(buffer_id);
+  this->rearm_requests(socket, socket_handler);
+}
+
+void Poller::rearm_requests(const socket_t socket, SocketHandler* socket_handler)
+{
+  const auto it = this->watches.find(socket);
+  // The SocketHandler may have been removed by its callback
+  if (it == this->watches.end() || this->socket_handlers.at(socket) != socket_handler)
+    return;
+  UringWatch& watch = it->second;
+  // Once connected, the data can be received directly: the poll is not
+  // needed anymore
+  if (watch.read_request != 0 && request_type(watch.read_request) == poll_in_request &&
+      this->multishot_recv && socket_handler->accepts_received_data())
+    {
+      this->cancel_request(watch.read_request);
+      watch.read_request = 0;
+    }
+  if (watch.read_request == 0)
+    this->arm_read_request(socket, watch, socket_handler);
+  if (socket_handler->watching_send_events && watch.write_request == 0 && !watch.send_queued)
+    {
+      watch.send_queued = true;
+      this->send_queue.push_back(socket);
+    }
+}
+#endif
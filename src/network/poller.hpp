@@ -6,10 +6,13 @@
 #include <unordered_map>
 #include <memory>
 #include <chrono>
+#include <vector>
+#include <cstdint>
 
 #define POLL 1
 #define EPOLL 2
 #define KQUEUE 3
+#define IO_URING 4
 #include <biboumi.h>
 #ifndef POLLER
  #define POLLER POLL
@@ -17,18 +20,31 @@
 
 #if POLLER == POLL
  #include <poll.h>
- #define MAX_POLL_FD_NUMBER 4096
-#elif POLLER == EPOLL
+#elif POLLER == EPOLL || POLLER == IO_URING
   #include <sys/epoll.h>
 #else
   #error Invalid POLLER value
 #endif
 
+#if POLLER == IO_URING
+class IoUring;
+struct io_uring_cqe;
+#endif
+
 /**
  * We pass some SocketHandlers to this Poller, which uses
  * poll/epoll/kqueue/select etc to wait for events on these SocketHandlers,
  * and call the callbacks when event occurs.
  *
+ * With io_uring, the connected sockets are read by the kernel in the
+ * background (with multishot recv requests), and the data is given to the
+ * SocketHandlers that accept it.  The data to send is written at the
+ * beginning of the next poll() call, and the socket is only watched for
+ * send events if it could not all be written.  All the requests are
+ * submitted in the same system call that waits for their completions.  If
+ * io_uring can not be used (disabled with the io_uring option, or not
+ * supported by the kernel), epoll is used instead.
+ *
  * TODO: support these pollers:
  * - kqueue(2)
  */
@@ -78,6 +94,11 @@ public:
    * Whether the given socket is managed by the poller
    */
    bool is_managing_socket(const socket_t socket) const;
+  /**
+   * Whether io_uring is used, instead of the poller chosen at compile time
+   * or its runtime fallback.
+   */
+  bool is_using_io_uring() const;
 
 private:
   /**
@@ -88,11 +109,80 @@ private:
   std::unordered_map<socket_t, SocketHandler*> socket_handlers;
 
 #if POLLER == POLL
-  struct pollfd fds[MAX_POLL_FD_NUMBER];
-  nfds_t nfds;
-#elif POLLER == EPOLL
+  /**
+   * The array given to poll(2).  The order of the elements is not
+   * meaningful: a removed element is replaced by the last one.
+   */
+  std::vector<struct pollfd> fds;
+  /**
+   * The position of each socket in the fds array.
+   */
+  std::unordered_map<socket_t, std::size_t> fds_index;
+#elif POLLER == EPOLL || POLLER == IO_URING
   int epfd;
 #endif
+#if POLLER == IO_URING
+  /**
+   * The state of the io_uring requests for one socket.  A request is
+   * designated by its user_data, which contains the socket, the type of
+   * request and a generation number, so that the completions of the
+   * requests that are not ours anymore (canceled, or for a previous socket
+   * that had the same value) are recognized and ignored.
+   */
+  struct UringWatch
+  {
+    /**
+     * The request that receives the data (a multishot recv if the
+     * SocketHandler accepts the data, a poll for POLLIN otherwise), 0 if
+     * none is pending.
+     */
+    std::uint64_t read_request{0};
+    /**
+     * The poll request for POLLOUT, 0 if none is pending.
+     */
+    std::uint64_t write_request{0};
+    /**
+     * Whether the socket is in send_queue.
+     */
+    bool send_queued{false};
+  };
+  /**
+   * Used instead of epoll, unless io_uring could not be used.
+   */
+  std::unique_ptr<IoUring> ring;
+  std::unordered_map<socket_t, UringWatch> watches;
+  /**
+   * The sockets that want to send some data, which is written at the
+   * beginning of the next poll() call.
+   */
+  std::vector<socket_t> send_queue;
+  std::uint32_t generation;
+  /**
+   * The number of requests that may still produce a completion.
+   */
+  std::size_t requests_in_flight;
+  /**
+   * Cleared if the kernel refuses the multishot recv requests.  All
+   * sockets are then watched with poll requests.
+   */
+  bool multishot_recv;
+
+  void uring_add_socket_handler(SocketHandler* socket_handler);
+  void uring_remove_socket_handler(const socket_t socket);
+  void uring_watch_send_events(SocketHandler* socket_handler);
+  int uring_poll(const std::chrono::milliseconds& timeout);
+  std::uint64_t make_request_data(const socket_t socket, const unsigned int type);
+  void arm_read_request(const socket_t socket, UringWatch& watch, SocketHandler* socket_handler);
+  void arm_write_request(const socket_t socket, UringWatch& watch);
+  void cancel_request(const std::uint64_t request);
+  int send_queued_data();
+  void on_uring_completion(const struct io_uring_cqe& cqe);
+  /**
+   * Once the SocketHandler has handled an event, make sure we have all the
+   * requests it needs.
+   */
+  void rearm_requests(const socket_t socket, SocketHandler* socket_handler);
+#endif
 };
 
 
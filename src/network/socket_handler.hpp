@@ -3,16 +3,20 @@
 #include <biboumi.h>
 #include <memory>
 
+#include <sys/types.h>
+
 class Poller;
 
 using socket_t = int;
 
 class SocketHandler
 {
+  friend class Poller;
 public:
   explicit SocketHandler(std::shared_ptr<Poller>& poller, const socket_t socket):
     poller(poller),
-    socket(socket)
+    socket(socket),
+    watching_send_events(false)
   {}
   virtual ~SocketHandler() = default;
   SocketHandler(const SocketHandler&) = delete;
@@ -24,9 +28,23 @@ public:
   virtual void on_send() {}
   virtual void connect() {}
   virtual bool is_connected() const = 0;
+  /**
+   * Whether the poller may read the socket by itself, and give us the
+   * received data with on_received_data(), instead of calling on_recv()
+   * once the socket is readable.
+   */
+  virtual bool accepts_received_data() const { return false; }
+  /**
+   * Called with the data read from the socket by the poller.  If size is
+   * not positive, it is what recv() returned: 0 if the remote end closed the
+   * connection, or -1 with errno set.
+   */
+  virtual void on_received_data(const char*, const ssize_t) {}
 
   socket_t get_socket() const
   { return this->socket; }
+  bool is_watching_send_events() const
+  { return this->watching_send_events; }
 
 protected:
   /**
@@ -38,5 +56,13 @@ protected:
    * The handled socket.
    */
   socket_t socket;
+
+private:
+  /**
+   * Whether the poller currently watches our socket for send events, in
+   * addition to the receive events.  This is kept up to date by the
+   * Poller, to avoid asking the kernel for a change that is a no-op.
+   */
+  bool watching_send_events;
 };
 
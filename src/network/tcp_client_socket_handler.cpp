@@ -182,6 +182,12 @@ void TCPClientSocketHandler::connect(const std::string& address, const std::stri
             }
 
           log_debug("Local port: ", this->local_port, ", and remote port: ", this->port);
+          try {
+            this->remote_port = static_cast<uint16_t>(std::stoi(this->port));
+          } catch (const std::logic_error&) {
+            this->remote_port = 0;
+          }
+          get_ports_index().emplace(ports_key(this->local_port, this->remote_port), this);
 
           this->on_connected();
           return ;
@@ -230,6 +236,18 @@ void TCPClientSocketHandler::close()
   TimedEventsManager::instance().cancel("connection_timeout" +
                                         std::to_string(this->socket));
 
+  if (this->connected)
+    {
+      auto& index = get_ports_index();
+      const auto range = index.equal_range(ports_key(this->local_port, this->remote_port));
+      for (auto it = range.first; it != range.second; ++it)
+        if (it->second == this)
+          {
+            index.erase(it);
+            break;
+          }
+    }
+
   TCPSocketHandler::close();
 
   this->connected = false;
@@ -261,8 +279,13 @@ std::string TCPClientSocketHandler::get_port() const
   return this->port;
 }
 
-bool TCPClientSocketHandler::match_port_pairt(const uint16_t local, const uint16_t remote) const
+std::unordered_multimap<uint32_t, TCPClientSocketHandler*>& TCPClientSocketHandler::get_ports_index()
+{
+  static std::unordered_multimap<uint32_t, TCPClientSocketHandler*> index;
+  return index;
+}
+
+uint32_t TCPClientSocketHandler::ports_key(const uint16_t local, const uint16_t remote)
 {
-  const auto remote_port = static_cast<uint16_t>(std::stoi(this->port));
-  return this->is_connected() && local == this->local_port && remote == remote_port;
+  return static_cast<uint32_t>(local) << 16 | remote;
 }
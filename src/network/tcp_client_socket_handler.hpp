@@ -2,6 +2,9 @@
 
 #include <network/tcp_socket_handler.hpp>
 
+#include <unordered_map>
+#include <cstdint>
+
 class TCPClientSocketHandler: public TCPSocketHandler
 {
  public:
@@ -32,9 +35,22 @@ class TCPClientSocketHandler: public TCPSocketHandler
   std::chrono::system_clock::time_point connection_date;
 
   /**
-   * Whether or not this connection is using the two given TCP ports.
+   * Return the first connected socket handler of type T using the two given
+   * TCP ports, or nullptr if there is none.  Other handlers, connected to
+   * other hosts, may use the same ports.
    */
-  bool match_port_pairt(const uint16_t local, const uint16_t remote) const;
+  template <typename T>
+  static T* find_by_ports(const uint16_t local, const uint16_t remote)
+  {
+    const auto range = get_ports_index().equal_range(ports_key(local, remote));
+    for (auto it = range.first; it != range.second; ++it)
+      {
+        auto* handler = dynamic_cast<T*>(it->second);
+        if (handler)
+          return handler;
+      }
+    return nullptr;
+  }
 
  protected:
   bool hostname_resolution_failed;
@@ -53,6 +69,12 @@ class TCPClientSocketHandler: public TCPSocketHandler
    * addrinfo structure.
    */
   void init_socket(const struct addrinfo* rp);
+  /**
+   * All the connected socket handlers, indexed by their local and remote
+   * TCP ports, see ports_key().  Updated on connection and on close().
+   */
+  static std::unordered_multimap<uint32_t, TCPClientSocketHandler*>& get_ports_index();
+  static uint32_t ports_key(const uint16_t local, const uint16_t remote);
   /**
    * DNS resolver
    */
@@ -76,6 +98,7 @@ class TCPClientSocketHandler: public TCPSocketHandler
   std::string port;
 
   uint16_t local_port{};
+  uint16_t remote_port{};
 
   bool connected;
   bool connecting;
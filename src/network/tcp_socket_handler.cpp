@@ -8,6 +8,7 @@
 #include <sys/types.h>
 #include <stdexcept>
 #include <unistd.h>
+#include <climits>
 #include <cerrno>
 #include <cstring>
 
@@ -38,10 +39,21 @@ namespace
 }
 #endif
 
-#ifndef UIO_FASTIOV
-# define UIO_FASTIOV 8
+#ifndef IOV_MAX
+# define IOV_MAX 1024
 #endif
 
+#ifndef MSG_MORE
+# define MSG_MORE 0
+#endif
+
+/**
+ * Data given to raw_send is appended to the last string of out_buf, as long
+ * as that string does not grow bigger than this.  This way, many small
+ * stanzas or messages are sent using only a few big writes.
+ */
+static constexpr std::size_t out_chunk_size = 16384;
+
 using namespace std::string_literals;
 using namespace std::chrono_literals;
 
@@ -67,42 +79,66 @@ TCPSocketHandler::~TCPSocketHandler()
 
 void TCPSocketHandler::on_recv()
 {
+  // Keep reading as long as the socket fills our whole buffer, because
+  // more data is probably waiting.  But stop after a few reads, to give a
+  // chance to the other sockets and to the timed events.
+  const auto read_size = static_cast<ssize_t>(this->get_read_size());
+  for (std::size_t i = 0; i < max_reads_per_event; ++i)
+    {
+      ssize_t size;
 #ifdef BOTAN_FOUND
-  if (this->use_tls)
-    this->tls_recv();
-  else
+      if (this->use_tls)
+        size = this->tls_recv();
+      else
 #endif
-    this->plain_recv();
+        size = this->plain_recv();
+      if (size < read_size || this->socket == -1)
+        break;
+    }
 }
 
-void TCPSocketHandler::plain_recv()
+ssize_t TCPSocketHandler::plain_recv()
 {
-  static constexpr size_t buf_size = 4096;
-  char buf[buf_size];
+  const std::size_t buf_size = this->get_read_size();
   void* recv_buf = this->get_receive_buffer(buf_size);
 
-  if (recv_buf == nullptr)
-    recv_buf = buf;
-
-  const ssize_t ssize = this->do_recv(recv_buf, buf_size);
+  if (recv_buf != nullptr)
+    {
+      const ssize_t ssize = this->do_recv(recv_buf, buf_size);
+      if (ssize > 0)
+        this->parse_in_buffer(static_cast<std::size_t>(ssize));
+      return ssize;
+    }
 
+  // No buffer was provided to receive that data directly: it is read at
+  // the end of the in_buf string, which will be handled in
+  // parse_in_buffer()
+  const auto old_size = this->in_buf.size();
+  this->in_buf.resize(old_size + buf_size);
+  const ssize_t ssize = this->do_recv(&this->in_buf[old_size], buf_size);
   if (ssize > 0)
     {
       auto size = static_cast<std::size_t>(ssize);
-      if (buf == recv_buf)
-        {
-          // data needs to be placed in the in_buf string, because no buffer
-          // was provided to receive that data directly. The in_buf buffer
-          // will be handled in parse_in_buffer()
-          this->in_buf += std::string(buf, size);
-        }
+      this->in_buf.resize(old_size + size);
       this->parse_in_buffer(size);
     }
+  else if (this->in_buf.size() > old_size) // close() may have emptied in_buf
+    this->in_buf.resize(old_size);
+  return ssize;
 }
 
 ssize_t TCPSocketHandler::do_recv(void* recv_buf, const size_t buf_size)
 {
-  ssize_t size = ::recv(this->socket, recv_buf, buf_size, 0);
+  ssize_t size = ::recv(this->socket, recv_buf, buf_size, MSG_DONTWAIT);
+  if (-1 == size && (errno == EAGAIN || errno == EWOULDBLOCK))
+    return size; // Nothing left to read for now
+  if (size <= 0)
+    this->on_recv_failure(size);
+  return size;
+}
+
+void TCPSocketHandler::on_recv_failure(const ssize_t size)
+{
   if (0 == size)
     {
       this->on_connection_close("");
@@ -123,33 +159,73 @@ ssize_t TCPSocketHandler::do_recv(void* recv_buf, const size_t buf_size)
       else
         this->on_connection_close(strerror(errno));
     }
-  return size;
 }
 
-void TCPSocketHandler::on_send()
+bool TCPSocketHandler::accepts_received_data() const
+{
+  return this->is_connected();
+}
+
+void TCPSocketHandler::on_received_data(const char* data, const ssize_t ssize)
 {
-  struct iovec msg_iov[UIO_FASTIOV] = {};
-  struct msghdr msg{};
-  msg.msg_iov = msg_iov;
-  msg.msg_iovlen = 0;
-  for (const std::string& s: this->out_buf)
+  if (ssize <= 0)
     {
-      // unconsting the content of s is ok, sendmsg will never modify it
-      msg_iov[msg.msg_iovlen].iov_base = const_cast<char*>(s.data());
-      msg_iov[msg.msg_iovlen].iov_len = s.size();
-      msg.msg_iovlen++;
-      if (msg.msg_iovlen == UIO_FASTIOV)
-        break;
+      this->on_recv_failure(ssize);
+      return;
     }
-  ssize_t res = ::sendmsg(this->socket, &msg, MSG_NOSIGNAL);
-  if (res < 0)
+  const auto size = static_cast<std::size_t>(ssize);
+#ifdef BOTAN_FOUND
+  if (this->use_tls)
     {
-      log_error("sendmsg failed: ", strerror(errno));
-      this->on_connection_close(strerror(errno));
-      this->close();
+      this->tls_received_data(reinterpret_cast<const Botan::byte*>(data), size);
+      return;
     }
+#endif
+  void* recv_buf = this->get_receive_buffer(size);
+  if (recv_buf != nullptr)
+    std::memcpy(recv_buf, data, size);
   else
+    this->in_buf.append(data, size);
+  this->parse_in_buffer(size);
+}
+
+void TCPSocketHandler::on_send()
+{
+  // Send the whole out_buf now, IOV_MAX strings at a time.  Each call but
+  // the last one tells the kernel that more data is coming right away, so
+  // that it does not send a partial segment between them
+  while (!this->out_buf.empty())
     {
+      struct iovec msg_iov[IOV_MAX];
+      struct msghdr msg{};
+      msg.msg_iov = msg_iov;
+      msg.msg_iovlen = 0;
+      std::size_t total_size = 0;
+      for (const std::string& s: this->out_buf)
+        {
+          // unconsting the content of s is ok, sendmsg will never modify it
+          msg_iov[msg.msg_iovlen].iov_base = const_cast<char*>(s.data());
+          msg_iov[msg.msg_iovlen].iov_len = s.size();
+          total_size += s.size();
+          msg.msg_iovlen++;
+          if (msg.msg_iovlen == IOV_MAX)
+            break;
+        }
+      int flags = MSG_NOSIGNAL|MSG_DONTWAIT;
+      if (static_cast<std::size_t>(msg.msg_iovlen) < this->out_buf.size())
+        flags |= MSG_MORE;
+      ssize_t res = ::sendmsg(this->socket, &msg, flags);
+      // We may be called before knowing that the socket is writable (see the
+      // io_uring Poller): we just keep watching the send events
+      if (res < 0 && (errno == EAGAIN || errno == EWOULDBLOCK))
+        return ;
+      if (res < 0)
+        {
+          log_error("sendmsg failed: ", strerror(errno));
+          this->on_connection_close(strerror(errno));
+          this->close();
+          return ;
+        }
       auto size = static_cast<std::size_t>(res);
       // remove all the strings that were successfully sent.
       auto it = this->out_buf.begin();
@@ -170,9 +246,11 @@ void TCPSocketHandler::on_send()
             }
         }
       this->out_buf.erase(this->out_buf.begin(), it);
-      if (this->out_buf.empty())
-        this->poller->stop_watching_send_events(this);
+      // The socket is full, wait until it is writable again
+      if (static_cast<std::size_t>(res) < total_size)
+        return ;
     }
+  this->poller->stop_watching_send_events(this);
 }
 
 void TCPSocketHandler::close()
@@ -208,8 +286,14 @@ void TCPSocketHandler::raw_send(std::string&& data)
 {
   if (data.empty())
     return ;
-  this->out_buf.emplace_back(std::move(data));
-  if (this->is_connected())
+  const bool was_empty = this->out_buf.empty();
+  if (!was_empty && this->out_buf.back().size() + data.size() <= out_chunk_size)
+    this->out_buf.back() += data;
+  else
+    this->out_buf.emplace_back(std::move(data));
+  // If out_buf was not empty, we are already watching the send events (or
+  // will be, once connected): no need to tell the poller again
+  if (was_empty && this->is_connected())
     this->poller->watch_send_events(this);
 }
 
@@ -229,6 +313,11 @@ void* TCPSocketHandler::get_receive_buffer(const size_t) const
   return nullptr;
 }
 
+std::size_t TCPSocketHandler::get_read_size() const
+{
+  return 4096;
+}
+
 void TCPSocketHandler::consume_in_buffer(const std::size_t size)
 {
   this->in_buf = this->in_buf.substr(size, std::string::npos);
@@ -250,28 +339,32 @@ void TCPSocketHandler::start_tls(const std::string& address, const std::string&
       get_rng(), server_info, Botan::TLS::Protocol_Version::latest_tls_version());
 }
 
-void TCPSocketHandler::tls_recv()
+ssize_t TCPSocketHandler::tls_recv()
 {
-  static constexpr size_t buf_size = 4096;
-  Botan::byte recv_buf[buf_size];
+  this->tls_recv_buf.resize(this->get_read_size());
 
-  const ssize_t size = this->do_recv(recv_buf, buf_size);
-  if (size > 0)
-    {
-      const bool was_active = this->tls->is_active();
-      try {
-        this->tls->received_data(recv_buf, static_cast<size_t>(size));
-      } catch (const Botan::TLS::TLS_Exception& e) {
-        // May happen if the server sends malformed TLS data (buggy server,
-        // or more probably we are just connected to a server that sends
-        // plain-text)
-        this->on_connection_close("TLS error: "s + e.what());
-        this->close();
-        return ;
-      }
-      if (!was_active && this->tls->is_active())
-        this->on_tls_activated();
-    }
+  const ssize_t size = this->do_recv(this->tls_recv_buf.data(), this->tls_recv_buf.size());
+  if (size > 0 && !this->tls_received_data(this->tls_recv_buf.data(), static_cast<size_t>(size)))
+    return -1;
+  return size;
+}
+
+bool TCPSocketHandler::tls_received_data(const Botan::byte* data, const size_t size)
+{
+  const bool was_active = this->tls->is_active();
+  try {
+    this->tls->received_data(data, size);
+  } catch (const Botan::TLS::TLS_Exception& e) {
+    // May happen if the server sends malformed TLS data (buggy server,
+    // or more probably we are just connected to a server that sends
+    // plain-text)
+    this->on_connection_close("TLS error: "s + e.what());
+    this->close();
+    return false;
+  }
+  if (!was_active && this->tls->is_active())
+    this->on_tls_activated();
+  return true;
 }
 
 void TCPSocketHandler::tls_send(std::string&& data)
@@ -300,8 +393,15 @@ void TCPSocketHandler::tls_send(std::string&& data)
 
 void TCPSocketHandler::tls_record_received(uint64_t, const Botan::byte *data, size_t size)
 {
-  this->in_buf += std::string(reinterpret_cast<const char*>(data),
-                              size);
+  // If we are given a buffer, copy the data into it directly
+  void* recv_buf = this->get_receive_buffer(size);
+  if (recv_buf != nullptr)
+    {
+      std::memcpy(recv_buf, data, size);
+      this->parse_in_buffer(size);
+      return;
+    }
+  this->in_buf.append(reinterpret_cast<const char*>(data), size);
   if (!this->in_buf.empty())
     this->parse_in_buffer(size);
 }
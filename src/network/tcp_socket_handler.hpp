@@ -46,8 +46,20 @@ public:
   /**
    * Reads raw data from the socket. And pass it to parse_in_buffer()
    * If we are using TLS on this connection, we call tls_recv()
+   *
+   * The socket is read again while it fills our whole read buffer, up to
+   * max_reads_per_event times.
    */
   void on_recv() override final;
+  /**
+   * Once connected, the data can be read from the socket by the poller.
+   */
+  bool accepts_received_data() const override final;
+  /**
+   * Pass the data read by the poller to parse_in_buffer(), or to tls
+   * object, like on_recv() does.
+   */
+  void on_received_data(const char* data, const ssize_t size) override final;
   /**
    * Write as much data from out_buf as possible, in the socket.
    */
@@ -99,13 +111,20 @@ private:
    * connection, log a message, etc).
    *
    * Returns the value returned by ::recv(), so the buffer should not be
-   * used if it’s not positive.
+   * used if it’s not positive.  EAGAIN is not an error: -1 is returned and
+   * the connection is left untouched.
    */
   ssize_t do_recv(void* recv_buf, const size_t buf_size);
   /**
-   * Reads data from the socket and calls parse_in_buffer with it.
+   * Close the connection, after recv() returned the given value (0 or -1,
+   * with errno set).
+   */
+  void on_recv_failure(const ssize_t size);
+  /**
+   * Reads data from the socket and calls parse_in_buffer with it.  Returns
+   * the number of bytes read, see do_recv().
    */
-  void plain_recv();
+  ssize_t plain_recv();
   /**
    * Mark the given data as ready to be sent, as-is, on the socket, as soon
    * as we can.
@@ -126,7 +145,12 @@ private:
    * An additional step to pass the data into our tls object to decrypt it
    * before passing it to parse_in_buffer.
    */
-  void tls_recv();
+  ssize_t tls_recv();
+  /**
+   * Give the data read from the socket to the tls object.  Returns false if
+   * it could not be decrypted, and the connection has been closed.
+   */
+  bool tls_received_data(const Botan::byte* data, const size_t size);
   /**
    * Pass the data to the tls object in order to encrypt it. The tls object
    * will then call raw_send as a callback whenever data as been encrypted
@@ -169,6 +193,7 @@ private:
 #endif // BOTAN_FOUND
   /**
    * Where data is added, when we want to send something to the client.
+   * Small writes are coalesced into bigger strings, see raw_send().
    */
   std::vector<std::string> out_buf;
 protected:
@@ -195,6 +220,15 @@ protected:
    * data until it can be used by parse_in_buffer().
    */
   virtual void* get_receive_buffer(const size_t size) const;
+  /**
+   * The maximum number of bytes read from the socket at once.
+   */
+  virtual std::size_t get_read_size() const;
+  /**
+   * How many times the socket may be read in a row, when data keeps
+   * coming, before going back to the poller.
+   */
+  static constexpr std::size_t max_reads_per_event = 8;
   /**
    * Called when we detect a disconnection from the remote host.
    */
@@ -223,5 +257,10 @@ private:
    * cannot because the handshake is not done.
    */
   std::vector<Botan::byte> pre_buf;
+  /**
+   * Where the encrypted data is read, before being passed to the tls
+   * object.  Kept here to avoid allocating it on each read.
+   */
+  std::vector<Botan::byte> tls_recv_buf;
 #endif // BOTAN_FOUND
 };
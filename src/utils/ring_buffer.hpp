@@ -0,0 +1,72 @@
+#pragma once
+
+#include <atomic>
+#include <vector>
+#include <cstddef>
+
+namespace utils
+{
+/**
+ * A fixed-size, lock-free queue, with exactly one thread pushing elements
+ * and exactly one (other) thread popping them.
+ */
+template <typename T>
+class RingBuffer
+{
+public:
+  explicit RingBuffer(const std::size_t capacity):
+    slots(capacity + 1),
+    head(0),
+    tail(0)
+  {}
+
+  RingBuffer(const RingBuffer&) = delete;
+  RingBuffer(RingBuffer&&) = delete;
+  RingBuffer& operator=(const RingBuffer&) = delete;
+  RingBuffer& operator=(RingBuffer&&) = delete;
+
+  /**
+   * Add the value at the end of the queue. If the queue is full, nothing is
+   * done and false is returned.  Must only be called by the producer.
+   */
+  bool push(T&& value)
+  {
+    const auto current_tail = this->tail.load(std::memory_order_relaxed);
+    const auto next_tail = this->next(current_tail);
+    if (next_tail == this->head.load(std::memory_order_acquire))
+      return false;
+    this->slots[current_tail] = std::move(value);
+    this->tail.store(next_tail, std::memory_order_release);
+    return true;
+  }
+  /**
+   * Move the first element of the queue into value. Returns false if the
+   * queue is empty.  Must only be called by the consumer.
+   */
+  bool pop(T& value)
+  {
+    const auto current_head = this->head.load(std::memory_order_relaxed);
+    if (current_head == this->tail.load(std::memory_order_acquire))
+      return false;
+    value = std::move(this->slots[current_head]);
+    this->head.store(this->next(current_head), std::memory_order_release);
+    return true;
+  }
+  bool empty() const
+  {
+    return this->head.load(std::memory_order_acquire) == this->tail.load(std::memory_order_acquire);
+  }
+
+private:
+  std::size_t next(const std::size_t index) const
+  {
+    return (index + 1) % this->slots.size();
+  }
+  /**
+   * One slot is always left empty, to tell a full queue from an empty one
+   */
+  std::vector<T> slots;
+  std::atomic<std::size_t> head;
+  std::atomic<std::size_t> tail;
+};
+}
@@ -0,0 +1,89 @@
+#include <utils/tokens_bucket.hpp>
+#include <logger/logger.hpp>
+
+#include <algorithm>
+
+TokensBucket::TokensBucket(long int max_size, std::chrono::milliseconds fill_duration, std::function<void()> callback, std::string name):
+  limit(max_size),
+  tokens(std::max(max_size, 0l)),
+  fill_duration(std::max(fill_duration, std::chrono::milliseconds(1))),
+  last_fill(std::chrono::steady_clock::now()),
+  callback(std::move(callback)),
+  name(std::move(name))
+{
+  log_debug("creating TokensBucket with max size: ", max_size);
+}
+
+TokensBucket::~TokensBucket()
+{
+  if (this->waiting)
+    TimedEventsManager::instance().cancel(this->name);
+}
+
+bool TokensBucket::use_token()
+{
+  if (this->limit < 0)
+    return true;
+  this->fill();
+  if (this->tokens > 0)
+    {
+      this->tokens--;
+      return true;
+    }
+  return false;
+}
+
+void TokensBucket::wait_for_token()
+{
+  if (this->waiting)
+    return;
+  this->waiting = true;
+  this->fill();
+  auto time_point = std::chrono::steady_clock::now();
+  if (this->limit >= 0 && this->tokens == 0)
+    time_point = this->last_fill + this->fill_duration;
+  TimedEventsManager::instance().add_event(TimedEvent(std::move(time_point),
+                                                      [this]() { this->on_token(); }, this->name));
+}
+
+void TokensBucket::set_limit(long int limit)
+{
+  this->fill();
+  this->limit = limit;
+  this->tokens = std::min(this->tokens, this->capacity());
+}
+
+long int TokensBucket::get_tokens()
+{
+  this->fill();
+  return this->tokens;
+}
+
+void TokensBucket::fill()
+{
+  const auto now = std::chrono::steady_clock::now();
+  if (this->tokens >= this->capacity())
+    {
+      // A full bucket does not accumulate time
+      this->last_fill = now;
+      return;
+    }
+  const auto count = (now - this->last_fill) / this->fill_duration;
+  if (count <= 0)
+    return;
+  this->last_fill += count * this->fill_duration;
+  this->tokens = static_cast<long int>(std::min<decltype(count)>(this->tokens + count, this->capacity()));
+  if (this->tokens == this->capacity())
+    this->last_fill = now;
+}
+
+void TokensBucket::on_token()
+{
+  this->waiting = false;
+  this->callback();
+}
+
+long int TokensBucket::capacity() const
+{
+  return std::max(this->limit, 1l);
+}
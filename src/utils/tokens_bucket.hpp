@@ -1,60 +1,64 @@
 /**
  * Implementation of the token bucket algorithm.
  *
- * It uses a repetitive TimedEvent, started at construction, to fill the
- * bucket.
- *
- * Every n seconds, it executes the given callback. If the callback
- * returns true, we add a token (if the limit is not yet reached).
+ * The bucket holds at most max_size tokens, and gains one token every
+ * fill_duration.  The tokens are counted from the time elapsed since the
+ * last fill, when they are needed, instead of being added by a periodic
+ * event: nothing runs while the bucket is not used.
  *
+ * When someone waits for a token (see wait_for_token()), a single TimedEvent
+ * is scheduled at the time the next token will be available, to execute the
+ * given callback.
  */
 
 #pragma once
 
 #include <utils/timed_events.hpp>
-#include <logger/logger.hpp>
+
+#include <functional>
+#include <chrono>
+#include <string>
 
 class TokensBucket
 {
 public:
-  TokensBucket(long int max_size, std::chrono::milliseconds fill_duration, std::function<bool()> callback, std::string name):
-      limit(max_size),
-      tokens(static_cast<std::size_t>(limit)),
-      callback(std::move(callback))
-  {
-    log_debug("creating TokensBucket with max size: ", max_size);
-    TimedEvent event(std::move(fill_duration), [this]() { this->add_token(); }, std::move(name));
-    TimedEventsManager::instance().add_event(std::move(event));
-  }
+  TokensBucket(long int max_size, std::chrono::milliseconds fill_duration, std::function<void()> callback, std::string name);
+  ~TokensBucket();
 
-  bool use_token()
-  {
-    if (this->limit < 0)
-      return true;
-    if (this->tokens > 0)
-      {
-        this->tokens--;
-        return true;
-      }
-    else
-      return false;
-  }
+  TokensBucket(const TokensBucket&) = delete;
+  TokensBucket(TokensBucket&&) = delete;
+  TokensBucket& operator=(const TokensBucket&) = delete;
+  TokensBucket& operator=(TokensBucket&&) = delete;
 
-  void set_limit(long int limit)
-  {
-    this->limit = limit;
-  }
+  /**
+   * Use a token, if one is available. Always succeeds if the limit is
+   * negative.
+   */
+  bool use_token();
+  /**
+   * Execute the callback once a token is available, unless it is already
+   * planned
+   */
+  void wait_for_token();
+  /**
+   * A limit of 0 still lets one token be gained every fill_duration, so
+   * that everything is throttled.  A negative limit disables the bucket.
+   */
+  void set_limit(long int limit);
+  long int get_tokens();
 
 private:
+  void fill();
+  void on_token();
+  /**
+   * The maximum number of tokens that the bucket can hold
+   */
+  long int capacity() const;
   long int limit;
-  std::size_t tokens;
-  std::function<bool()> callback;
-
-  void add_token()
-  {
-    if (this->limit < 0)
-      return;
-    if (this->callback() && this->tokens != static_cast<decltype(this->tokens)>(this->limit))
-      this->tokens++;
-  }
+  long int tokens;
+  const std::chrono::milliseconds fill_duration;
+  std::chrono::steady_clock::time_point last_fill;
+  std::function<void()> callback;
+  const std::string name;
+  bool waiting{false};
 };
@@ -45,12 +45,12 @@ void DisconnectUserStep1(XmppComponent& xmpp_component, AdhocSession&, XmlNode&
   jids_field["type"] = "list-multi";
   jids_field["label"] = "The JIDs to disconnect";
   XmlSubNode required(jids_field, "required");
-  for (Bridge* bridge: biboumi_component.get_bridges())
+  for (const auto& pair: biboumi_component.get_bridges())
     {
       XmlSubNode option(jids_field, "option");
-      option["label"] = bridge->get_jid();
+      option["label"] = pair.second->get_jid();
       XmlSubNode value(option, "value");
-      value.set_inner(bridge->get_jid());
+      value.set_inner(pair.second->get_jid());
     }
 
   XmlSubNode message_field(x, "field");
@@ -615,6 +615,24 @@ void insert_irc_channel_configuration_form(XmlNode& node, const Jid& requester,
         value.set_inner("false");
     }
   }
+
+  {
+    XmlSubNode lazy_user_list(x, "field");
+    lazy_user_list["var"] = "lazy_user_list";
+    lazy_user_list["type"] = "boolean";
+    const std::string desc = "If set to true, when this channel has more than " +
+        std::to_string(Config::get_int("lazy_user_list_threshold", 1000)) +
+        " users, only the operators and voiced users are listed when joining it. The other users are listed gradually afterwards.";
+    set_desc(lazy_user_list, desc.data());
+    lazy_user_list["label"] = "Lazy users list";
+    {
+      XmlSubNode value(lazy_user_list, "value");
+      if (options.col<Database::LazyUserList>())
+        value.set_inner("true");
+      else
+        value.set_inner("false");
+    }
+  }
 }
 
 void ConfigureIrcChannelStep2(XmppComponent& xmpp_component, AdhocSession& session, XmlNode& command_node)
@@ -661,6 +679,9 @@ bool handle_irc_channel_configuration_form(XmppComponent& xmpp_component, const
 
               else if (field->get_tag("var") == "persistent" && value)
                 options.col<Database::Persistent>() = to_bool(value->get_inner());
+
+              else if (field->get_tag("var") == "lazy_user_list" && value)
+                options.col<Database::LazyUserList>() = to_bool(value->get_inner());
               else if (field->get_tag("var") == "record_history" &&
                        value && !value->get_inner().empty())
                 {
@@ -720,12 +741,12 @@ void DisconnectUserFromServerStep1(XmppComponent& xmpp_component, AdhocSession&
       jids_field["type"] = "list-single";
       jids_field["label"] = "The JID to disconnect";
       XmlSubNode required(jids_field, "required");
-      for (Bridge* bridge: biboumi_component.get_bridges())
+      for (const auto& pair: biboumi_component.get_bridges())
         {
           XmlSubNode option(jids_field, "option");
-          option["label"] = bridge->get_jid();
+          option["label"] = pair.second->get_jid();
           XmlSubNode value(option, "value");
-          value.set_inner(bridge->get_jid());
+          value.set_inner(pair.second->get_jid());
         }
     }
 }
@@ -12,6 +12,7 @@
 #include <utils/time.hpp>
 #include <xmpp/jid.hpp>
 
+#include <algorithm>
 #include <stdexcept>
 #include <iostream>
 
@@ -100,17 +101,39 @@ void BiboumiComponent::shutdown()
 #endif
 }
 
-void BiboumiComponent::clean()
+void BiboumiComponent::clean(const bool all)
 {
-  auto it = this->bridges.begin();
-  while (it != this->bridges.end())
-  {
-    it->second->clean();
-    if (it->second->active_clients() == 0)
-      it = this->bridges.erase(it);
-    else
-      ++it;
-  }
+  if (all)
+    {
+      auto it = this->bridges.begin();
+      while (it != this->bridges.end())
+      {
+        it->second->clean(true);
+        if (it->second->active_clients() == 0)
+          it = this->bridges.erase(it);
+        else
+          ++it;
+      }
+      this->dirty_bridges.clear();
+      this->channel_list_cache.remove_expired();
+      return;
+    }
+  const auto dirty = std::move(this->dirty_bridges);
+  this->dirty_bridges.clear();
+  for (const std::string& bare_jid: dirty)
+    {
+      const auto it = this->bridges.find(bare_jid);
+      if (it == this->bridges.end())
+        continue;
+      it->second->clean();
+      if (it->second->active_clients() == 0)
+        this->bridges.erase(it);
+    }
+}
+
+void BiboumiComponent::mark_bridge_dirty(const std::string& bare_jid)
+{
+  this->dirty_bridges.insert(bare_jid);
 }
 
 void BiboumiComponent::handle_presence(const Stanza& stanza)
@@ -493,6 +516,40 @@ void BiboumiComponent::handle_iq(const Stanza& stanza)
             stanza_error.disable();
         }
 #endif
+      else if ((query = stanza.get_child("query", SEARCH_NS)))
+        {
+          Iid iid(to.local, bridge);
+          if (iid.type != Iid::Type::Server)
+            {
+              error_name = "feature-not-implemented";
+              return;
+            }
+          std::string text;
+          auto order = ChannelDirectory::Order::users;
+          std::size_t max = 100;
+          const XmlNode* x = query->get_child("x", DATAFORM_NS);
+          if (x)
+            {
+              for (const XmlNode* field: x->get_children("field", DATAFORM_NS))
+                {
+                  const XmlNode* value = field->get_child("value", DATAFORM_NS);
+                  if (!value)
+                    continue;
+                  if (field->get_tag("var") == "text")
+                    text = value->get_inner();
+                  else if (field->get_tag("var") == "sort" && value->get_inner() == "list")
+                    order = ChannelDirectory::Order::list;
+                  else if (field->get_tag("var") == "max")
+                    {
+                      const int value_max = std::atoi(value->get_inner().data());
+                      if (value_max > 0)
+                        max = static_cast<std::size_t>(value_max);
+                    }
+                }
+            }
+          bridge->send_irc_channel_search(iid, id, from, text, order, max);
+          stanza_error.disable();
+        }
     }
   else if (type == "get")
     {
@@ -610,6 +667,29 @@ void BiboumiComponent::handle_iq(const Stanza& stanza)
               bridge->send_irc_channel_list_request(iid, id, from, std::move(rs_info));
               stanza_error.disable();
             }
+          else if (node.empty() && iid.type == Iid::Type::Channel && to.resource.empty())
+            { // Disco on a room: the occupants are not listed as items, but
+              // the presences of the ones that were not sent yet (see the
+              // lazy_user_list option of the channel) are sent right away
+              IrcClient* irc = bridge->find_irc_client(iid.get_server());
+              if (irc)
+                irc->announce_all_users(iid.get_local());
+              auto query = std::make_unique<XmlNode>("query");
+              (*query)["xmlns"] = DISCO_ITEMS_NS;
+              this->send_iq_result_full_jid(id, from, to_str, std::move(query));
+              stanza_error.disable();
+            }
+        }
+      else if ((query = stanza.get_child("query", SEARCH_NS)))
+        {
+          Iid iid(to.local, bridge);
+          if (iid.type != Iid::Type::Server)
+            {
+              error_name = "feature-not-implemented";
+              return;
+            }
+          this->send_channel_search_form(id, from, to_str);
+          stanza_error.disable();
         }
       else if ((query = stanza.get_child("ping", PING_NS)))
         {
@@ -879,35 +959,28 @@ bool BiboumiComponent::handle_room_configuration_form(const XmlNode& query, cons
 Bridge* BiboumiComponent::get_user_bridge(const std::string& user_jid)
 {
   auto bare_jid = Jid{user_jid}.bare();
-  try
-    {
-      return this->bridges.at(bare_jid).get();
-    }
-  catch (const std::out_of_range& exception)
+  auto it = this->bridges.find(bare_jid);
+  if (it == this->bridges.end())
     {
-      return this->bridges.emplace(bare_jid, std::make_unique<Bridge>(bare_jid, *this, this->poller)).first->second.get();
+      it = this->bridges.emplace(bare_jid, std::make_unique<Bridge>(bare_jid, *this, this->poller)).first;
+      // Removed by the next clean() if no IrcClient gets created
+      this->mark_bridge_dirty(bare_jid);
     }
+  return it->second.get();
 }
 
 Bridge* BiboumiComponent::find_user_bridge(const std::string& full_jid)
 {
   auto bare_jid = Jid{full_jid}.bare();
-  try
-    {
-      return this->bridges.at(bare_jid).get();
-    }
-  catch (const std::out_of_range& exception)
-    {
-      return nullptr;
-    }
+  const auto it = this->bridges.find(bare_jid);
+  if (it == this->bridges.end())
+    return nullptr;
+  return it->second.get();
 }
 
-std::vector<Bridge*> BiboumiComponent::get_bridges() const
+const std::unordered_map<std::string, std::unique_ptr<Bridge>>& BiboumiComponent::get_bridges() const
 {
-  std::vector<Bridge*> res;
-  for (const auto& bridge: this->bridges)
-    res.push_back(bridge.second.get());
-  return res;
+  return this->bridges;
 }
 
 void BiboumiComponent::send_self_disco_info(const std::string& id, const std::string& jid_to)
@@ -948,7 +1021,7 @@ void BiboumiComponent::send_irc_server_disco_info(const std::string& id, const s
     identity["category"] = "conference";
     identity["type"] = "irc";
     identity["name"] = "IRC server " + from.local + " over Biboumi";
-    for (const char *ns: {DISCO_INFO_NS, MUC_NS, ADHOC_NS, PING_NS, MAM_NS, VERSION_NS, STABLE_MUC_ID_NS})
+    for (const char *ns: {DISCO_INFO_NS, MUC_NS, ADHOC_NS, PING_NS, MAM_NS, VERSION_NS, STABLE_MUC_ID_NS, SEARCH_NS})
       {
         XmlSubNode feature(query, "feature");
         feature["var"] = ns;
@@ -1056,6 +1129,70 @@ void BiboumiComponent::send_ping_request(const std::string& from,
   this->waiting_iq[id] = result_cb;
 }
 
+/**
+ * Return the position of the channel with that JID in the list, or the size
+ * of the list if it is not in it
+ */
+static std::size_t find_channel_jid(const ChannelList& channel_list, const std::string& jid,
+                                    const std::string& served_hostname)
+{
+  const std::string suffix = "@" + served_hostname;
+  if (jid.size() <= suffix.size() ||
+      jid.compare(jid.size() - suffix.size(), suffix.size(), suffix) != 0)
+    return channel_list.channels.size();
+  return channel_list.find(jid.substr(0, jid.size() - suffix.size()));
+}
+
+bool BiboumiComponent::send_matching_channel_list(const ChannelList& channel_list, const ResultSetInfo& rs_info,
+                                                  const std::string& id, const std::string& to_jid,
+                                                  const std::string& from)
+{
+  const auto size = channel_list.channels.size();
+  std::size_t begin = 0;
+  std::size_t end = size;
+  if (channel_list.complete)
+    {
+      begin = find_channel_jid(channel_list, rs_info.after, this->served_hostname);
+      if (begin == size)
+        begin = 0;
+      else
+        begin++;
+      end = std::max(begin, find_channel_jid(channel_list, rs_info.before, this->served_hostname));
+      if (rs_info.max >= 0)
+        end = std::min(end, begin + static_cast<std::size_t>(rs_info.max));
+    }
+  else
+    {
+      if (rs_info.after.empty() && rs_info.before.empty() && rs_info.max < 0)
+        return false;
+      if (!rs_info.after.empty())
+        {
+          begin = find_channel_jid(channel_list, rs_info.after, this->served_hostname);
+          if (begin == size)
+            return false;
+          begin++;
+        }
+      if (!rs_info.before.empty())
+        {
+          end = find_channel_jid(channel_list, rs_info.before, this->served_hostname);
+          if (end == size || end < begin)
+            return false;
+        }
+      if (rs_info.max >= 0)
+        {
+          if (end - begin < static_cast<std::size_t>(rs_info.max))
+            return false;
+          else
+            end = begin + static_cast<std::size_t>(rs_info.max);
+        }
+    }
+  const auto first = channel_list.channels.cbegin();
+  this->send_iq_room_list_result(id, to_jid, from, channel_list,
+                                 first + static_cast<std::ptrdiff_t>(begin),
+                                 first + static_cast<std::ptrdiff_t>(end), rs_info);
+  return true;
+}
+
 void BiboumiComponent::send_iq_room_list_result(const std::string& id, const std::string& to_jid,
                                                 const std::string& from, const ChannelList& channel_list,
                                                 std::vector<ListElement>::const_iterator begin,
@@ -1105,6 +1242,119 @@ void BiboumiComponent::send_iq_room_list_result(const std::string& id, const std
   this->send_stanza(iq);
 }
 
+void BiboumiComponent::send_channel_search_form(const std::string& id, const std::string& to_jid,
+                                                const std::string& from)
+{
+  Stanza iq("iq");
+  {
+    iq["from"] = from;
+    iq["to"] = to_jid;
+    iq["id"] = id;
+    iq["type"] = "result";
+    XmlSubNode query(iq, "query");
+    query["xmlns"] = SEARCH_NS;
+    XmlSubNode query_instructions(query, "instructions");
+    query_instructions.set_inner("Fill the form to search the channels of this server");
+
+    XmlSubNode x(query, "jabber:x:data:x");
+    x["type"] = "form";
+    XmlSubNode title(x, "title");
+    title.set_inner("Search the channels");
+    XmlSubNode instructions(x, "instructions");
+    instructions.set_inner("Find the channels whose name or topic contains some text");
+
+    XmlSubNode form_type(x, "field");
+    form_type["var"] = "FORM_TYPE";
+    form_type["type"] = "hidden";
+    XmlSubNode form_type_value(form_type, "value");
+    form_type_value.set_inner(SEARCH_NS);
+
+    XmlSubNode text(x, "field");
+    text["var"] = "text";
+    text["type"] = "text-single";
+    text["label"] = "Name or topic contains";
+
+    XmlSubNode sort(x, "field");
+    sort["var"] = "sort";
+    sort["type"] = "list-single";
+    sort["label"] = "Sort by";
+    XmlSubNode sort_value(sort, "value");
+    sort_value.set_inner("users");
+    for (const auto& option_pair: {std::make_pair("users", "Number of users"),
+                                   std::make_pair("list", "Server order")})
+      {
+        XmlSubNode option(sort, "option");
+        option["label"] = option_pair.second;
+        XmlSubNode value(option, "value");
+        value.set_inner(option_pair.first);
+      }
+
+    XmlSubNode max(x, "field");
+    max["var"] = "max";
+    max["type"] = "text-single";
+    max["label"] = "Maximum number of results";
+    XmlSubNode max_value(max, "value");
+    max_value.set_inner("100");
+  }
+  this->send_stanza(iq);
+}
+
+void BiboumiComponent::send_channel_search_result(const std::string& id, const std::string& to_jid,
+                                                  const std::string& from, const ChannelList& channel_list,
+                                                  const std::vector<std::size_t>& positions,
+                                                  const std::size_t max)
+{
+  Stanza iq("iq");
+  {
+    iq["from"] = from + "@" + this->served_hostname;
+    iq["to"] = to_jid;
+    iq["id"] = id;
+    iq["type"] = "result";
+    XmlSubNode query(iq, "query");
+    query["xmlns"] = SEARCH_NS;
+
+    XmlSubNode x(query, "jabber:x:data:x");
+    x["type"] = "result";
+    XmlSubNode form_type(x, "field");
+    form_type["var"] = "FORM_TYPE";
+    form_type["type"] = "hidden";
+    XmlSubNode form_type_value(form_type, "value");
+    form_type_value.set_inner(SEARCH_NS);
+
+    XmlSubNode reported(x, "reported");
+    for (const auto& field_pair: {std::make_pair("jid", "Channel"), std::make_pair("users", "Users"),
+                                  std::make_pair("topic", "Topic")})
+      {
+        XmlSubNode field(reported, "field");
+        field["var"] = field_pair.first;
+        field["label"] = field_pair.second;
+      }
+
+    for (std::size_t i = 0; i < positions.size() && i < max; ++i)
+      {
+        const ListElement& element = channel_list.channels[positions[i]];
+        XmlSubNode item(x, "item");
+        std::string channel_name = element.channel;
+        xep0106::encode(channel_name);
+        for (const auto& field_pair: {std::make_pair("jid", channel_name + "@" + this->served_hostname),
+                                      std::make_pair("users", element.nb_users),
+                                      std::make_pair("topic", element.topic)})
+          {
+            XmlSubNode field(item, "field");
+            field["var"] = field_pair.first;
+            XmlSubNode value(field, "value");
+            value.set_inner(field_pair.second);
+          }
+      }
+
+    XmlSubNode set_node(query, "set");
+    set_node["xmlns"] = RSM_NS;
+    XmlSubNode count_node(set_node, "count");
+    count_node.set_inner(std::to_string(positions.size()));
+  }
+  this->send_stanza(iq);
+}
+
 void BiboumiComponent::send_invitation(const std::string& room_target,
                                        const std::string& jid_to,
                                        const std::string& author_nick)
@@ -4,10 +4,12 @@
 #include <xmpp/xmpp_component.hpp>
 #include <xmpp/jid.hpp>
 
+#include <bridge/channel_list_cache.hpp>
 #include <bridge/bridge.hpp>
 
 #include <memory>
 #include <string>
+#include <set>
 #include <map>
 
 namespace db
@@ -44,9 +46,9 @@ public:
    */
   Bridge* find_user_bridge(const std::string& full_jid);
   /**
-   * Return a list of all the managed bridges.
+   * Return all the managed bridges, indexed by the bare JID of their user.
    */
-  std::vector<Bridge*> get_bridges() const;
+  const std::unordered_map<std::string, std::unique_ptr<Bridge>>& get_bridges() const;
 
   /**
    * Send a "close" message to all our connected peers.  That message
@@ -56,10 +58,17 @@ public:
    */
   void shutdown();
   /**
-   * Run a check on all bridges, to remove all disconnected (socket is
-   * closed, or no channel is joined) IrcClients. Some kind of garbage collector.
+   * Run a check on the bridges marked with mark_bridge_dirty() (or on all
+   * bridges, if all is true), to remove all disconnected (socket is
+   * closed, or no channel is joined) IrcClients, and the bridges left
+   * without any IrcClient. Some kind of garbage collector.
    */
-  void clean();
+  void clean(const bool all=false);
+  /**
+   * Remember that something changed in this bridge, and that it must be
+   * checked by the next clean()
+   */
+  void mark_bridge_dirty(const std::string& bare_jid);
   /**
    * Send a result IQ with the gateway disco informations.
    */
@@ -81,6 +90,28 @@ public:
   void send_ping_request(const std::string& from,
                          const std::string& jid_to,
                          const std::string& id);
+  /**
+   * Check if the channel list contains what is needed to answer the RSM request,
+   * if it does, send the iq result. If the list is complete but does not contain
+   * everything, send the result anyway (because there are no more available
+   * channels that could complete the list).
+   *
+   * Returns true if we sent the answer.
+   */
+  bool send_matching_channel_list(const ChannelList& channel_list,
+                                  const ResultSetInfo& rs_info, const std::string& id, const std::string& to_jid,
+                                  const std::string& from);
+  /**
+   * Send the form used to search the channels of an IRC server
+   */
+  void send_channel_search_form(const std::string& id, const std::string& to_jid, const std::string& from);
+  /**
+   * Send the channels found by a search, at the given positions in the
+   * list, at most max of them
+   */
+  void send_channel_search_result(const std::string& id, const std::string& to_jid, const std::string& from,
+                                  const ChannelList& channel_list, const std::vector<std::size_t>& positions,
+                                  const std::size_t max);
   /**
    * Send the channels list in one big stanza
    */
@@ -118,6 +149,9 @@ public:
    */
   Bridge* get_user_bridge(const std::string& user_jid);
 
+  ChannelListCache& get_channel_list_cache()
+  { return this->channel_list_cache; }
+
 private:
   /**
    * A map of id -> callback.  When we want to wait for an iq result, we add
@@ -126,12 +160,21 @@ private:
    * found, we call it and remove it.
    */
   std::map<std::string, iq_responder_callback_t> waiting_iq;
+  /**
+   * The channels list of the IRC servers, shared by all the bridges.  It
+   * must outlive them.
+   */
+  ChannelListCache channel_list_cache;
 
   /**
    * One bridge for each user of the component. Indexed by the user's bare
    * jid
    */
   std::unordered_map<std::string, std::unique_ptr<Bridge>> bridges;
+  /**
+   * The bare JIDs of the bridges to check in the next clean()
+   */
+  std::set<std::string> dirty_bridges;
 
   AdhocCommandsHandler irc_server_adhoc_commands_handler;
   AdhocCommandsHandler irc_channel_adhoc_commands_handler;
@@ -0,0 +1,41 @@
+#include <xmpp/xml_symbols.hpp>
+#include <xmpp/xmpp_component.hpp>
+
+#include <unordered_map>
+
+namespace
+{
+  std::unordered_map<std::string, XmlSymbol> make_symbols_table()
+  {
+    static const char* known_strings[] = {
+      // namespaces
+      STREAM_NS, COMPONENT_NS, MUC_NS, MUC_USER_NS, MUC_ADMIN_NS, MUC_OWNER_NS,
+      DISCO_ITEMS_NS, DISCO_INFO_NS, XHTMLIM_NS, STANZA_NS, STREAMS_NS,
+      VERSION_NS, ADHOC_NS, PING_NS, DELAY_NS, MAM_NS, FORWARD_NS, CLIENT_NS,
+      DATAFORM_NS, RSM_NS, MUC_TRAFFIC_NS, STABLE_ID_NS, STABLE_MUC_ID_NS, SEARCH_NS,
+      // element names
+      "stream", "handshake", "message", "presence", "iq", "error", "body",
+      "subject", "status", "show", "x", "query", "item", "field", "value",
+      "set", "max", "before", "after", "first", "last", "count", "command",
+      "ping", "version", "name", "os", "text", "reason", "invite", "history",
+      "password", "actor", "delay", "forwarded", "result", "fin", "stanza-id",
+      "origin-id", "html", "no-copy", "private", "feature-not-implemented",
+      "service-unavailable",
+    };
+    std::unordered_map<std::string, XmlSymbol> res;
+    XmlSymbol next = unknown_symbol + 1;
+    for (const char* str: known_strings)
+      if (res.emplace(str, next).second)
+        next++;
+    return res;
+  }
+}
+
+XmlSymbol find_xml_symbol(const std::string& str)
+{
+  static const auto table = make_symbols_table();
+  const auto it = table.find(str);
+  if (it == table.end())
+    return unknown_symbol;
+  return it->second;
+}
@@ -0,0 +1,24 @@
+#pragma once
+
+#include <cstdint>
+#include <string>
+
+/**
+ * An integer identifying an XML element name or namespace.  The table of
+ * symbols is built at startup with all the names and namespaces that
+ * biboumi looks for in the received stanzas, so that comparing two of them
+ * is just comparing two integers.
+ *
+ * The strings that are not in the table (for example the names of the
+ * elements biboumi does not know about) are never added to it: they all
+ * get the unknown_symbol value and must be compared as strings.
+ */
+using XmlSymbol = std::uint32_t;
+
+static constexpr XmlSymbol unknown_symbol = 0;
+
+/**
+ * Return the symbol of that string, or unknown_symbol if it is not in the
+ * table.
+ */
+XmlSymbol find_xml_symbol(const std::string& str);
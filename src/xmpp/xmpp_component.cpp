@@ -12,6 +12,7 @@
 #include <xmpp/jid.hpp>
 
 #include <stdexcept>
+#include <algorithm>
 #include <iostream>
 #include <set>
 
@@ -25,6 +26,13 @@
 
 using namespace std::string_literals;
 
+/**
+ * How many stanzas can wait for an additional stream to be authenticated,
+ * and for how long, before they are sent on the main stream instead
+ */
+static constexpr std::size_t max_pending_stanzas = 1000;
+static constexpr std::chrono::seconds pending_stanzas_timeout = 30s;
+
 static std::set<std::string> kickable_errors{
     "gone",
     "internal-server-error",
@@ -42,9 +50,12 @@ XmppComponent::XmppComponent(std::shared_ptr<Poller>& poller, std::string hostna
   TCPClientSocketHandler(poller),
   ever_auth(false),
   first_connection_try(true),
+  read_size(static_cast<std::size_t>(std::min(std::max(Config::get_int("xmpp_read_size", 65536), 512), 1 << 20))),
   secret(std::move(secret)),
   authenticated(false),
   doc_open(false),
+  main_stream(nullptr),
+  pending_on_main_stream(false),
   served_hostname(std::move(hostname)),
   stanza_handlers{},
   adhoc_commands_handler(*this)
@@ -59,6 +70,43 @@ XmppComponent::XmppComponent(std::shared_ptr<Poller>& poller, std::string hostna
                                 std::bind(&XmppComponent::handle_handshake, this,std::placeholders::_1));
   this->stanza_handlers.emplace("error",
                                 std::bind(&XmppComponent::handle_error, this,std::placeholders::_1));
+
+  const auto connections = Config::get_int("component_connections", 1);
+  for (auto i = 1; i < connections; ++i)
+    this->streams.emplace_back(new XmppComponent(poller, *this));
+}
+
+XmppComponent::XmppComponent(std::shared_ptr<Poller>& poller, XmppComponent& main_stream):
+  TCPClientSocketHandler(poller),
+  ever_auth(false),
+  first_connection_try(true),
+  read_size(main_stream.read_size),
+  secret(main_stream.secret),
+  authenticated(false),
+  doc_open(false),
+  main_stream(&main_stream),
+  pending_on_main_stream(false),
+  pending_stanzas_event("XMPP pending stanzas " + std::to_string(main_stream.streams.size() + 1)),
+  served_hostname(main_stream.served_hostname),
+  stanza_handlers{},
+  adhoc_commands_handler(*this)
+{
+  this->parser.add_stream_open_callback(std::bind(&XmppComponent::on_remote_stream_open, this,
+                                                  std::placeholders::_1));
+  this->parser.add_stanza_callback(std::bind(&XmppComponent::on_stanza, this,
+                                                  std::placeholders::_1));
+  this->parser.add_stream_close_callback(std::bind(&XmppComponent::on_remote_stream_close, this,
+                                                  std::placeholders::_1));
+  this->stanza_handlers.emplace("handshake",
+                                std::bind(&XmppComponent::handle_handshake, this,std::placeholders::_1));
+  this->stanza_handlers.emplace("error",
+                                std::bind(&XmppComponent::handle_error, this,std::placeholders::_1));
+}
+
+XmppComponent::~XmppComponent()
+{
+  if (this->main_stream)
+    TimedEventsManager::instance().cancel(this->pending_stanzas_event);
 }
 
 void XmppComponent::start()
@@ -75,7 +123,60 @@ void XmppComponent::send_stanza(const Stanza& stanza)
 {
   std::string str = stanza.to_string();
   log_debug("XMPP SENDING: ", str);
-  this->send_data(std::move(str));
+  XmppComponent& stream = this->get_stream_for(stanza.get_tag("to"));
+  if (&stream == this || stream.authenticated)
+    stream.send_data(std::move(str));
+  else if (stream.pending_on_main_stream)
+    // The previous stanzas of that user already went through the main
+    // stream, this one must follow them
+    stream.main_stream->send_data(std::move(str));
+  else
+    // Sending it on another stream could reorder the stanzas of that
+    // user: it waits for its own stream to be up again
+    stream.add_pending_stanza(std::move(str));
+}
+
+void XmppComponent::add_pending_stanza(std::string&& str)
+{
+  if (this->pending_stanzas.empty())
+    TimedEventsManager::instance().add_event(TimedEvent(std::chrono::steady_clock::now() + pending_stanzas_timeout,
+                                                        [this]() { this->send_pending_stanzas_on_main_stream(); },
+                                                        this->pending_stanzas_event));
+  this->pending_stanzas.push_back(std::move(str));
+  if (this->pending_stanzas.size() >= max_pending_stanzas)
+    {
+      log_warning("Too many stanzas are waiting for an XMPP component stream to be connected");
+      this->send_pending_stanzas_on_main_stream();
+    }
+}
+
+void XmppComponent::send_pending_stanzas_on_main_stream()
+{
+  TimedEventsManager::instance().cancel(this->pending_stanzas_event);
+  if (!this->pending_stanzas.empty())
+    log_warning("Sending ", this->pending_stanzas.size(), " stanzas on the main stream, instead of an XMPP component stream that is not connected");
+  for (std::string& str: this->pending_stanzas)
+    this->main_stream->send_data(std::move(str));
+  this->pending_stanzas.clear();
+  this->pending_on_main_stream = true;
+}
+
+XmppComponent& XmppComponent::get_stream_for(const std::string& jid)
+{
+  if (this->streams.empty() || jid.empty())
+    return *this;
+  const auto index = std::hash<std::string>{}(Jid(jid).bare()) % (this->streams.size() + 1);
+  if (index == 0)
+    return *this;
+  return *this->streams[index - 1];
+}
+
+std::vector<XmppComponent*> XmppComponent::get_streams()
+{
+  std::vector<XmppComponent*> res{this};
+  for (auto& stream: this->streams)
+    res.push_back(stream.get());
+  return res;
 }
 
 void XmppComponent::on_connection_failed(const std::string& reason)
@@ -103,6 +204,7 @@ void XmppComponent::on_connected()
 
 void XmppComponent::on_connection_close(const std::string& error)
 {
+  this->authenticated = false;
   if (error.empty())
     log_info("XMPP server closed connection");
   else
@@ -111,8 +213,8 @@ void XmppComponent::on_connection_close(const std::string& error)
 
 void XmppComponent::parse_in_buffer(const size_t size)
 {
-  // in_buf.size, or size, cannot be bigger than our read-size (4096) so it’s safe
-  // to cast.
+  // in_buf.size, or size, cannot be bigger than our read-size, which is
+  // much smaller than INT_MAX, so it’s safe to cast.
 
   if (!this->in_buf.empty())
     { // This may happen if the parser could not allocate enough space for
@@ -155,22 +257,21 @@ void XmppComponent::on_remote_stream_close(const XmlNode& node)
 void XmppComponent::reset()
 {
   this->parser.reset();
+  this->authenticated = false;
 }
 
 void XmppComponent::on_stanza(const Stanza& stanza)
 {
   log_debug("XMPP RECEIVING: ", stanza.to_string());
-  std::function<void(const Stanza&)> handler;
-  try
-    {
-      handler = this->stanza_handlers.at(stanza.get_name());
-    }
-  catch (const std::out_of_range& exception)
-    {
-      log_warning("No handler for stanza of type ", stanza.get_name());
-      return;
-    }
-  handler(stanza);
+  const auto it = this->stanza_handlers.find(stanza.get_name());
+  if (it != this->stanza_handlers.end())
+    it->second(stanza);
+  else if (this->main_stream)
+    // The XMPP server may deliver any stanza for our component on any
+    // of the streams: let the main one handle it
+    this->main_stream->on_stanza(stanza);
+  else
+    log_warning("No handler for stanza of type ", stanza.get_name());
 }
 
 void XmppComponent::send_stream_error(const std::string& name, const std::string& explanation)
@@ -233,6 +334,16 @@ void XmppComponent::handle_handshake(const Stanza&)
 {
   this->authenticated = true;
   this->ever_auth = true;
+  if (this->main_stream)
+    {
+      log_info("Authenticated additional stream with the XMPP server");
+      TimedEventsManager::instance().cancel(this->pending_stanzas_event);
+      this->pending_on_main_stream = false;
+      for (std::string& str: this->pending_stanzas)
+        this->send_data(std::move(str));
+      this->pending_stanzas.clear();
+      return;
+    }
   log_info("Authenticated with the XMPP server");
 #ifdef SYSTEMD_FOUND
   sd_notify(0, "READY=1");
@@ -267,6 +378,11 @@ void* XmppComponent::get_receive_buffer(const size_t size) const
   return this->parser.get_buffer(size);
 }
 
+std::size_t XmppComponent::get_read_size() const
+{
+  return this->read_size;
+}
+
 void XmppComponent::send_message(const std::string& from, Xmpp::body&& body, const std::string& to,
                                  const std::string& type, const bool fulljid, const bool nocopy,
                                  const bool muc_private)
@@ -10,6 +10,7 @@
 
 #include <unordered_map>
 #include <memory>
+#include <vector>
 #include <string>
 #include <ctime>
 #include <map>
@@ -38,6 +39,7 @@
 #define MUC_TRAFFIC_NS   "http://jabber.org/protocol/muc#traffic"
 #define STABLE_ID_NS     "urn:xmpp:sid:0"
 #define STABLE_MUC_ID_NS "http://jabber.org/protocol/muc#stable_id"
+#define SEARCH_NS        "jabber:iq:search"
 
 /**
  * An XMPP component, communicating with an XMPP server using the protocole
@@ -49,7 +51,7 @@ class XmppComponent: public TCPClientSocketHandler
 {
 public:
   explicit XmppComponent(std::shared_ptr<Poller>& poller, std::string hostname, std::string secret);
-  virtual ~XmppComponent() = default;
+  virtual ~XmppComponent();
 
   XmppComponent(const XmppComponent&) = delete;
   XmppComponent(XmppComponent&&) = delete;
@@ -76,9 +78,33 @@ public:
   void reset();
   /**
    * Serialize the stanza and add it to the out_buf to be sent to the
-   * server.
+   * server.  The stream used is chosen from the bare JID of the recipient,
+   * so that all the stanzas going to the same user are sent in order.
    */
   void send_stanza(const Stanza& stanza);
+  /**
+   * Return all the component streams: this one, followed by the additional
+   * streams of the pool (see the component_connections option)
+   */
+  std::vector<XmppComponent*> get_streams();
+  /**
+   * Return the stream on which the stanzas for that JID are sent.  It is
+   * chosen from the bare JID only, so that all the stanzas going to the same
+   * user are sent in order, on the same stream.
+   */
+  XmppComponent& get_stream_for(const std::string& jid);
+  /**
+   * The stanzas that wait for this (additional) stream to be authenticated
+   */
+  const std::vector<std::string>& get_pending_stanzas() const
+  { return this->pending_stanzas; }
+  /**
+   * Stop waiting for this (additional) stream to be authenticated: send its
+   * pending stanzas on the main stream, and the next ones too, until it is
+   * authenticated.  This happens when too many stanzas are pending, or when
+   * they waited for too long.
+   */
+  void send_pending_stanzas_on_main_stream();
   /**
    * Handle the opening of the remote stream
    */
@@ -231,12 +257,28 @@ public:
   bool first_connection_try;
 
 private:
+  /**
+   * Create an additional stream for the given component.  It uses the same
+   * hostname and secret, and forwards all the stanzas it receives to it.
+   */
+  explicit XmppComponent(std::shared_ptr<Poller>& poller, XmppComponent& main_stream);
+  /**
+   * Keep that stanza until this (additional) stream is authenticated.
+   * After pending_stanzas_timeout, or if there are already too many of
+   * them, they are sent on the main stream instead.
+   */
+  void add_pending_stanza(std::string&& str);
   /**
    * Return a buffer provided by the XML parser, to read data directly into
    * it, and avoiding some unnecessary copy.
    */
   void* get_receive_buffer(const size_t size) const override final;
+  std::size_t get_read_size() const override final;
   XmppParser parser;
+  /**
+   * See get_read_size(). Configured with the xmpp_read_size option
+   */
+  const std::size_t read_size;
   std::string stream_id;
   std::string secret;
   bool authenticated;
@@ -244,6 +286,27 @@ private:
    * Whether or not OUR XMPP document is open
    */
   bool doc_open;
+  /**
+   * The component that created this stream, or nullptr if this is the
+   * main stream
+   */
+  XmppComponent* main_stream;
+  /**
+   * The additional streams opened to the XMPP server, to spread the
+   * outgoing traffic
+   */
+  std::vector<std::unique_ptr<XmppComponent>> streams;
+  std::vector<std::string> pending_stanzas;
+  /**
+   * Whether the stanzas for this stream are sent on the main stream, until
+   * it is authenticated again
+   */
+  bool pending_on_main_stream;
+  /**
+   * The name of the timed event that sends the pending stanzas on the main
+   * stream, if this stream is still not authenticated
+   */
+  const std::string pending_stanzas_event;
 protected:
   std::string served_hostname;
 
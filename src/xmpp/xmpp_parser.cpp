@@ -3,6 +3,13 @@
 
 #include <logger/logger.hpp>
 
+/**
+ * The maximum number of nodes kept for reuse. This way, a stanza with a
+ * huge number of children does not keep them all allocated forever (the
+ * nodes with huge content are not kept, see XmlNode::release_children).
+ */
+static constexpr std::size_t max_free_nodes = 256;
+
 /**
  * Expat handlers. Called by the Expat library, never by ourself.
  * They just forward the call to the XmppParser corresponding methods.
@@ -88,7 +95,15 @@ void XmppParser::start_element(const XML_Char* name, const XML_Char** attribute)
 {
   this->level++;
 
-  auto new_node = std::make_unique<XmlNode>(name, this->current_node);
+  std::unique_ptr<XmlNode> new_node;
+  if (this->free_nodes.empty())
+    new_node = std::make_unique<XmlNode>(name, this->current_node);
+  else
+    {
+      new_node = std::move(this->free_nodes.back());
+      this->free_nodes.pop_back();
+      new_node->reset(name, this->current_node);
+    }
   auto new_node_ptr = new_node.get();
   if (this->current_node)
     this->current_node->add_child(std::move(new_node));
@@ -116,9 +131,9 @@ void XmppParser::end_element(const XML_Char*)
       if (this->level == 1)
         { // End of a stanza
           this->stanza_event(*this->current_node);
-          // Note: deleting all the children of our parent deletes ourself,
-          // so current_node is an invalid pointer after this line
-          parent->delete_all_children();
+          // Note: releasing all the children of our parent releases
+          // ourself, so current_node is an invalid pointer after this line
+          parent->release_children(this->free_nodes, max_free_nodes);
         }
       this->current_node = parent;
     }
@@ -127,9 +142,9 @@ void XmppParser::end_element(const XML_Char*)
 void XmppParser::char_data(const XML_Char* data, const size_t len)
 {
   if (this->current_node->has_children())
-    this->current_node->get_last_child()->add_to_tail({data, len});
+    this->current_node->get_last_child()->add_to_tail(data, len);
   else
-    this->current_node->add_to_inner({data, len});
+    this->current_node->add_to_inner(data, len);
 }
 
 void XmppParser::stanza_event(const Stanza& stanza) const
@@ -75,8 +75,8 @@ public:
    * set our current_node as the parent of the current_node, and if that was
    * a level-2 element we spawn a stanza_event with this node.
    *
-   * And we then delete the stanza (and everything under it, its children,
-   * attribute, etc).
+   * And we then release the stanza (and everything under it, its
+   * children, attribute, etc) into our pool of nodes.
    */
   void end_element(const XML_Char* name);
   /**
@@ -121,6 +121,11 @@ private:
    * is its owner.
    */
   std::unique_ptr<XmlNode> root;
+  /**
+   * The nodes of the previous stanzas, kept to be reused by the next ones,
+   * so that parsing a stanza usually does not allocate any new node.
+   */
+  std::vector<std::unique_ptr<XmlNode>> free_nodes;
   /**
    * A list of callbacks to be called on an *_event, receiving the
    * concerned Stanza/XmlNode.
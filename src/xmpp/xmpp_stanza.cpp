@@ -4,11 +4,20 @@
 #include <utils/split.hpp>
 
 #include <stdexcept>
+#include <algorithm>
 #include <iostream>
 #include <sstream>
 
 #include <cstring>
 
+/**
+ * A released node is not kept for reuse if its strings, or its vector of
+ * children, use more memory than that: after a huge stanza, it would keep
+ * that memory allocated until the parser is destroyed.
+ */
+static constexpr std::size_t max_pooled_string_capacity = 4096;
+static constexpr std::size_t max_pooled_children_capacity = 32;
+
 std::string xml_escape(const std::string& data)
 {
   std::string res;
@@ -50,6 +59,11 @@ std::string sanitize(const std::string& data, const std::string& encoding)
 
 XmlNode::XmlNode(const std::string& name, XmlNode* parent):
   parent(parent)
+{
+  this->set_qualified_name(name);
+}
+
+void XmlNode::set_qualified_name(const std::string& name)
 {
   // split the namespace and the name
   auto n = name.rfind(':');
@@ -57,9 +71,11 @@ XmlNode::XmlNode(const std::string& name, XmlNode* parent):
     this->name = name;
   else
     {
-      this->name = name.substr(n+1);
-      this->attributes["xmlns"] = name.substr(0, n);
+      this->name.assign(name, n+1, std::string::npos);
+      (*this)["xmlns"].assign(name, 0, n);
     }
+  this->name_symbol = find_xml_symbol(this->name);
+  this->xmlns_symbol = find_xml_symbol(this->get_tag("xmlns"));
 }
 
 XmlNode::XmlNode(const std::string& name):
@@ -72,9 +88,41 @@ void XmlNode::delete_all_children()
   this->children.clear();
 }
 
+void XmlNode::release_children(std::vector<std::unique_ptr<XmlNode>>& pool, const std::size_t pool_limit)
+{
+  for (auto& child: this->children)
+    {
+      child->release_children(pool, pool_limit);
+      if (pool.size() < pool_limit &&
+          child->inner.capacity() <= max_pooled_string_capacity &&
+          child->tail.capacity() <= max_pooled_string_capacity &&
+          child->children.capacity() <= max_pooled_children_capacity)
+        {
+          // Do not keep the content of the stanza around until the node
+          // is reused
+          child->parent = nullptr;
+          child->attributes.clear();
+          child->inner.clear();
+          child->tail.clear();
+          pool.push_back(std::move(child));
+        }
+    }
+  this->children.clear();
+}
+
+void XmlNode::reset(const std::string& name, XmlNode* parent)
+{
+  this->parent = parent;
+  this->attributes.clear();
+  this->children.clear();
+  this->inner.clear();
+  this->tail.clear();
+  this->set_qualified_name(name);
+}
+
 void XmlNode::set_attribute(const std::string& name, const std::string& value)
 {
-  this->attributes[name] = value;
+  (*this)[name] = value;
 }
 
 void XmlNode::set_tail(const std::string& data)
@@ -87,6 +135,11 @@ void XmlNode::add_to_tail(const std::string& data)
   this->tail += data;
 }
 
+void XmlNode::add_to_tail(const char* data, const std::size_t len)
+{
+  this->tail.append(data, len);
+}
+
 void XmlNode::set_inner(const std::string& data)
 {
   this->inner = data;
@@ -97,6 +150,11 @@ void XmlNode::add_to_inner(const std::string& data)
   this->inner += data;
 }
 
+void XmlNode::add_to_inner(const char* data, const std::size_t len)
+{
+  this->inner.append(data, len);
+}
+
 std::string XmlNode::get_inner() const
 {
   return this->inner;
@@ -107,11 +165,45 @@ std::string XmlNode::get_tail() const
   return this->tail;
 }
 
+XmlSymbol XmlNode::get_name_symbol() const
+{
+  if (this->name_symbol == not_looked_up)
+    this->name_symbol = find_xml_symbol(this->name);
+  return this->name_symbol;
+}
+
+XmlSymbol XmlNode::get_xmlns_symbol() const
+{
+  if (this->xmlns_symbol == not_looked_up)
+    this->xmlns_symbol = find_xml_symbol(this->get_tag("xmlns"));
+  return this->xmlns_symbol;
+}
+
+bool XmlNode::matches(const std::string& name, const XmlSymbol name_symbol,
+                      const std::string& xmlns, const XmlSymbol xmlns_symbol) const
+{
+  // If a symbol is known, comparing it is enough.  Otherwise, the strings
+  // must be compared, except if our own symbol is known: the strings are
+  // then necessarily different.
+  if (name_symbol != unknown_symbol)
+    {
+      if (this->get_name_symbol() != name_symbol)
+        return false;
+    }
+  else if (this->get_name_symbol() != unknown_symbol || this->name != name)
+    return false;
+  if (xmlns_symbol != unknown_symbol)
+    return this->get_xmlns_symbol() == xmlns_symbol;
+  return this->get_xmlns_symbol() == unknown_symbol && this->get_tag("xmlns") == xmlns;
+}
+
 const XmlNode* XmlNode::get_child(const std::string& name, const std::string& xmlns) const
 {
+  const auto name_symbol = find_xml_symbol(name);
+  const auto xmlns_symbol = find_xml_symbol(xmlns);
   for (const auto& child: this->children)
     {
-      if (child->name == name && child->get_tag("xmlns") == xmlns)
+      if (child->matches(name, name_symbol, xmlns, xmlns_symbol))
         return child.get();
     }
   return nullptr;
@@ -120,9 +212,11 @@ const XmlNode* XmlNode::get_child(const std::string& name, const std::string& xm
 std::vector<const XmlNode*> XmlNode::get_children(const std::string& name, const std::string& xmlns) const
 {
   std::vector<const XmlNode*> res;
+  const auto name_symbol = find_xml_symbol(name);
+  const auto xmlns_symbol = find_xml_symbol(xmlns);
   for (const auto& child: this->children)
     {
-      if (child->name == name && child->get_tag("xmlns") == xmlns)
+      if (child->matches(name, name_symbol, xmlns, xmlns_symbol))
         res.push_back(child.get());
     }
   return res;
@@ -161,11 +255,13 @@ XmlNode* XmlNode::get_parent() const
 void XmlNode::set_name(const std::string& name)
 {
   this->name = name;
+  this->name_symbol = not_looked_up;
 }
 
 void XmlNode::set_name(std::string&& name)
 {
   this->name = std::move(name);
+  this->name_symbol = not_looked_up;
 }
 
 const std::string XmlNode::get_name() const
@@ -199,28 +295,54 @@ bool XmlNode::has_children() const
 
 const std::string& XmlNode::get_tag(const std::string& name) const
 {
-  try
-    {
-      const auto& value = this->attributes.at(name);
-      return value;
-    }
-  catch (const std::out_of_range& e)
+  const auto it = this->find_attribute(name);
+  if (it == this->attributes.end() || it->first != name)
     {
       static const std::string def{};
       return def;
     }
+  return it->second;
 }
 
 bool XmlNode::del_tag(const std::string& name)
 {
-  if (this->attributes.erase(name) != 0)
-    return true;
-  return false;
+  const auto it = this->find_attribute(name);
+  if (it == this->attributes.end() || it->first != name)
+    return false;
+  this->attributes.erase(it);
+  if (name == "xmlns")
+    this->xmlns_symbol = not_looked_up;
+  return true;
 }
 
 std::string& XmlNode::operator[](const std::string& name)
 {
-  return this->attributes[name];
+  // The caller may modify the value of the xmlns through the returned
+  // reference, we will need to look up its symbol again
+  if (name == "xmlns")
+    this->xmlns_symbol = not_looked_up;
+  auto it = this->find_attribute(name);
+  if (it == this->attributes.end() || it->first != name)
+    it = this->attributes.emplace(it, name, std::string{});
+  return it->second;
+}
+
+std::vector<XmlNode::Attribute>::iterator XmlNode::find_attribute(const std::string& name)
+{
+  return std::lower_bound(this->attributes.begin(), this->attributes.end(), name,
+                          [](const Attribute& attribute, const std::string& n)
+                          {
+                            return attribute.first < n;
+                          });
+}
+
+std::vector<XmlNode::Attribute>::const_iterator XmlNode::find_attribute(const std::string& name) const
+{
+  return std::lower_bound(this->attributes.begin(), this->attributes.end(), name,
+                          [](const Attribute& attribute, const std::string& n)
+                          {
+                            return attribute.first < n;
+                          });
 }
 
 std::ostream& operator<<(std::ostream& os, const XmlNode& node)
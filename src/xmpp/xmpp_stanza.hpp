@@ -1,8 +1,10 @@
 #pragma once
 
 
-#include <map>
+#include <xmpp/xml_symbols.hpp>
+
 #include <string>
+#include <utility>
 #include <vector>
 #include <memory>
 
@@ -16,7 +18,7 @@ std::string sanitize(const std::string& data, const std::string& encoding = "ISO
      nullptr)
  * - zero, one or more children XML nodes
  * - A name
- * - A map of attributes
+ * - A list of attributes, sorted by name
  * - inner data (text inside the node)
  * - tail data (text just after the node)
  */
@@ -31,6 +33,8 @@ public:
    */
   XmlNode(const XmlNode& node):
     name(node.name),
+    name_symbol(node.name_symbol),
+    xmlns_symbol(node.xmlns_symbol),
     parent(nullptr),
     attributes(node.attributes),
     children{},
@@ -48,6 +52,19 @@ public:
   ~XmlNode() = default;
 
   void delete_all_children();
+  /**
+   * Remove all the children, recursively, and put them in the given pool
+   * (while it has less than pool_limit elements) instead of freeing them.
+   * Their content is cleared, but not the memory allocated by their strings
+   * and vectors, which can then be reused with reset().  The nodes that
+   * allocated too much of it are freed instead.
+   */
+  void release_children(std::vector<std::unique_ptr<XmlNode>>& pool, const std::size_t pool_limit);
+  /**
+   * Make this node look like a newly constructed one, with the given name
+   * and parent.
+   */
+  void reset(const std::string& name, XmlNode* parent);
   void set_attribute(const std::string& name, const std::string& value);
   /**
    * Set the content of the tail, that is the text just after this node
@@ -59,6 +76,7 @@ public:
    * than one call
    */
   void add_to_tail(const std::string& data);
+  void add_to_tail(const char* data, const std::size_t len);
   /**
    * Set the content of the inner, that is the text inside this node.
    */
@@ -68,6 +86,7 @@ public:
    * described in add_to_tail comment.
    */
   void add_to_inner(const std::string& data);
+  void add_to_inner(const char* data, const std::size_t len);
   /**
    * Get the content of inner
    */
@@ -126,9 +145,44 @@ public:
   std::string& operator[](const std::string& name);
 
 private:
+  using Attribute = std::pair<std::string, std::string>;
+  /**
+   * Split the expat "namespace:name" into the name and the xmlns attribute
+   */
+  void set_qualified_name(const std::string& name);
+  /**
+   * Return the position of that attribute, or of the place where it should
+   * be inserted if it is absent.
+   */
+  std::vector<Attribute>::iterator find_attribute(const std::string& name);
+  std::vector<Attribute>::const_iterator find_attribute(const std::string& name) const;
+  /**
+   * Return the symbols of our name and namespace, looking them up if they
+   * changed since the last call.
+   */
+  XmlSymbol get_name_symbol() const;
+  XmlSymbol get_xmlns_symbol() const;
+  /**
+   * Whether this node has that name and that namespace, whose symbols
+   * have already been looked up.
+   */
+  bool matches(const std::string& name, const XmlSymbol name_symbol,
+               const std::string& xmlns, const XmlSymbol xmlns_symbol) const;
+
   std::string name;
+  /**
+   * Value used for the symbols that have not been looked up since the
+   * name or the xmlns attribute changed.
+   */
+  static constexpr XmlSymbol not_looked_up = static_cast<XmlSymbol>(-1);
+  mutable XmlSymbol name_symbol{not_looked_up};
+  mutable XmlSymbol xmlns_symbol{not_looked_up};
   XmlNode* parent;
-  std::map<std::string, std::string> attributes;
+  /**
+   * Nodes only have a few attributes: a small vector, sorted by name, is
+   * faster and lighter than a map.
+   */
+  std::vector<Attribute> attributes;
   std::vector<std::unique_ptr<XmlNode>> children;
   std::string inner;
   std::string tail;
@@ -0,0 +1,248 @@
+/**
+ * Compare the pollers, by exchanging messages with some synthetic IRC
+ * servers, running in another thread.
+ *
+ * Usage: poller_benchmark [number of servers] [messages per server]
+ *
+ * Each server sends PRIVMSG lines as fast as possible, with a PING every
+ * ten lines, and each of our clients answers the PINGs with a PONG.  The
+ * time and the CPU used by the thread of the Poller are displayed for
+ * each poller.  To also count the system calls, run it with “strace -f -c”
+ * or “perf trace -s”.
+ */
+
+#include <network/poller.hpp>
+#include <network/tcp_client_socket_handler.hpp>
+#include <config/config.hpp>
+
+#include <sys/resource.h>
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+#include <poll.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#include <chrono>
+#include <cstdlib>
+#include <iostream>
+#include <memory>
+#include <string>
+#include <thread>
+#include <vector>
+
+using namespace std::chrono_literals;
+
+namespace
+{
+  /**
+   * One line out of ping_interval is a PING
+   */
+  constexpr std::size_t ping_interval = 10;
+
+  class BenchmarkClient: public TCPClientSocketHandler
+  {
+  public:
+    BenchmarkClient(std::shared_ptr<Poller>& poller):
+      TCPClientSocketHandler(poller)
+    {}
+    void on_connected() override final
+    {
+      this->send_data("NICK benchmark\r\nUSER benchmark 0 * :benchmark\r\n");
+    }
+    void parse_in_buffer(const std::size_t) override final
+    {
+      std::string::size_type start = 0;
+      std::string::size_type end;
+      while ((end = this->in_buf.find("\r\n", start)) != std::string::npos)
+        {
+          if (this->in_buf.compare(start, 5, "PING ") == 0)
+            this->send_data("PONG " + this->in_buf.substr(start + 5, end - start - 5) + "\r\n");
+          this->lines++;
+          start = end + 2;
+        }
+      this->consume_in_buffer(start);
+    }
+    std::size_t lines{0};
+  };
+
+  /**
+   * A listening socket, and the connection it accepted, that sends
+   * “messages” lines and counts the PONGs it receives.
+   */
+  struct SyntheticServer
+  {
+    int listener{-1};
+    int client{-1};
+    std::string port;
+    std::size_t sent_lines{0};
+    std::size_t received_lines{0};
+    std::string out_buf;
+    std::string::size_type out_pos{0};
+  };
+
+  SyntheticServer make_server()
+  {
+    SyntheticServer server;
+    server.listener = ::socket(AF_INET, SOCK_STREAM, 0);
+    struct sockaddr_in addr{};
+    addr.sin_family = AF_INET;
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    socklen_t addr_len = sizeof(addr);
+    if (server.listener == -1 ||
+        ::bind(server.listener, reinterpret_cast<struct sockaddr*>(&addr), addr_len) == -1 ||
+        ::listen(server.listener, 1) == -1 ||
+        ::getsockname(server.listener, reinterpret_cast<struct sockaddr*>(&addr), &addr_len) == -1)
+      throw std::runtime_error("Could not create a listening socket");
+    server.port = std::to_string(ntohs(addr.sin_port));
+    return server;
+  }
+
+  /**
+   * Runs all the servers, until each of them sent all its messages and
+   * received all the expected PONGs.
+   */
+  void run_servers(std::vector<SyntheticServer>& servers, const std::size_t messages)
+  {
+    std::vector<struct pollfd> fds(servers.size());
+    for (std::size_t i = 0; i < servers.size(); ++i)
+      fds[i] = {servers[i].listener, POLLIN, 0};
+    const std::size_t expected_pongs = messages / ping_interval;
+    std::size_t done = 0;
+    char buf[65536];
+    while (done < servers.size())
+      {
+        if (::poll(fds.data(), fds.size(), 1000) <= 0)
+          continue;
+        for (std::size_t i = 0; i < servers.size(); ++i)
+          {
+            SyntheticServer& server = servers[i];
+            if (server.client == -1)
+              {
+                if (fds[i].revents & POLLIN)
+                  {
+                    server.client = ::accept(server.listener, nullptr, nullptr);
+                    ::fcntl(server.client, F_SETFL, O_NONBLOCK);
+                    fds[i] = {server.client, POLLIN|POLLOUT, 0};
+                  }
+                continue;
+              }
+            if (fds[i].fd == -1)
+              continue;
+            if (fds[i].revents & POLLIN)
+              {
+                ssize_t size;
+                while ((size = ::recv(server.client, buf, sizeof(buf), 0)) > 0)
+                  for (ssize_t j = 0; j < size; ++j)
+                    if (buf[j] == '\n')
+                      server.received_lines++;
+              }
+            if (fds[i].revents & POLLOUT)
+              {
+                // Fill the socket with as many lines as possible
+                while (true)
+                  {
+                    if (server.out_pos == server.out_buf.size())
+                      {
+                        server.out_buf.clear();
+                        server.out_pos = 0;
+                        for (; server.sent_lines < messages && server.out_buf.size() < 16384; ++server.sent_lines)
+                          if ((server.sent_lines + 1) % ping_interval == 0)
+                            server.out_buf += "PING :" + std::to_string(server.sent_lines) + "\r\n";
+                          else
+                            server.out_buf += ":nick!user@host PRIVMSG #benchmark :message number " +
+                                std::to_string(server.sent_lines) + "\r\n";
+                        if (server.out_buf.empty())
+                          break;
+                      }
+                    const ssize_t size = ::send(server.client, server.out_buf.data() + server.out_pos,
+                                                server.out_buf.size() - server.out_pos, MSG_NOSIGNAL);
+                    if (size <= 0)
+                      break;
+                    server.out_pos += static_cast<std::size_t>(size);
+                  }
+                if (server.sent_lines == messages && server.out_pos == server.out_buf.size())
+                  fds[i].events = POLLIN;
+              }
+            // The first two lines are NICK and USER
+            if (server.received_lines >= expected_pongs + 2 && fds[i].events == POLLIN)
+              {
+                fds[i].fd = -1;
+                done++;
+              }
+          }
+      }
+  }
+
+  void run_benchmark(const bool use_io_uring, const std::size_t number, const std::size_t messages)
+  {
+    Config::set("io_uring", use_io_uring ? "true" : "false", false);
+    auto poller = std::make_shared<Poller>();
+    if (use_io_uring && !poller->is_using_io_uring())
+      {
+        std::cout << "io_uring: not available" << std::endl;
+        return;
+      }
+
+    std::vector<SyntheticServer> servers;
+    for (std::size_t i = 0; i < number; ++i)
+      servers.push_back(make_server());
+
+    struct rusage usage_before;
+    ::getrusage(RUSAGE_THREAD, &usage_before);
+    const auto start = std::chrono::steady_clock::now();
+
+    std::thread server_thread(run_servers, std::ref(servers), messages);
+    std::vector<std::unique_ptr<BenchmarkClient>> clients;
+    for (const SyntheticServer& server: servers)
+      {
+        clients.push_back(std::make_unique<BenchmarkClient>(poller));
+        clients.back()->connect("127.0.0.1", server.port, false);
+      }
+    std::size_t done = 0;
+    while (done < clients.size())
+      {
+        poller->poll(100ms);
+        done = 0;
+        for (const auto& client: clients)
+          if (client->lines == messages)
+            done++;
+      }
+    // Send the last PONGs
+    while (poller->poll(10ms) > 0);
+    server_thread.join();
+
+    const auto duration = std::chrono::duration_cast<std::chrono::duration<double>>(
+        std::chrono::steady_clock::now() - start);
+    struct rusage usage_after;
+    ::getrusage(RUSAGE_THREAD, &usage_after);
+    const auto cpu_time = [](const struct timeval& after, const struct timeval& before)
+    {
+      return static_cast<double>(after.tv_sec - before.tv_sec) +
+          static_cast<double>(after.tv_usec - before.tv_usec) / 1000000.;
+    };
+    std::cout << (use_io_uring ? "io_uring" : "epoll") << ": "
+              << number * messages << " messages in " << duration.count() << "s ("
+              << static_cast<double>(number * messages) / duration.count() << " messages/s), "
+              << "user CPU " << cpu_time(usage_after.ru_utime, usage_before.ru_utime) << "s, "
+              << "system CPU " << cpu_time(usage_after.ru_stime, usage_before.ru_stime) << "s, "
+              << usage_after.ru_nvcsw - usage_before.ru_nvcsw << " context switches" << std::endl;
+
+    clients.clear();
+    for (const SyntheticServer& server: servers)
+      {
+        ::close(server.client);
+        ::close(server.listener);
+      }
+  }
+}
+
+int main(int argc, char** argv)
+{
+  const std::size_t number = argc > 1 ? std::strtoul(argv[1], nullptr, 10) : 50;
+  const std::size_t messages = argc > 2 ? std::strtoul(argv[2], nullptr, 10) : 20000;
+  Config::set("log_level", "2", false);
+  for (const bool use_io_uring: {true, false})
+    run_benchmark(use_io_uring, number, messages);
+  return 0;
+}
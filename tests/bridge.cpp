@@ -0,0 +1,381 @@
+#include "catch.hpp"
+
+#include <biboumi.h>
+
+#ifdef USE_DATABASE
+
+#include <bridge/bridge.hpp>
+#include <irc/irc_client.hpp>
+#include <xmpp/biboumi_component.hpp>
+#include <database/database.hpp>
+#include <database/save.hpp>
+#include <network/poller.hpp>
+#include <utils/timed_events.hpp>
+
+#include <thread>
+
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+#include <unistd.h>
+
+using namespace std::chrono_literals;
+
+namespace
+{
+/**
+ * A minimal IRC server, listening on a random port of the loopback
+ * interface, that accepts one connection
+ */
+class FakeIrcServer
+{
+public:
+  FakeIrcServer()
+  {
+    this->server = ::socket(AF_INET, SOCK_STREAM, 0);
+    struct sockaddr_in addr{};
+    addr.sin_family = AF_INET;
+    addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+    socklen_t addr_len = sizeof(addr);
+    ::bind(this->server, reinterpret_cast<struct sockaddr*>(&addr), addr_len);
+    ::listen(this->server, 1);
+    ::getsockname(this->server, reinterpret_cast<struct sockaddr*>(&addr), &addr_len);
+    this->port = std::to_string(ntohs(addr.sin_port));
+  }
+  ~FakeIrcServer()
+  {
+    this->disconnect();
+    ::close(this->server);
+  }
+  void accept()
+  {
+    this->client = ::accept(this->server, nullptr, nullptr);
+  }
+  void send(const std::string& line)
+  {
+    const std::string data = line + "\r\n";
+    ::send(this->client, data.data(), data.size(), 0);
+  }
+  bool received(const std::string& needle)
+  {
+    char buf[4096];
+    ssize_t size;
+    while ((size = ::recv(this->client, buf, sizeof(buf), MSG_DONTWAIT)) > 0)
+      this->data.append(buf, static_cast<std::size_t>(size));
+    return this->data.find(needle) != std::string::npos;
+  }
+  void disconnect()
+  {
+    if (this->client != -1)
+      ::close(this->client);
+    this->client = -1;
+  }
+
+  int server{-1};
+  int client{-1};
+  std::string port;
+  std::string data;
+};
+
+template <typename Condition>
+bool poll_until(Poller& poller, Condition&& condition)
+{
+  for (int i = 0; i < 200 && !condition(); ++i)
+    poller.poll(10ms);
+  return condition();
+}
+
+/**
+ * Connect to the server, with these capabilities, and join #foo
+ */
+IrcClient* join_channel(Poller& poller, FakeIrcServer& server, Bridge& bridge,
+                        const std::string& hostname, const std::string& caps)
+{
+  bridge.join_irc_channel(Iid("#foo%" + hostname, {'#'}), "nick", "", "res", {}, false);
+  IrcClient* irc = bridge.find_irc_client(hostname);
+  REQUIRE(irc != nullptr);
+  REQUIRE(poll_until(poller, [irc]() { return irc->is_connected(); }));
+  server.accept();
+  REQUIRE(poll_until(poller, [&server]() { return server.received("CAP LS"); }));
+  server.send(":irc.example.com CAP * LS :" + caps);
+  REQUIRE(poll_until(poller, [&server]() { return server.received("CAP REQ"); }));
+  server.send(":irc.example.com CAP nick ACK :" + caps);
+  REQUIRE(poll_until(poller, [&server]() { return server.received("CAP END"); }));
+  server.send(":irc.example.com 001 nick :Welcome");
+  REQUIRE(poll_until(poller, [&server]() { return server.received("JOIN #foo"); }));
+  server.send(":nick!user@host JOIN :#foo");
+  server.send(":irc.example.com 366 nick #foo :End of /NAMES list");
+  REQUIRE(poll_until(poller, [irc]() { return irc->is_channel_joined("#foo"); }));
+  return irc;
+}
+}
+
+TEST_CASE("Clean the bridges and the IRC clients")
+{
+  Database::open(":memory:");
+  Database::raw_exec("DELETE FROM " + Database::irc_server_options.get_name());
+
+  const std::string user_jid{"user@example.com"};
+  const std::string hostname{"127.0.0.1"};
+  FakeIrcServer server;
+  auto options = Database::get_irc_server_options(user_jid, hostname);
+  options.col<Database::Ports>() = server.port;
+  save(options, *Database::db);
+
+  auto poller = std::make_shared<Poller>();
+  BiboumiComponent xmpp(poller, "biboumi.example.com", "secret");
+
+  SECTION("A bridge that never gets a client is removed")
+    {
+      CHECK(xmpp.get_user_bridge(user_jid + "/res") != nullptr);
+      xmpp.clean();
+      CHECK(xmpp.find_user_bridge(user_jid + "/res") == nullptr);
+    }
+
+  SECTION("Connected clients")
+    {
+      Bridge* bridge = xmpp.get_user_bridge(user_jid + "/res");
+      bridge->join_irc_channel(Iid("#foo%" + hostname, {'#'}), "nick", "", "res", {}, false);
+      IrcClient* irc = bridge->find_irc_client(hostname);
+      REQUIRE(irc != nullptr);
+      REQUIRE(poll_until(*poller, [irc]() { return irc->is_connected(); }));
+      server.accept();
+
+      // The client is marked when it is created, but it is still active
+      xmpp.clean();
+      REQUIRE(xmpp.find_user_bridge(user_jid) == bridge);
+      CHECK(bridge->find_irc_client(hostname) == irc);
+
+      SECTION("The server closes the connection")
+        {
+          server.disconnect();
+          REQUIRE(poll_until(*poller, [irc]() { return !irc->is_connected(); }));
+          xmpp.clean();
+          CHECK(xmpp.find_user_bridge(user_jid) == nullptr);
+        }
+
+      SECTION("The user leaves the last channel")
+        {
+          server.send(":irc.example.com 001 nick :Welcome");
+          REQUIRE(poll_until(*poller, [&server]() { return server.received("JOIN #foo"); }));
+          server.send(":nick!user@host JOIN :#foo");
+          server.send(":irc.example.com 366 nick #foo :End of /NAMES list");
+          REQUIRE(poll_until(*poller, [irc]() { return irc->is_channel_joined("#foo"); }));
+
+          bridge->leave_irc_channel({"#foo", hostname, Iid::Type::Channel}, "", "res");
+          REQUIRE(poll_until(*poller, [&server]() { return server.received("PART #foo"); }));
+          server.send(":nick!user@host PART #foo");
+          REQUIRE(poll_until(*poller, [&server]() { return server.received("QUIT"); }));
+          // Nothing changed for the client until the server closes the
+          // connection
+          xmpp.clean();
+          REQUIRE(xmpp.find_user_bridge(user_jid) == bridge);
+
+          server.disconnect();
+          REQUIRE(poll_until(*poller, [irc]() { return !irc->is_connected(); }));
+          xmpp.clean();
+          CHECK(xmpp.find_user_bridge(user_jid) == nullptr);
+        }
+
+      SECTION("The full clean removes the clients that were not marked")
+        {
+          // Closing the socket directly does not mark the client
+          irc->close();
+          xmpp.clean();
+          REQUIRE(xmpp.find_user_bridge(user_jid) == bridge);
+          CHECK(bridge->find_irc_client(hostname) == irc);
+          xmpp.clean(true);
+          CHECK(xmpp.find_user_bridge(user_jid) == nullptr);
+        }
+    }
+
+  Database::close();
+}
+
+TEST_CASE("Waiting IRC callbacks expire")
+{
+  Database::open(":memory:");
+  auto poller = std::make_shared<Poller>();
+  BiboumiComponent xmpp(poller, "biboumi.example.com", "secret");
+  Bridge* bridge = xmpp.get_user_bridge("user@example.com/res");
+
+  int calls = 0;
+  int timeouts = 0;
+  IrcResponse response = IrcResponse::ignored;
+  bridge->add_waiting_irc("irc.example.com", {"NOTICE"},
+                          [&calls, &response](const std::string&, const IrcMessage&)
+                          {
+                            ++calls;
+                            return response;
+                          },
+                          [&timeouts]() { ++timeouts; }, 100ms);
+  const IrcMessage notice("NOTICE", {"nick", "text"});
+
+  SECTION("The messages that are ignored do not delay the expiration")
+    {
+      for (int i = 0; i < 2; ++i)
+        {
+          std::this_thread::sleep_for(40ms);
+          bridge->trigger_on_irc_message("irc.example.com", notice);
+          TimedEventsManager::instance().execute_expired_events();
+        }
+      CHECK(timeouts == 0);
+      std::this_thread::sleep_for(40ms);
+      TimedEventsManager::instance().execute_expired_events();
+      CHECK(timeouts == 1);
+      bridge->trigger_on_irc_message("irc.example.com", notice);
+      CHECK(calls == 2);
+    }
+
+  SECTION("Each partial response delays the expiration")
+    {
+      response = IrcResponse::partial;
+      for (int i = 0; i < 3; ++i)
+        {
+          std::this_thread::sleep_for(60ms);
+          bridge->trigger_on_irc_message("irc.example.com", notice);
+          TimedEventsManager::instance().execute_expired_events();
+        }
+      CHECK(timeouts == 0);
+      CHECK(calls == 3);
+      std::this_thread::sleep_for(120ms);
+      TimedEventsManager::instance().execute_expired_events();
+      CHECK(timeouts == 1);
+    }
+
+  SECTION("A callback that is done is removed")
+    {
+      response = IrcResponse::done;
+      bridge->trigger_on_irc_message("irc.example.com", notice);
+      bridge->trigger_on_irc_message("irc.example.com", notice);
+      CHECK(calls == 1);
+      std::this_thread::sleep_for(120ms);
+      TimedEventsManager::instance().execute_expired_events();
+      CHECK(timeouts == 0);
+    }
+
+  Database::close();
+}
+
+TEST_CASE("Echo of our own channel messages")
+{
+  Database::open(":memory:");
+  Database::raw_exec("DELETE FROM " + Database::irc_server_options.get_name());
+
+  const std::string user_jid{"user@example.com"};
+  const std::string hostname{"127.0.0.1"};
+  FakeIrcServer server;
+  auto options = Database::get_irc_server_options(user_jid, hostname);
+  options.col<Database::Ports>() = server.port;
+  save(options, *Database::db);
+
+  auto poller = std::make_shared<Poller>();
+  BiboumiComponent xmpp(poller, "biboumi.example.com", "secret");
+  Bridge* bridge = xmpp.get_user_bridge(user_jid + "/res");
+
+  // The ids of the messages whose echo callback was called
+  std::vector<int> reflected;
+  const auto send = [&reflected](IrcClient* irc, const std::string& body, const int id)
+  {
+    irc->send_channel_message("#foo", body, [&reflected, id](const IrcClient*, const IrcMessage&)
+    {
+      reflected.push_back(id);
+    });
+  };
+
+  SECTION("Without labels, the echoes are matched with the oldest messages")
+    {
+      IrcClient* irc = join_channel(*poller, server, *bridge, hostname, "echo-message");
+      send(irc, "first", 1);
+      send(irc, "second", 2);
+      send(irc, "\x02third\x02", 3);
+      REQUIRE(poll_until(*poller, [&server]() { return server.received("PRIVMSG #foo \x02third\x02"); }));
+
+      // The first one is refused, with an error that is not a 404
+      server.send(":irc.example.com 477 nick #foo :You need to be identified");
+      server.send(":nick!user@host PRIVMSG #foo second");
+      REQUIRE(poll_until(*poller, [&reflected]() { return !reflected.empty(); }));
+      CHECK(reflected == std::vector<int>{2});
+
+      // The server removed the colors from the third one
+      server.send(":nick!user@host PRIVMSG #foo third");
+      REQUIRE(poll_until(*poller, [&reflected]() { return reflected.size() == 2; }));
+      CHECK(reflected == std::vector<int>{2, 3});
+    }
+
+  SECTION("With labeled-response, the echoes and errors are recognized by their label")
+    {
+      IrcClient* irc = join_channel(*poller, server, *bridge, hostname, "echo-message batch labeled-response");
+      send(irc, "same", 1);
+      send(irc, "same", 2);
+      send(irc, "same", 3);
+      REQUIRE(poll_until(*poller, [&server]() { return server.received("@label=biboumi2 PRIVMSG #foo same"); }));
+
+      server.send("@label=biboumi0 :irc.example.com 404 nick #foo :Cannot send to channel");
+      server.send("@label=biboumi1 :nick!user@host PRIVMSG #foo same");
+      REQUIRE(poll_until(*poller, [&reflected]() { return !reflected.empty(); }));
+      CHECK(reflected == std::vector<int>{2});
+
+      server.send("@label=biboumi2 :nick!user@host PRIVMSG #foo same");
+      REQUIRE(poll_until(*poller, [&reflected]() { return reflected.size() == 2; }));
+      CHECK(reflected == std::vector<int>{2, 3});
+    }
+
+  Database::close();
+}
+
+TEST_CASE("Channels list shared by the users")
+{
+  Database::open(":memory:");
+  Database::raw_exec("DELETE FROM " + Database::irc_server_options.get_name());
+
+  const std::string user_jid{"user@example.com"};
+  const std::string hostname{"127.0.0.1"};
+  FakeIrcServer server;
+  auto options = Database::get_irc_server_options(user_jid, hostname);
+  options.col<Database::Ports>() = server.port;
+  save(options, *Database::db);
+
+  auto poller = std::make_shared<Poller>();
+  BiboumiComponent xmpp(poller, "biboumi.example.com", "secret");
+  auto& cache = xmpp.get_channel_list_cache();
+  Bridge* connected = xmpp.get_user_bridge(user_jid + "/res");
+  Bridge* disconnected = xmpp.get_user_bridge("other@example.com/res");
+  const Iid iid("", hostname, Iid::Type::Server);
+
+  IrcClient* irc = join_channel(*poller, server, *connected, hostname, "multi-prefix");
+
+  // A user that is not connected to that server can not fetch the list,
+  // and must not block the others
+  CHECK_THROWS_AS(disconnected->send_irc_channel_search(iid, "1", "other@example.com/res", "",
+                                                        ChannelDirectory::Order::list, 10),
+                  IRCNotConnected);
+  CHECK(cache.needs_fetch(hostname, true));
+
+  connected->send_irc_channel_search(iid, "2", user_jid + "/res", "", ChannelDirectory::Order::list, 10);
+  REQUIRE(poll_until(*poller, [&server]() { return server.received("LIST"); }));
+  server.send(":irc.example.com 322 nick #foo 12 :Foo");
+
+  SECTION("The list is complete")
+    {
+      server.send(":irc.example.com 323 nick :End of /LIST");
+      REQUIRE(poll_until(*poller, [&cache, &hostname]() { return cache.get(hostname).complete; }));
+      CHECK_FALSE(cache.get(hostname).failed);
+      CHECK(cache.get(hostname).channels.size() == 1);
+    }
+
+  SECTION("The IRC client is disconnected during the fetch")
+    {
+      REQUIRE(poll_until(*poller, [&cache, &hostname]() { return !cache.get(hostname).channels.empty(); }));
+      server.disconnect();
+      REQUIRE(poll_until(*poller, [irc]() { return !irc->is_connected(); }));
+      // The list fails right away, instead of after the timeout
+      CHECK(cache.get(hostname).complete);
+      CHECK(cache.get(hostname).failed);
+      CHECK(cache.needs_fetch(hostname, true));
+    }
+
+  Database::close();
+}
+
+#endif
@@ -0,0 +1,100 @@
+#include "catch.hpp"
+
+#include <bridge/channel_list_cache.hpp>
+
+TEST_CASE("Shared channel list cache")
+{
+  ChannelListCache cache;
+  int fetcher;
+  int other_fetcher;
+
+  // Only one fetch at a time
+  CHECK(cache.start_fetch("irc.example.com", &fetcher, true));
+  CHECK_FALSE(cache.start_fetch("irc.example.com", &other_fetcher, true));
+  CHECK(cache.start_fetch("irc.example.org", &other_fetcher, true));
+
+  // A waiter is called as the list grows, until it returns true
+  std::size_t seen = 0;
+  cache.add_waiter("irc.example.com", [&seen](const ChannelList& list)
+  {
+    seen = list.channels.size();
+    return list.channels.size() >= 2;
+  });
+  std::size_t completed = 0;
+  cache.add_waiter("irc.example.com", [&completed](const ChannelList& list)
+  {
+    if (list.complete)
+      completed = list.channels.size();
+    return false;
+  });
+  cache.add("irc.example.com", {"#a%irc.example.com", "2", "topic a"});
+  CHECK(seen == 1);
+  cache.add("irc.example.com", {"#b%irc.example.com", "5", "topic b"});
+  CHECK(seen == 2);
+  cache.add("irc.example.com", {"#c%irc.example.com", "1", "topic c"});
+  CHECK(seen == 2);
+  CHECK(completed == 0);
+  cache.complete("irc.example.com");
+  CHECK(completed == 3);
+
+  const ChannelList& list = cache.get("irc.example.com");
+  CHECK(list.complete);
+  CHECK(list.find("#b%irc.example.com") == 1);
+  CHECK(list.find("#nope%irc.example.com") == 3);
+
+  // The index is built by the first search
+  const ChannelDirectory& directory = cache.get_directory("irc.example.com");
+  CHECK(directory.size() == 3);
+  CHECK(directory.search("topic b", ChannelDirectory::Order::list) == std::vector<std::size_t>{1});
+  CHECK(cache.get_directory("irc.example.org").size() == 0);
+
+  // The complete list is re-used
+  CHECK_FALSE(cache.start_fetch("irc.example.com", &fetcher, true));
+  bool called = false;
+  cache.add_waiter("irc.example.com", [&called](const ChannelList& list)
+  {
+    called = list.complete;
+    return false;
+  });
+  CHECK(called);
+
+  // A fetch that can not complete fails, and is tried again next time
+  std::string error = "none";
+  cache.add_waiter("irc.example.org", [&error](const ChannelList& list)
+  {
+    if (list.failed)
+      error = list.error;
+    return false;
+  });
+  cache.abort_fetches(&other_fetcher);
+  CHECK(error.empty());
+  CHECK(cache.get("irc.example.org").failed);
+  CHECK(cache.size() == 2);
+  cache.remove_expired();
+  CHECK(cache.size() == 1);
+  CHECK(cache.start_fetch("irc.example.org", &fetcher, false));
+}
+
+TEST_CASE("Channel directory search")
+{
+  ChannelList list;
+  list.add({"#biboumi%irc.example.com", "12", "XMPP to IRC gateway"});
+  list.add({"#python%irc.example.com", "1500", "The Python language"});
+  list.add({"#xmpp%irc.example.com", "300", "Everything about XMPP"});
+  list.add({"#a%irc.example.com", "3", ""});
+
+  ChannelDirectory directory;
+  directory.build(list);
+  CHECK(directory.size() == 4);
+
+  using Order = ChannelDirectory::Order;
+  CHECK(directory.search("xmpp", Order::list) == std::vector<std::size_t>{0, 2});
+  CHECK(directory.search("XMPP", Order::users) == std::vector<std::size_t>{2, 0});
+  CHECK(directory.search("python", Order::list) == std::vector<std::size_t>{1});
+  CHECK(directory.search("#a%", Order::list) == std::vector<std::size_t>{3});
+  CHECK(directory.search("a", Order::list).size() == 4);
+  CHECK(directory.search("", Order::users) == std::vector<std::size_t>{1, 2, 0, 3});
+  CHECK(directory.search("nothing like this", Order::list).empty());
+  // The name and topic are indexed separately
+  CHECK(directory.search("comeverything", Order::list).empty());
+}
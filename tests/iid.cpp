@@ -2,32 +2,171 @@
 
 #include <irc/iid.hpp>
 #include <irc/irc_user.hpp>
+#include <irc/irc_channel.hpp>
+#include <irc/irc_message.hpp>
+#include <irc/irc_capabilities.hpp>
 
 #include <config/config.hpp>
 
 TEST_CASE("Irc user parsing")
 {
-  const std::map<char, char> prefixes{{'!', 'a'}, {'@', 'o'}};
+  IrcUserModeRanks prefixes;
+  prefixes.set("ao", "!@");
   IrcUser user1("!nick!~some@host.bla", prefixes);
   CHECK(user1.nick == "nick");
   CHECK(user1.host == "~some@host.bla");
-  CHECK(user1.modes.size() == 1);
-  CHECK(user1.modes.find('a') != user1.modes.end());
+  const auto modes1 = IrcUserModes::from_prefixes("!nick!~some@host.bla", prefixes);
+  CHECK(modes1.size() == 1);
+  CHECK(modes1.has('a', prefixes));
 
   IrcUser user2("coucou!~other@host.bla", prefixes);
   CHECK(user2.nick == "coucou");
   CHECK(user2.host == "~other@host.bla");
-  CHECK(user2.modes.empty());
-  CHECK(user2.modes.find('a') == user2.modes.end());
+  const auto modes2 = IrcUserModes::from_prefixes("coucou!~other@host.bla", prefixes);
+  CHECK(modes2.empty());
+  CHECK(!modes2.has('a', prefixes));
 }
 
 TEST_CASE("multi-prefix")
 {
-  const std::map<char, char> prefixes{{'!', 'a'}, {'@', 'o'}, {'~', 'f'}};
+  IrcUserModeRanks prefixes;
+  prefixes.set("aof", "!@~");
   IrcUser user("!@~nick", prefixes);
   CHECK(user.nick == "nick");
-  CHECK(user.modes.size() == 3);
-  CHECK(user.modes.find('f') != user.modes.end());
+  const auto modes = IrcUserModes::from_prefixes("!@~nick", prefixes);
+  CHECK(modes.size() == 3);
+  CHECK(modes.has('f', prefixes));
+  CHECK(modes.get_most_significant(prefixes) == 'a');
+}
+
+TEST_CASE("Most significant user mode")
+{
+  IrcUserModeRanks ranks;
+  ranks.set("qaohv", "~&@%+");
+  CHECK(ranks.get_rank('q') == 0);
+  CHECK(ranks.get_rank('v') == 4);
+  CHECK(ranks.get_rank('x') == -1);
+  CHECK(ranks.get_prefix_rank('%') == 3);
+  CHECK(ranks.get_prefix_rank('o') == -1);
+
+  IrcUserModes modes;
+  CHECK(modes.get_most_significant(ranks) == 0);
+  modes.add('v', ranks);
+  CHECK(modes.get_most_significant(ranks) == 'v');
+  modes.add('o', ranks);
+  modes.add('x', ranks);
+  CHECK(modes.size() == 2);
+  CHECK(modes.get_most_significant(ranks) == 'o');
+  modes.remove('o', ranks);
+  CHECK(!modes.has('o', ranks));
+  CHECK(modes.get_most_significant(ranks) == 'v');
+
+  // The modes known before are forgotten
+  ranks.set("ov", "@+");
+  CHECK(ranks.get_rank('q') == -1);
+  CHECK(ranks.get_prefix_rank('~') == -1);
+  CHECK(ranks.get_rank('v') == 1);
+}
+
+TEST_CASE("Users shared between channels")
+{
+  IrcUserModeRanks prefixes;
+  prefixes.set("ov", "@+");
+  IrcUserTable table;
+  IrcChannel chan1(table);
+  IrcChannel chan2(table);
+
+  chan1.set_self(chan1.add_user("me!~me@home", prefixes));
+  chan1.add_user("@nick", prefixes);
+  chan2.add_user("+nick!~nick@host", prefixes);
+  CHECK(table.size() == 2);
+
+  const auto* user1 = chan1.find_user("nick");
+  const auto* user2 = chan2.find_user("nick!~nick@host");
+  REQUIRE(user1);
+  REQUIRE(user2);
+  CHECK(user1->user == user2->user);
+  CHECK(user1->user->host == "~nick@host");
+  CHECK(user1->modes.has('o', prefixes));
+  CHECK(!user1->modes.has('v', prefixes));
+  CHECK(user2->modes.has('v', prefixes));
+  CHECK(chan1.get_self()->user->nick == "me");
+  CHECK(!chan2.find_user("me"));
+
+  table.rename("nick", "other");
+  CHECK(!chan1.find_user("nick"));
+  CHECK(chan2.find_user("other") == user2);
+
+  chan2.remove_user(user2);
+  CHECK(table.size() == 2);
+  {
+    const auto removed = chan1.remove_user(chan1.find_user("other"));
+    CHECK(removed.user->nick == "other");
+    CHECK(table.find("other") == removed.user.get());
+  }
+  CHECK(table.size() == 1);
+  CHECK(!table.find("other"));
+
+  chan1.joined = true;
+  chan1.remove_user(chan1.get_self());
+  CHECK(!chan1.get_self());
+  CHECK(!chan1.joined);
+  CHECK(table.size() == 0);
+}
+
+TEST_CASE("Removing a user keeps the others reachable")
+{
+  IrcUserModeRanks prefixes;
+  prefixes.set("ov", "@+");
+  IrcUserTable table;
+  IrcChannel chan(table);
+
+  chan.add_user("a", prefixes);
+  chan.set_self(chan.add_user("me", prefixes));
+  chan.add_user("b", prefixes);
+  chan.add_user("+c", prefixes);
+
+  chan.remove_user(chan.find_user("a"));
+  REQUIRE(chan.get_users().size() == 3);
+  REQUIRE(chan.get_self());
+  CHECK(chan.get_self()->user->nick == "me");
+  for (const auto& nick: {"me", "b", "c"})
+    {
+      REQUIRE(chan.find_user(nick));
+      CHECK(chan.find_user(nick)->user->nick == nick);
+    }
+  CHECK(chan.find_user("c")->modes.has('v', prefixes));
+  CHECK(!chan.find_user("a"));
+
+  chan.remove_user(chan.find_user("c"));
+  chan.remove_user(chan.find_user("c"));
+  REQUIRE(chan.get_users().size() == 2);
+  CHECK(chan.find_user("b")->user->nick == "b");
+  CHECK(chan.get_self()->user->nick == "me");
+}
+
+TEST_CASE("Lazy users list")
+{
+  IrcUserTable table;
+  IrcChannel chan(table);
+
+  for (const auto& nick: {"a", "b", "c", "d"})
+    chan.add_user(nick, {})->announced = false;
+  chan.add_user("e", {});
+  CHECK(chan.has_unannounced_users());
+
+  auto users = chan.announce_users(3);
+  REQUIRE(users.size() == 3);
+  CHECK(users[0]->user->nick == "a");
+  CHECK(users[2]->user->nick == "c");
+  CHECK(chan.find_user("a")->announced);
+  CHECK(chan.has_unannounced_users());
+
+  users = chan.announce_users();
+  REQUIRE(users.size() == 1);
+  CHECK(users[0]->user->nick == "d");
+  CHECK_FALSE(chan.has_unannounced_users());
+  CHECK(chan.announce_users().empty());
 }
 
 /**
@@ -132,3 +271,61 @@ TEST_CASE("Iid creation in fixed_server mode")
     CHECK(iid7.get_server() == "fixed.example.com");
     CHECK(iid7.type == Iid::Type::None);
 }
+
+TEST_CASE("IRCv3 message tags")
+{
+  IrcMessage message("@batch=abc;draft/multiline-concat;msgid=a\\sb\\:c\\\\ :nick!u@h PRIVMSG #chan :hello world");
+  CHECK(message.get_tag("batch") == "abc");
+  CHECK(message.has_tag("draft/multiline-concat"));
+  CHECK(message.get_tag("draft/multiline-concat").empty());
+  CHECK(message.get_tag("msgid") == "a b;c\\");
+  CHECK_FALSE(message.has_tag("time"));
+  CHECK(message.prefix == "nick!u@h");
+  CHECK(message.command == "PRIVMSG");
+  CHECK(message.arguments.size() == 2);
+  CHECK(message.arguments[1] == "hello world");
+
+  CHECK(irc::serialize_tags(message.tags) == "batch=abc;draft/multiline-concat;msgid=a\\sb\\:c\\\\");
+
+  IrcMessage no_tags(":server 001 nick :Welcome");
+  CHECK(no_tags.tags.empty());
+  CHECK(no_tags.prefix == "server");
+}
+
+TEST_CASE("IRCv3 capabilities negotiation")
+{
+  IrcCapabilities caps({"multi-prefix", "batch", "draft/multiline"});
+  CHECK_FALSE(caps.is_negotiating());
+  const IrcMessage ls = caps.start();
+  CHECK(ls.command == "CAP");
+  CHECK(ls.arguments[0] == "LS");
+  CHECK(caps.is_negotiating());
+
+  // A list in more than one line
+  CHECK(caps.on_cap(IrcMessage(":server CAP * LS * :multi-prefix sasl")).empty());
+  auto res = caps.on_cap(IrcMessage(":server CAP * LS :draft/multiline=max-bytes=4096,max-lines=10 away-notify"));
+  REQUIRE(res.size() == 1);
+  CHECK(res[0].arguments[0] == "REQ");
+  CHECK(res[0].arguments[1] == "multi-prefix draft/multiline");
+  CHECK(caps.get_value("draft/multiline") == "max-bytes=4096,max-lines=10");
+
+  // Refused all at once: ask them again one by one
+  res = caps.on_cap(IrcMessage(":server CAP * NAK :multi-prefix draft/multiline"));
+  REQUIRE(res.size() == 2);
+  CHECK(res[0].arguments[1] == "multi-prefix");
+  CHECK(res[1].arguments[1] == "draft/multiline");
+  CHECK(caps.on_cap(IrcMessage(":server CAP * ACK :multi-prefix")).empty());
+  res = caps.on_cap(IrcMessage(":server CAP * NAK :draft/multiline"));
+  REQUIRE(res.size() == 1);
+  CHECK(res[0].arguments[0] == "END");
+  CHECK_FALSE(caps.is_negotiating());
+  CHECK(caps.is_enabled("multi-prefix"));
+  CHECK_FALSE(caps.is_enabled("draft/multiline"));
+
+  // Nothing that we want
+  caps.start();
+  res = caps.on_cap(IrcMessage(":server CAP * LS :sasl"));
+  REQUIRE(res.size() == 1);
+  CHECK(res[0].arguments[0] == "END");
+  CHECK(caps.get_enabled().empty());
+}
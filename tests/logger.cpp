@@ -5,8 +5,17 @@
 
 #include "io_tester.hpp"
 #include <iostream>
+#include <fstream>
+#include <thread>
+#include <vector>
+#include <set>
+
+#include <pthread.h>
+#include <dirent.h>
+#include <csignal>
 
 using namespace std::string_literals;
+using namespace std::chrono_literals;
 
 TEST_CASE("Basic logging")
 {
@@ -41,6 +50,14 @@ TEST_CASE("Basic logging")
           THEN("nothing is written")
             CHECK(out.str().empty());
         }
+      WHEN("we log some debug text that is expensive to compute")
+        {
+          int evaluations = 0;
+          auto expensive = [&evaluations]() { return ++evaluations; };
+          log_debug("value: ", expensive());
+          THEN("the arguments are not evaluated")
+            CHECK(evaluations == 0);
+        }
       WHEN("we log some errors")
         {
           IoTester<std::ostream> out(std::cout);
@@ -50,3 +67,109 @@ TEST_CASE("Basic logging")
         }
     }
 }
+
+TEST_CASE("Asynchronous logging")
+{
+  const std::string info_header = "[INFO]: ";
+  Logger::instance().reset();
+  Config::set("log_level", "1");
+  GIVEN("A logger with a big enough buffer")
+    {
+      Config::set("log_buffer_size", "100");
+      IoTester<std::ostream> out(std::cout);
+      log_info("in", "fo");
+      log_debug("debug");
+      const auto line = __LINE__ - 2;
+      Logger::instance().reset();
+      THEN("the lines are written by the writer thread")
+        CHECK(out.str() == info_header + "tests/logger.cpp:" + std::to_string(line) + ":\tinfo\n");
+    }
+  GIVEN("A logger with a tiny buffer")
+    {
+      Config::set("log_buffer_size", "1");
+      IoTester<std::ostream> out(std::cout);
+      static constexpr std::size_t number = 1000;
+      for (std::size_t i = 0; i < number; ++i)
+        log_info("line ", i);
+      const auto dropped = Logger::instance()->get_dropped_lines();
+      Logger::instance().reset();
+      THEN("each line is either written or counted as dropped")
+        {
+          std::size_t written = 0;
+          std::istringstream is(out.str());
+          std::string line;
+          while (std::getline(is, line))
+            if (line.find("log lines dropped") == std::string::npos)
+              written++;
+          CHECK(written + dropped == number);
+        }
+    }
+  Config::set("log_buffer_size", "0");
+  Logger::instance().reset();
+}
+
+namespace
+{
+/**
+ * The ids of all the threads of this process
+ */
+std::set<std::string> get_thread_ids()
+{
+  std::set<std::string> res;
+  DIR* dir = ::opendir("/proc/self/task");
+  if (!dir)
+    return res;
+  while (const struct dirent* entry = ::readdir(dir))
+    if (entry->d_name[0] != '.')
+      res.insert(entry->d_name);
+  ::closedir(dir);
+  return res;
+}
+
+/**
+ * The signals blocked by that thread, as displayed by the kernel
+ */
+unsigned long long get_blocked_signals(const std::string& tid)
+{
+  std::ifstream status("/proc/self/task/" + tid + "/status");
+  std::string line;
+  while (std::getline(status, line))
+    if (line.compare(0, 7, "SigBlk:") == 0)
+      return std::stoull(line.substr(7), nullptr, 16);
+  return 0;
+}
+}
+
+TEST_CASE("The log writer thread blocks the signals")
+{
+  // Even if the calling thread does not block them yet, as it happens
+  // when a line is logged before the signals are set up
+  sigset_t mask;
+  ::sigemptyset(&mask);
+  ::sigaddset(&mask, SIGINT);
+  ::sigaddset(&mask, SIGUSR1);
+  ::pthread_sigmask(SIG_UNBLOCK, &mask, nullptr);
+
+  Logger::instance().reset();
+  Config::set("log_buffer_size", "10");
+  const auto threads_before = get_thread_ids();
+  IoTester<std::ostream> out(std::cout);
+  log_error("start the writer thread");
+  std::vector<std::string> new_threads;
+  for (const auto& tid: get_thread_ids())
+    if (threads_before.count(tid) == 0)
+      new_threads.push_back(tid);
+  REQUIRE(new_threads.size() == 1);
+  const auto blocked = get_blocked_signals(new_threads[0]);
+  for (const int signum: {SIGINT, SIGTERM, SIGUSR1, SIGHUP})
+    CHECK((blocked & (1ULL << (signum - 1))) != 0);
+
+  // The mask of the calling thread is left untouched
+  sigset_t current;
+  ::pthread_sigmask(SIG_SETMASK, nullptr, &current);
+  CHECK(::sigismember(&current, SIGINT) == 0);
+  CHECK(::sigismember(&current, SIGUSR1) == 0);
+
+  Config::set("log_buffer_size", "0");
+  Logger::instance().reset();
+}
@@ -0,0 +1,77 @@
+#include "catch.hpp"
+
+#include <irc/netsplit_buffer.hpp>
+
+TEST_CASE("Netsplit quit messages")
+{
+  CHECK(NetsplitBuffer::is_netsplit_message("irc.example.com irc.example.org"));
+  CHECK(NetsplitBuffer::is_netsplit_message("*.net *.split"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message("irc.example.com irc.example.com"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message("Quit: bye"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message("Leaving now"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message("see you. later"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message("irc.example.com irc.example.org bye"));
+  CHECK_FALSE(NetsplitBuffer::is_netsplit_message(""));
+}
+
+TEST_CASE("Netsplit departures buffer")
+{
+  IrcUserTable table;
+  IrcUserModeRanks ranks;
+  ranks.set("ov", "@+");
+  NetsplitBuffer buffer;
+
+  buffer.add("#a", {table.get("first", "host"), IrcUserModes::from_prefixes("@first", ranks)}, "a.net b.net");
+  buffer.add("#b", {table.get("first", "host"), {}}, "a.net b.net");
+  buffer.add("#a", {table.get("second", "host"), {}}, "a.net b.net");
+  CHECK(buffer.size() == 3);
+  // The users are kept, to be sent later
+  CHECK(table.find("first"));
+
+  CHECK_FALSE(buffer.cancel("#c", "first"));
+  CHECK(buffer.cancel("#a", "first"));
+  CHECK_FALSE(buffer.cancel("#a", "first"));
+  CHECK(buffer.has_returned("#a", "first"));
+  CHECK_FALSE(buffer.has_returned("#b", "first"));
+  // The departures of the returned users are kept, to compare their modes
+  // at the end
+  CHECK(buffer.size() == 3);
+
+  auto departures = buffer.take_all();
+  CHECK(buffer.empty());
+  REQUIRE(departures.size() == 3);
+  CHECK(departures[0].channel == "#a");
+  CHECK(departures[0].returned);
+  CHECK(departures[0].user.get_most_significant_mode(ranks) == 'o');
+  CHECK(departures[1].channel == "#b");
+  CHECK(departures[1].user.user->nick == "first");
+  CHECK_FALSE(departures[1].returned);
+  CHECK(departures[2].channel == "#a");
+  CHECK(departures[2].user.user->nick == "second");
+  CHECK(departures[2].message == "a.net b.net");
+
+  departures.clear();
+  CHECK_FALSE(table.find("first"));
+}
+
+TEST_CASE("Netsplit departures of a user leaving twice")
+{
+  IrcUserTable table;
+  IrcUserModeRanks ranks;
+  ranks.set("ov", "@+");
+  NetsplitBuffer buffer;
+
+  buffer.add("#a", {table.get("nick", "host"), IrcUserModes::from_prefixes("@nick", ranks)}, "a.net b.net");
+  CHECK(buffer.cancel("#a", "nick"));
+  // It came back without its modes, and left again before getting them
+  buffer.add("#a", {table.get("nick", "host"), {}}, "a.net c.net");
+  CHECK_FALSE(buffer.has_returned("#a", "nick"));
+  CHECK(buffer.size() == 1);
+
+  const auto departures = buffer.take_all();
+  REQUIRE(departures.size() == 1);
+  CHECK_FALSE(departures[0].returned);
+  CHECK(departures[0].message == "a.net c.net");
+  // The XMPP users still know it as a moderator
+  CHECK(departures[0].user.get_most_significant_mode(ranks) == 'o');
+}
@@ -1,6 +1,18 @@
 #include "catch.hpp"
 #include <network/tls_policy.hpp>
+#include <network/poller.hpp>
+#include <network/tcp_socket_handler.hpp>
+#include <network/tcp_client_socket_handler.hpp>
+#include <config/config.hpp>
 #include <sstream>
+#include <vector>
+#include <climits>
+
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <arpa/inet.h>
+#include <unistd.h>
+#include <fcntl.h>
 
 #ifdef BOTAN_FOUND
 TEST_CASE("tls_policy")
@@ -43,3 +55,265 @@ TEST_CASE("tls_policy")
     }
 }
 #endif
+
+class DummySocketHandler: public SocketHandler
+{
+public:
+  DummySocketHandler(std::shared_ptr<Poller>& poller, const socket_t socket):
+    SocketHandler(poller, socket)
+  {}
+  bool is_connected() const override final
+  { return true; }
+  void on_send() override final
+  {
+    this->send_events++;
+    this->poller->stop_watching_send_events(this);
+  }
+  int send_events{0};
+};
+
+TEST_CASE("poller_send_events")
+{
+  int fds[2];
+  REQUIRE(::socketpair(AF_UNIX, SOCK_STREAM, 0, fds) == 0);
+  auto poller = std::make_shared<Poller>();
+  DummySocketHandler handler(poller, fds[0]);
+
+  poller->add_socket_handler(&handler);
+  CHECK(!handler.is_watching_send_events());
+  poller->watch_send_events(&handler);
+  CHECK(handler.is_watching_send_events());
+  poller->watch_send_events(&handler);
+  CHECK(handler.is_watching_send_events());
+  poller->stop_watching_send_events(&handler);
+  CHECK(!handler.is_watching_send_events());
+  poller->watch_send_events(&handler);
+  poller->remove_socket_handler(fds[0]);
+  CHECK(!handler.is_watching_send_events());
+
+  ::close(fds[0]);
+  ::close(fds[1]);
+}
+
+TEST_CASE("poller_many_sockets")
+{
+  static constexpr std::size_t number = 256;
+  auto poller = std::make_shared<Poller>();
+  std::vector<int> peers;
+  std::vector<std::unique_ptr<DummySocketHandler>> handlers;
+  for (std::size_t i = 0; i < number; ++i)
+    {
+      int fds[2];
+      REQUIRE(::socketpair(AF_UNIX, SOCK_STREAM, 0, fds) == 0);
+      peers.push_back(fds[1]);
+      handlers.push_back(std::make_unique<DummySocketHandler>(poller, fds[0]));
+      poller->add_socket_handler(handlers.back().get());
+    }
+  CHECK(poller->size() == number);
+
+  // Remove every other socket, in no particular order
+  for (std::size_t i = 0; i < number; i += 2)
+    poller->remove_socket_handler(handlers[i]->get_socket());
+  CHECK(poller->size() == number / 2);
+
+  for (std::size_t i = 1; i < number; i += 2)
+    poller->watch_send_events(handlers[i].get());
+
+  int total = 0;
+  for (std::size_t tries = 0; tries < number && total < static_cast<int>(number / 2); ++tries)
+    {
+      poller->poll(std::chrono::milliseconds(100));
+      total = 0;
+      for (const auto& handler: handlers)
+        total += handler->send_events;
+    }
+  for (std::size_t i = 0; i < number; ++i)
+    CHECK(handlers[i]->send_events == (i % 2 ? 1 : 0));
+
+  for (std::size_t i = 1; i < number; i += 2)
+    poller->remove_socket_handler(handlers[i]->get_socket());
+  CHECK(poller->size() == 0);
+  for (std::size_t i = 0; i < number; ++i)
+    {
+      ::close(handlers[i]->get_socket());
+      ::close(peers[i]);
+    }
+}
+
+class DummyTCPSocketHandler: public TCPSocketHandler
+{
+public:
+  DummyTCPSocketHandler(std::shared_ptr<Poller>& poller, const socket_t socket):
+    TCPSocketHandler(poller)
+  {
+    this->socket = socket;
+  }
+  ~DummyTCPSocketHandler() = default;
+  bool is_connected() const override final
+  { return this->socket != -1; }
+  bool is_connecting() const override final
+  { return false; }
+  void parse_in_buffer(const size_t) override final
+  {
+    this->received += this->in_buf.size();
+    this->consume_in_buffer(this->in_buf.size());
+  }
+  std::size_t get_read_size() const override final
+  { return read_size; }
+  static constexpr std::size_t read_size = 512;
+  static constexpr std::size_t max_reads = max_reads_per_event;
+  std::size_t received{0};
+};
+
+TEST_CASE("tcp_socket_handler_recv_drain")
+{
+  int fds[2];
+  REQUIRE(::socketpair(AF_UNIX, SOCK_STREAM, 0, fds) == 0);
+  auto poller = std::make_shared<Poller>();
+  DummyTCPSocketHandler handler(poller, fds[0]);
+  poller->add_socket_handler(&handler);
+
+  const std::size_t available = DummyTCPSocketHandler::read_size * (DummyTCPSocketHandler::max_reads + 2);
+  const std::string data(available, 'a');
+  REQUIRE(::write(fds[1], data.data(), data.size()) == static_cast<ssize_t>(data.size()));
+
+  // A single event reads no more than its budget
+  handler.on_recv();
+  CHECK(handler.received == DummyTCPSocketHandler::read_size * DummyTCPSocketHandler::max_reads);
+  // The next one reads the rest, and stops when nothing is left
+  handler.on_recv();
+  CHECK(handler.received == available);
+  // Nothing to read is not an error
+  handler.on_recv();
+  CHECK(handler.received == available);
+  CHECK(handler.is_connected());
+
+  ::close(fds[1]);
+  handler.on_recv();
+  CHECK(!handler.is_connected());
+}
+
+TEST_CASE("tcp_socket_handler_sends_more_than_iov_max_strings")
+{
+  int fds[2];
+  REQUIRE(::socketpair(AF_UNIX, SOCK_STREAM, 0, fds) == 0);
+  auto poller = std::make_shared<Poller>();
+  DummyTCPSocketHandler handler(poller, fds[0]);
+  poller->add_socket_handler(&handler);
+
+  const std::size_t number = IOV_MAX * 2 + 10;
+  for (std::size_t i = 0; i < number; ++i)
+    handler.send_data("ab");
+  // A single send event writes them all, in several calls
+  handler.on_send();
+  CHECK(!handler.is_watching_send_events());
+  std::string received(number * 2 + 1, '\0');
+  CHECK(::recv(fds[1], &received[0], received.size(), MSG_DONTWAIT) == static_cast<ssize_t>(number * 2));
+
+  ::close(fds[1]);
+}
+
+TEST_CASE("poller_receives_and_sends_data")
+{
+  // With io_uring, the poller reads the data itself and writes it without
+  // waiting for a send event.  Its epoll fallback behaves the same way.
+  for (const std::string use_io_uring: {"true", "false"})
+    {
+      Config::set("io_uring", use_io_uring, false);
+      int fds[2];
+      REQUIRE(::socketpair(AF_UNIX, SOCK_STREAM, 0, fds) == 0);
+      REQUIRE(::fcntl(fds[1], F_SETFL, O_NONBLOCK) == 0);
+      auto poller = std::make_shared<Poller>();
+      if (use_io_uring == "false")
+        CHECK(!poller->is_using_io_uring());
+      DummyTCPSocketHandler handler(poller, fds[0]);
+      poller->add_socket_handler(&handler);
+
+      // Much more than the buffers used by the io_uring poller
+      const std::string data(4 * 1024 * 1024, 'a');
+      std::size_t written = 0;
+      for (int i = 0; i < 10000 && handler.received < data.size(); ++i)
+        {
+          const ssize_t res = ::write(fds[1], data.data() + written, data.size() - written);
+          if (res > 0)
+            written += static_cast<std::size_t>(res);
+          poller->poll(std::chrono::milliseconds(10));
+        }
+      CHECK(handler.received == data.size());
+
+      handler.send_data(std::string(1024 * 1024, 'b'));
+      char buf[65536];
+      std::size_t received = 0;
+      for (int i = 0; i < 10000 && received < 1024 * 1024; ++i)
+        {
+          poller->poll(std::chrono::milliseconds(10));
+          ssize_t res;
+          while ((res = ::read(fds[1], buf, sizeof(buf))) > 0)
+            received += static_cast<std::size_t>(res);
+        }
+      CHECK(received == 1024 * 1024);
+      CHECK(!handler.is_watching_send_events());
+
+      ::close(fds[1]);
+      for (int i = 0; i < 100 && handler.is_connected(); ++i)
+        poller->poll(std::chrono::milliseconds(10));
+      CHECK(!handler.is_connected());
+    }
+  Config::set("io_uring", "", false);
+}
+
+class DummyTCPClientSocketHandler: public TCPClientSocketHandler
+{
+public:
+  DummyTCPClientSocketHandler(std::shared_ptr<Poller>& poller):
+    TCPClientSocketHandler(poller)
+  {}
+  void on_connected() override final {}
+  void parse_in_buffer(const size_t) override final {}
+};
+
+class OtherTCPClientSocketHandler: public TCPClientSocketHandler
+{
+public:
+  OtherTCPClientSocketHandler(std::shared_ptr<Poller>& poller):
+    TCPClientSocketHandler(poller)
+  {}
+  void on_connected() override final {}
+  void parse_in_buffer(const size_t) override final {}
+};
+
+TEST_CASE("tcp_client_socket_handler_ports_index")
+{
+  const int server = ::socket(AF_INET, SOCK_STREAM, 0);
+  REQUIRE(server != -1);
+  struct sockaddr_in addr{};
+  addr.sin_family = AF_INET;
+  addr.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+  socklen_t addr_len = sizeof(addr);
+  REQUIRE(::bind(server, reinterpret_cast<struct sockaddr*>(&addr), addr_len) == 0);
+  REQUIRE(::listen(server, 1) == 0);
+  REQUIRE(::getsockname(server, reinterpret_cast<struct sockaddr*>(&addr), &addr_len) == 0);
+  const auto remote_port = ntohs(addr.sin_port);
+
+  auto poller = std::make_shared<Poller>();
+  DummyTCPClientSocketHandler client(poller);
+  client.connect("127.0.0.1", std::to_string(remote_port), false);
+  for (int i = 0; i < 100 && !client.is_connected(); ++i)
+    poller->poll(std::chrono::milliseconds(10));
+  REQUIRE(client.is_connected());
+
+  const int accepted = ::accept(server, reinterpret_cast<struct sockaddr*>(&addr), &addr_len);
+  REQUIRE(accepted != -1);
+  const auto local_port = ntohs(addr.sin_port);
+
+  CHECK(TCPClientSocketHandler::find_by_ports<TCPClientSocketHandler>(local_port, remote_port) == &client);
+  CHECK(TCPClientSocketHandler::find_by_ports<DummyTCPClientSocketHandler>(local_port, remote_port) == &client);
+  CHECK(TCPClientSocketHandler::find_by_ports<TCPClientSocketHandler>(remote_port, local_port) == nullptr);
+  // Only the handlers of the requested type are returned
+  CHECK(TCPClientSocketHandler::find_by_ports<OtherTCPClientSocketHandler>(local_port, remote_port) == nullptr);
+  client.close();
+  CHECK(TCPClientSocketHandler::find_by_ports<TCPClientSocketHandler>(local_port, remote_port) == nullptr);
+
+  ::close(accepted);
+  ::close(server);
+}
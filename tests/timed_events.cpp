@@ -59,3 +59,39 @@ TEST_CASE("Test timed event cancellation")
   CHECK(TimedEventsManager::instance().cancel("deux") == 2);
   CHECK(TimedEventsManager::instance().get_timeout() == utils::no_timeout);
 }
+
+#include <utils/tokens_bucket.hpp>
+
+TEST_CASE("Tokens bucket")
+{
+  int called = 0;
+  TokensBucket bucket(2, 50ms, [&called]() { called++; }, "test_bucket");
+  CHECK(bucket.use_token());
+  CHECK(bucket.use_token());
+  CHECK_FALSE(bucket.use_token());
+
+  // Nothing is scheduled until someone waits for a token
+  CHECK(TimedEventsManager::instance().size() == 0);
+  bucket.wait_for_token();
+  bucket.wait_for_token();
+  CHECK(TimedEventsManager::instance().size() == 1);
+  CHECK(TimedEventsManager::instance().execute_expired_events() == 0);
+  std::this_thread::sleep_for(60ms);
+  CHECK(TimedEventsManager::instance().execute_expired_events() == 1);
+  CHECK(called == 1);
+  CHECK(bucket.use_token());
+  CHECK_FALSE(bucket.use_token());
+
+  // The tokens are gained back while the bucket is not used, up to its limit
+  std::this_thread::sleep_for(160ms);
+  CHECK(bucket.get_tokens() == 2);
+
+  // A limit of 0 still gains one token at a time
+  bucket.set_limit(0);
+  CHECK(bucket.get_tokens() == 1);
+
+  bucket.set_limit(-1);
+  for (int i = 0; i < 10; ++i)
+    CHECK(bucket.use_token());
+  CHECK(TimedEventsManager::instance().size() == 0);
+}
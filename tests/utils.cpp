@@ -12,6 +12,7 @@
 #include <utils/scopeguard.hpp>
 #include <utils/dirname.hpp>
 #include <utils/is_one_of.hpp>
+#include <utils/ring_buffer.hpp>
 
 using namespace std::string_literals;
 
@@ -183,3 +184,22 @@ TEST_CASE("is_in")
   CHECK((is_one_of<bool, bool>) == true);
   CHECK((is_one_of<bool, bool, bool, bool, bool, int>) == true);
 }
+
+TEST_CASE("ring buffer")
+{
+  utils::RingBuffer<std::string> queue(2);
+  std::string value;
+  CHECK(queue.empty());
+  CHECK(!queue.pop(value));
+  CHECK(queue.push("a"));
+  CHECK(queue.push("b"));
+  CHECK(!queue.push("c"));
+  CHECK(queue.pop(value));
+  CHECK(value == "a");
+  CHECK(queue.push("d"));
+  CHECK(queue.pop(value));
+  CHECK(value == "b");
+  CHECK(queue.pop(value));
+  CHECK(value == "d");
+  CHECK(queue.empty());
+}
@@ -2,6 +2,12 @@
 
 #include <xmpp/xmpp_parser.hpp>
 #include <xmpp/auth.hpp>
+#include <xmpp/xmpp_component.hpp>
+#include <network/poller.hpp>
+#include <config/config.hpp>
+#include <utils/timed_events.hpp>
+
+#include <algorithm>
 
 TEST_CASE("Test basic XML parsing")
 {
@@ -42,6 +48,84 @@ TEST_CASE("Test basic XML parsing")
   xml.feed(doc2.data(), static_cast<int>(doc.size()), true);
 }
 
+TEST_CASE("XML parsing reuses the nodes of the previous stanzas")
+{
+  XmppParser xml;
+  std::vector<std::string> stanzas;
+  xml.add_stanza_callback([&stanzas](const Stanza& stanza)
+      {
+        stanzas.push_back(stanza.to_string());
+      });
+  const std::string doc = "<stream xmlns='s'>"
+      "<message to='a' id='1'><body>hello</body><x xmlns='x_ns' c='d'/></message>"
+      "<presence from='b'/>"
+      "<iq><query xmlns='q'><item/></query></iq>"
+      "</stream>";
+  xml.feed(doc.data(), static_cast<int>(doc.size()), true);
+  REQUIRE(stanzas.size() == 3);
+  CHECK(stanzas[0] == "<message id='1' to='a' xmlns='s'><body xmlns='s'>hello</body><x c='d' xmlns='x_ns'/></message>");
+  CHECK(stanzas[1] == "<presence from='b' xmlns='s'/>");
+  CHECK(stanzas[2] == "<iq xmlns='s'><query xmlns='q'><item xmlns='q'/></query></iq>");
+}
+
+TEST_CASE("Released nodes are cleared, and the huge ones are not kept")
+{
+  XmlNode root("root");
+  {
+    XmlSubNode small(root, "small");
+    small["id"] = "secret";
+    small.set_inner("some content");
+    small.set_tail("some tail");
+  }
+  {
+    XmlSubNode big(root, "big");
+    big.set_inner(std::string(1 << 20, 'a'));
+  }
+  std::vector<std::unique_ptr<XmlNode>> pool;
+  root.release_children(pool, 10);
+  CHECK(!root.has_children());
+  REQUIRE(pool.size() == 1);
+  CHECK(pool[0]->get_parent() == nullptr);
+  CHECK(pool[0]->get_name() == "small");
+  CHECK(pool[0]->get_tag("id").empty());
+  CHECK(pool[0]->get_inner().empty());
+  CHECK(pool[0]->get_tail().empty());
+}
+
+TEST_CASE("Child lookup with known and unknown names")
+{
+  Stanza message("message");
+  message["xmlns"] = COMPONENT_NS;
+  {
+    XmlSubNode body(message, "body");
+    body["xmlns"] = COMPONENT_NS;
+  }
+  {
+    XmlSubNode x(message, "x");
+    x["xmlns"] = "some:unknown:namespace";
+  }
+  {
+    XmlSubNode unknown(message, "unknown-element");
+    unknown["xmlns"] = MUC_USER_NS;
+  }
+  CHECK(message.get_child("body", COMPONENT_NS) != nullptr);
+  CHECK(message.get_child("body", MUC_USER_NS) == nullptr);
+  CHECK(message.get_child("body", "some:unknown:namespace") == nullptr);
+  CHECK(message.get_child("x", "some:unknown:namespace") != nullptr);
+  CHECK(message.get_child("x", MUC_USER_NS) == nullptr);
+  CHECK(message.get_child("unknown-element", MUC_USER_NS) != nullptr);
+  CHECK(message.get_child("unknown-element", COMPONENT_NS) == nullptr);
+  CHECK(message.get_children("body", COMPONENT_NS).size() == 1);
+
+  // Changing the namespace of a node after a lookup
+  XmlNode* subject = message.add_child(Stanza("subject"));
+  (*subject)["xmlns"] = COMPONENT_NS;
+  CHECK(message.get_child("subject", COMPONENT_NS) == subject);
+  (*subject)["xmlns"] = MUC_USER_NS;
+  CHECK(message.get_child("subject", COMPONENT_NS) == nullptr);
+  CHECK(message.get_child("subject", MUC_USER_NS) == subject);
+}
+
 TEST_CASE("XML escape")
 {
   const std::string unescaped = R"('coucou'<cc>/&"gaga")";
@@ -70,3 +154,95 @@ TEST_CASE("substanzas")
   }
   CHECK(a.has_children());
 }
+
+namespace
+{
+class TestComponent: public XmppComponent
+{
+public:
+  TestComponent(std::shared_ptr<Poller>& poller):
+    XmppComponent(poller, "biboumi.localhost", "secret")
+  {
+    this->stanza_handlers.emplace("message", [this](const Stanza& stanza)
+    {
+      this->received.push_back(stanza.get_tag("id"));
+    });
+  }
+  std::vector<std::string> received;
+};
+}
+
+TEST_CASE("Pool of component streams")
+{
+  Config::set("component_connections", "3", false);
+  auto poller = std::make_shared<Poller>();
+  TestComponent component(poller);
+  Config::set("component_connections", "1", false);
+
+  const auto streams = component.get_streams();
+  REQUIRE(streams.size() == 3);
+  CHECK(streams[0] == &component);
+
+  // All the stanzas of one user go to the same stream, whatever the resource
+  std::string jid;
+  for (auto i = 0; i < 100 && jid.empty(); ++i)
+    {
+      const std::string candidate = "user" + std::to_string(i) + "@example.com";
+      if (&component.get_stream_for(candidate) != &component)
+        jid = candidate;
+    }
+  REQUIRE(!jid.empty());
+  XmppComponent& stream = component.get_stream_for(jid);
+  CHECK(&component.get_stream_for(jid + "/resource") == &stream);
+  CHECK(&component.get_stream_for("") == &component);
+
+  // Until that stream is authenticated, its stanzas wait for it, instead of
+  // going through another stream
+  for (const auto& id: {"1", "2"})
+    {
+      Stanza message("message");
+      message["to"] = jid + "/resource";
+      message["id"] = id;
+      component.send_stanza(message);
+    }
+  CHECK(stream.get_pending_stanzas().size() == 2);
+  CHECK(stream.get_pending_stanzas()[0].find("id='1'") != std::string::npos);
+  const auto index = std::find(streams.begin(), streams.end(), &stream) - streams.begin();
+  const std::string event_name = "XMPP pending stanzas " + std::to_string(index);
+  CHECK(TimedEventsManager::instance().find_event(event_name) != nullptr);
+  stream.handle_handshake(Stanza("handshake"));
+  CHECK(stream.get_pending_stanzas().empty());
+  CHECK(TimedEventsManager::instance().find_event(event_name) == nullptr);
+
+  // If the stream stays down for too long, its stanzas go through the main
+  // stream, and so do the following ones, to keep them in order
+  stream.on_connection_close("");
+  Stanza late("message");
+  late["to"] = jid;
+  component.send_stanza(late);
+  CHECK(stream.get_pending_stanzas().size() == 1);
+  stream.send_pending_stanzas_on_main_stream();
+  CHECK(stream.get_pending_stanzas().empty());
+  CHECK(TimedEventsManager::instance().find_event(event_name) == nullptr);
+  component.send_stanza(late);
+  CHECK(stream.get_pending_stanzas().empty());
+  stream.handle_handshake(Stanza("handshake"));
+
+  // The number of pending stanzas is bounded
+  stream.on_connection_close("");
+  for (auto i = 0; i < 1000; ++i)
+    component.send_stanza(late);
+  CHECK(stream.get_pending_stanzas().empty());
+  component.send_stanza(late);
+  CHECK(stream.get_pending_stanzas().empty());
+  stream.handle_handshake(Stanza("handshake"));
+  component.send_stanza(late);
+  CHECK(stream.get_pending_stanzas().empty());
+
+  // The stanzas received on any stream are handled by the main one
+  Stanza received("message");
+  received["id"] = "in";
+  stream.on_stanza(received);
+  REQUIRE(component.received.size() == 1);
+  CHECK(component.received[0] == "in");
+}